@@ -0,0 +1,104 @@
+"""
+Benchmark: /ws requests per second as the CPU pool grows.
+
+Starts the real app under uvicorn once per pool configuration (in a scratch
+working directory so results are not written into resultjson/), points it at
+the local stub model server and drives it with concurrent WebSocket clients
+uploading full-size invoice scans. The stub reports "medium" readability so
+every upload also runs the OpenCV enhancement path.
+
+Run from backend/:   python -m benchmarks.bench_cpu_pool
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import websockets
+
+from benchmarks.harness import make_sample_invoice_image
+from benchmarks.stub_model_server import start_stub_server
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        with socket.socket() as sock:
+            if sock.connect_ex(("127.0.0.1", port)) == 0:
+                return
+        time.sleep(0.1)
+    raise RuntimeError(f"App did not start on port {port}")
+
+
+def start_app(port, pool_kind, workers, base_url, workdir):
+    env = dict(os.environ,
+               OPENAI_API_KEY="stub", OPENAI_BASE_URL=base_url,
+               CPU_POOL_KIND=pool_kind, CPU_POOL_WORKERS=str(workers),
+               EXTRACTION_CACHE_BACKEND="off", PYTHONPATH=BACKEND_DIR)
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    wait_for_port(port)
+    return process
+
+
+async def upload(url, filename, data):
+    async with websockets.connect(url, max_size=None) as ws:
+        await ws.send(filename)
+        await ws.send(data)
+        async for message in ws:
+            if "processed successfully" in message:
+                return True
+    return False
+
+
+async def drive(url, data, clients, uploads_per_client):
+    async def client():
+        ok = 0
+        for _ in range(uploads_per_client):
+            ok += await upload(url, "bench.jpg", data)
+        return ok
+
+    start = time.perf_counter()
+    done = sum(await asyncio.gather(*[client() for _ in range(clients)]))
+    return done, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pool-sizes", default="1,2,4")
+    parser.add_argument("--kinds", default="thread,process")
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--uploads", type=int, default=3, help="uploads per client")
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--port", type=int, default=8100)
+    args = parser.parse_args()
+
+    server, base_url = start_stub_server(port=8003, latency=args.latency, readability="medium")
+    data = make_sample_invoice_image()
+    print(f"{'pool':8} {'workers':>7} {'uploads':>8} {'seconds':>8} {'req/s':>7}")
+    try:
+        for kind in args.kinds.split(","):
+            for workers in [int(n) for n in args.pool_sizes.split(",")]:
+                with tempfile.TemporaryDirectory() as workdir:
+                    app = start_app(args.port, kind, workers, base_url, workdir)
+                    try:
+                        done, elapsed = asyncio.run(drive(f"ws://127.0.0.1:{args.port}/ws", data,
+                                                          args.clients, args.uploads))
+                    finally:
+                        app.terminate()
+                        app.wait()
+                print(f"{kind:8} {workers:7d} {done:8d} {elapsed:8.2f} {done / elapsed:7.2f}")
+    finally:
+        server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Fuzz + benchmark: repairing truncated model output.
+
+Builds a corpus from the saved extractions in resultjson/ (one document per
+image or PDF page), serialises each the way the model writes it (pretty,
+compact and inside a ```json fence) and truncates it at many points, as a
+max_tokens cut-off would. For every truncation the repaired text must parse
+(unless the cut falls inside the leading fence) and its line items must be
+exactly the items completed before the cut, in order. The legacy
+quote/brace-counting repair is run on the same inputs for comparison.
+
+Run from backend/:   python -m benchmarks.bench_json_repair
+"""
+import argparse
+import glob
+import json
+import os
+import random
+import time
+
+from json_stream import JsonSectionStream, repair_truncated_json
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_GLOB = os.path.join(BACKEND_DIR, 'resultjson', 'invoice_*.json')
+
+
+def legacy_clean_json_response(content):
+    """The previous clean_json_response, kept here as the comparison baseline"""
+    content = content.strip()
+    if content.startswith('```json'):
+        content = content[7:]
+    elif content.startswith('```'):
+        content = content[3:]
+    if content.endswith('```'):
+        content = content[:-3]
+    content = content.strip()
+    if not content.endswith('}'):
+        content = content.rstrip(',\n\r\t ')
+        if content.count('"') % 2 == 1:
+            content += '"'
+        open_braces = content.count('{') - content.count('}')
+        open_brackets = content.count('[') - content.count(']')
+        if open_brackets > 0:
+            content += ']' * open_brackets
+        if open_braces > 0:
+            content += '}' * open_braces
+    return content
+
+
+def load_corpus(pattern=RESULTS_GLOB):
+    """Per-page extraction dicts from the saved results"""
+    documents = []
+    for path in sorted(glob.glob(pattern)):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f).get('extraction_data', {})
+        for page in data.get('page_by_page_results') or [data]:
+            page = {key: value for key, value in page.items() if key != 'page_info'}
+            if page.get('line_items'):
+                documents.append(page)
+    return documents
+
+
+def serialisations(document):
+    pretty = json.dumps(document, indent=2, ensure_ascii=False)
+    yield 'pretty', pretty
+    yield 'compact', json.dumps(document, ensure_ascii=False)
+    yield 'fenced', f"```json\n{pretty}\n```"
+
+
+def complete_items(prefix):
+    """Line items whose closing brace is inside the prefix"""
+    return sum(1 for section, index, _ in JsonSectionStream().feed(prefix)
+               if section == 'line_items' and index is not None)
+
+
+def run_case(repair, prefix, document):
+    """Return (parsed ok, line items salvaged, seconds)"""
+    start = time.perf_counter()
+    repaired = repair(prefix)
+    elapsed = time.perf_counter() - start
+    try:
+        parsed = json.loads(repaired)
+    except json.JSONDecodeError:
+        # Only a cut-off inside the leading fence leaves nothing to salvage
+        assert repair is not repair_truncated_json or '{' not in prefix, f"unparseable repair: ...{prefix[-80:]!r}"
+        return False, 0, elapsed
+    items = parsed.get('line_items', []) if isinstance(parsed, dict) else []
+    if repair is repair_truncated_json:
+        expected = document['line_items'][:complete_items(prefix)]
+        assert items == expected, f"salvaged {len(items)} items, expected {len(expected)}: ...{prefix[-80:]!r}"
+    return True, len(items) if isinstance(items, list) else 0, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--cuts", type=int, default=200, help="random truncation points per serialisation")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    documents = load_corpus()
+    if not documents:
+        raise SystemExit(f"No saved extractions with line items found under {RESULTS_GLOB}")
+
+    repairs = {'legacy': legacy_clean_json_response, 'stack': repair_truncated_json}
+    stats = {name: {'ok': 0, 'items': 0, 'seconds': 0.0} for name in repairs}
+    cases = available_items = 0
+    for document in documents:
+        for _, text in serialisations(document):
+            for cut in [rng.randint(1, len(text)) for _ in range(args.cuts)] + [len(text)]:
+                prefix = text[:cut]
+                cases += 1
+                available_items += complete_items(prefix)
+                for name, repair in repairs.items():
+                    ok, items, seconds = run_case(repair, prefix, document)
+                    stats[name]['ok'] += ok
+                    stats[name]['items'] += items
+                    stats[name]['seconds'] += seconds
+
+    print(f"{len(documents)} documents, {cases} truncated responses, {available_items} complete line items in them")
+    print(f"{'repair':8} {'parses':>8} {'items kept':>11} {'us/call':>8}")
+    for name, s in stats.items():
+        print(f"{name:8} {s['ok'] / cases:8.1%} {s['items'] / max(available_items, 1):11.1%} "
+              f"{s['seconds'] * 1e6 / cases:8.1f}")
+
+
+if __name__ == "__main__":
+    main()
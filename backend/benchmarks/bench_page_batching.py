@@ -0,0 +1,88 @@
+"""
+Benchmark: tokens, cost and latency per page when packing pages into one request.
+
+Renders a synthetic scanned PDF and extracts it with batch sizes 1, 2, 4 and 8
+against the local stub model server. The stub counts prompt tokens from the
+prompt text and image tiles, and simulates generation time per output token,
+so the shared ~4 KB prompt and the per-request round trip are what batching
+saves. Extraction accuracy cannot be judged against the stub; compare batched
+and single-page results from the real model before raising PAGE_BATCH_SIZE.
+
+Run from backend/:   python -m benchmarks.bench_page_batching
+"""
+import argparse
+import asyncio
+import time
+
+from openai import AsyncOpenAI
+
+from benchmarks.harness import NullWebSocket, make_sample_invoice_pdf
+from benchmarks.stub_model_server import start_stub_server
+from gptprocesses import build_extraction_prompt, create_chat_completion, encode_image, try_process_image_batch
+from process import iter_pdf_pages
+
+BATCH_SIZES = [1, 2, 4, 8]
+
+
+async def send_batch(client, images, page_numbers):
+    """Send one request for the given pages and return its usage"""
+    if len(images) == 1:
+        # Batch size 1 is today's single-page request
+        response = await create_chat_completion(
+            client, "stub", build_extraction_prompt('FIRST ATTEMPT - This is the original image.'),
+            encode_image(images[0])
+        )
+        return response.usage
+    _, usage = await try_process_image_batch(client, "stub", images, page_numbers, NullWebSocket())
+    return usage
+
+
+async def run(args, client):
+    pdf_data = make_sample_invoice_pdf(args.pages, args.kind)
+    images = [image for _, image, _ in iter_pdf_pages(pdf_data, use_text_layer=False)]
+    print(f"{len(images)} pages ({args.kind}), stub latency {args.latency}s + {args.token_ms}ms/output token, "
+          f"${args.input_price}/${args.output_price} per 1M input/output tokens")
+    print(f"{'batch':>5} {'requests':>8} {'in tok/pg':>10} {'out tok/pg':>11} {'cost/pg $':>10} "
+          f"{'req ms':>8} {'ms/pg':>7}")
+    for batch_size in BATCH_SIZES:
+        prompt_tokens = completion_tokens = requests = 0
+        request_seconds = 0.0
+        start = time.perf_counter()
+        for first in range(0, len(images), batch_size):
+            chunk = images[first:first + batch_size]
+            request_start = time.perf_counter()
+            usage = await send_batch(client, chunk, list(range(first + 1, first + len(chunk) + 1)))
+            request_seconds += time.perf_counter() - request_start
+            requests += 1
+            prompt_tokens += usage.prompt_tokens
+            completion_tokens += usage.completion_tokens
+        elapsed = time.perf_counter() - start
+        pages = len(images)
+        cost = (prompt_tokens * args.input_price + completion_tokens * args.output_price) / 1_000_000
+        print(f"{batch_size:5d} {requests:8d} {prompt_tokens / pages:10.0f} {completion_tokens / pages:11.0f} "
+              f"{cost / pages:10.4f} {request_seconds * 1000 / requests:8.0f} {elapsed * 1000 / pages:7.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pages", type=int, default=8)
+    parser.add_argument("--kind", default="scanned")
+    parser.add_argument("--latency", type=float, default=1.0, help="stub seconds per request")
+    parser.add_argument("--token-ms", type=float, default=2.0, help="stub milliseconds per output token")
+    parser.add_argument("--input-price", type=float, default=2.50, help="USD per 1M input tokens")
+    parser.add_argument("--output-price", type=float, default=10.00, help="USD per 1M output tokens")
+    parser.add_argument("--port", type=int, default=8004)
+    args = parser.parse_args()
+
+    server, base_url = start_stub_server(port=args.port, latency=args.latency,
+                                         token_latency=args.token_ms / 1000)
+    client = AsyncOpenAI(api_key="stub", base_url=base_url)
+
+    try:
+        asyncio.run(run(args, client))
+    finally:
+        server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""
+Benchmark suite: the whole upload pipeline, offline, for catching regressions.
+
+Runs process_pdf and process_image (the functions the /ws endpoint calls)
+end to end against the local stub model server, which replays the pages of
+the saved results in resultjson/ with --latency seconds per completion.
+Each scenario is a synthetic document:
+
+  pdf:<kind>:<pages>   make_sample_invoice_pdf (digital_dense, digital_sparse,
+                       ledger or scanned), 1-500 pages
+  image:<count>        <count> A4 JPEG uploads, one after the other
+
+and runs in its own process, in a scratch directory (results files and the
+master file are written there, the repo's resultjson/ is not touched), with
+the extraction cache off. Reported per scenario: wall time, pages/s, peak
+RSS, bytes written to disk (/proc/self/io) and left behind in the results
+files, and the slowest stages from the tracing layer (stages nest, so their
+totals add up to more than the wall time).
+
+--save writes the numbers as JSON; --baseline compares against such a file
+and exits with status 1 if a scenario got slower, fatter or wrote more than
+--tolerance allows.
+
+Run from backend/:   python -m benchmarks.bench_pipeline
+                     python -m benchmarks.bench_pipeline --scenarios pdf:scanned:500 --latency 0.5
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_GLOB = os.path.join(BACKEND_DIR, 'resultjson', 'invoice_*.json')
+
+DEFAULT_SCENARIOS = ('pdf:digital_dense:1', 'pdf:digital_dense:10', 'pdf:digital_dense:100',
+                     'pdf:scanned:1', 'pdf:scanned:10', 'image:3')
+MAX_PAGES = 500
+# Compared against the baseline; a higher value is worse for all of them
+REGRESSION_KEYS = ('wall_s', 'peak_rss_mb', 'disk_write_mb')
+# Marks the child's result line among the pipeline's own prints
+RESULT_PREFIX = 'BENCH_RESULT '
+
+
+def parse_scenario(name):
+    """'pdf:<kind>:<pages>' or 'image:<count>' -> (source, kind, pages)"""
+    parts = name.split(':')
+    if parts[0] == 'pdf' and len(parts) == 3:
+        source, kind, pages = parts
+    elif parts[0] == 'image' and len(parts) == 2:
+        source, kind, pages = 'image', 'jpeg', parts[1]
+    else:
+        raise SystemExit(f"Unknown scenario {name!r} (use pdf:<kind>:<pages> or image:<count>)")
+    if not 1 <= int(pages) <= MAX_PAGES:
+        raise SystemExit(f"Scenario {name!r}: pages must be between 1 and {MAX_PAGES}")
+    return source, kind, int(pages)
+
+
+def disk_write_bytes():
+    """Bytes this process has caused to be written to storage so far (0 where /proc is missing)"""
+    try:
+        with open('/proc/self/io', 'r') as f:
+            return int(dict(line.split(': ') for line in f.read().splitlines())['write_bytes'])
+    except (OSError, KeyError, ValueError):
+        return 0
+
+
+def tree_bytes(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+async def run_pipeline(source, kind, pages, client):
+    from benchmarks.harness import NullWebSocket, make_sample_invoice_image, make_sample_invoice_pdf
+    from process import process_image, process_pdf
+
+    if source == 'pdf':
+        uploads = [(make_sample_invoice_pdf(pages, kind), process_pdf, 'bench.pdf')]
+    else:
+        uploads = [(make_sample_invoice_image(), process_image, f'bench_{i}.jpg') for i in range(pages)]
+    websocket = NullWebSocket()
+    write_before = disk_write_bytes()
+    start = time.perf_counter()
+    for data, process, filename in uploads:
+        await process(data, websocket, filename, client, "stub")
+    wall = time.perf_counter() - start
+    failures = sum(1 for message in websocket.messages if isinstance(message, str) and message.startswith('❌'))
+    return wall, disk_write_bytes() - write_before, failures
+
+
+def run_child(args):
+    """Run one scenario in this process (cwd is the scratch directory) and print its numbers"""
+    from openai import AsyncOpenAI
+
+    import tracing
+    from benchmarks.stub_model_server import start_stub_server
+
+    source, kind, pages = parse_scenario(args.child)
+    server, base_url = start_stub_server(port=args.port, latency=args.latency, fixtures=args.fixtures)
+    client = AsyncOpenAI(api_key="stub", base_url=base_url)
+    try:
+        wall, written, failures = asyncio.run(run_pipeline(source, kind, pages, client))
+    finally:
+        server.should_exit = True
+    stages = sorted(tracing.stage_totals().items(), key=lambda item: -item[1][1])
+    result = {
+        'scenario': args.child, 'pages': pages, 'failures': failures,
+        'wall_s': round(wall, 3), 'pages_per_s': round(pages / wall, 3),
+        # ru_maxrss is in KiB on Linux
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'disk_write_mb': round(written / 1e6, 3),
+        'results_mb': round(tree_bytes(os.getcwd()) / 1e6, 3),
+        'stages': {stage: [count, round(total, 3)] for stage, (count, total) in stages},
+    }
+    print(RESULT_PREFIX + json.dumps(result), flush=True)
+
+
+def run_scenario(name, args):
+    """Run one scenario in a fresh interpreter in a scratch directory and return its numbers"""
+    env = dict(os.environ, PYTHONPATH=BACKEND_DIR, EXTRACTION_CACHE_BACKEND='off', TRACE_LOG='0')
+    command = [sys.executable, '-m', 'benchmarks.bench_pipeline', '--child', name, '--port', str(args.port),
+               '--latency', str(args.latency), '--fixtures', args.fixtures]
+    with tempfile.TemporaryDirectory(prefix='bench_pipeline_') as workdir:
+        completed = subprocess.run(command, cwd=workdir, env=env, capture_output=True, text=True)
+    for line in completed.stdout.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    raise SystemExit(f"Scenario {name} failed:\n{completed.stderr[-2000:]}")
+
+
+def regressions(results, baseline, tolerance):
+    """Lines describing every number that got worse than the baseline by more than tolerance"""
+    previous = {result['scenario']: result for result in baseline}
+    found = []
+    for result in results:
+        before = previous.get(result['scenario'])
+        if before is None:
+            continue
+        for key in REGRESSION_KEYS:
+            # Ignore changes too small to measure reliably (a few ms, a few KB)
+            if before[key] > 0.01 and result[key] > before[key] * (1 + tolerance):
+                found.append(f"{result['scenario']}: {key} {before[key]} -> {result[key]}")
+        if result['failures'] > before['failures']:
+            found.append(f"{result['scenario']}: failed pages {before['failures']} -> {result['failures']}")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scenarios", default=','.join(DEFAULT_SCENARIOS),
+                        help="comma-separated pdf:<kind>:<pages> / image:<count>")
+    parser.add_argument("--latency", type=float, default=0.2, help="stub seconds per completion")
+    parser.add_argument("--fixtures", default=RESULTS_GLOB, help="saved results the stub replays")
+    parser.add_argument("--port", type=int, default=8008)
+    parser.add_argument("--stages", type=int, default=6, help="slowest stages shown per scenario")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="results JSON from an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed slowdown/growth (0.15 = 15%%)")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args)
+        return
+
+    names = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    for name in names:
+        parse_scenario(name)
+    print(f"stub latency {args.latency:g}s, replaying {args.fixtures}")
+    print(f"{'scenario':24} {'pages':>5} {'fail':>4} {'wall s':>7} {'pages/s':>8} {'rss MB':>7} "
+          f"{'disk MB':>8} {'files MB':>8}")
+    results = []
+    for name in names:
+        result = run_scenario(name, args)
+        results.append(result)
+        print(f"{name:24} {result['pages']:5d} {result['failures']:4d} {result['wall_s']:7.2f} "
+              f"{result['pages_per_s']:8.2f} {result['peak_rss_mb']:7.1f} {result['disk_write_mb']:8.2f} "
+              f"{result['results_mb']:8.2f}")
+        top = list(result['stages'].items())[:args.stages]
+        print("    " + "  ".join(f"{stage} {total:.2f}s/{count}" for stage, (count, total) in top))
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        for line in found:
+            print(f"REGRESSION {line}")
+        if found:
+            sys.exit(1)
+        print(f"no regressions beyond {args.tolerance:.0%} of {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Benchmark: input tokens per prompt version.
+
+Builds every prompt the pipeline sends (first attempt, enhanced retry, text
+layer, 4-page batch, continuation) with each registered prompt version and
+counts its tokens. Uses tiktoken's o200k_base encoding (GPT-4o) when tiktoken
+is installed, otherwise estimates ~4 characters per token. Image tokens are
+the same for every version and are not included.
+
+Run from backend/:   python -m benchmarks.bench_prompt_tokens
+"""
+import argparse
+import time
+
+import gptprocesses
+from prompts import PROMPTS
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+def token_counter():
+    if tiktoken is None:
+        return (lambda text: len(text) // 4), "~chars/4"
+    encoding = tiktoken.get_encoding("o200k_base")
+    return (lambda text: len(encoding.encode(text))), "o200k_base"
+
+
+def build_prompts():
+    """The prompt of every call type, built with the currently active template"""
+    return {
+        'image': gptprocesses.build_extraction_prompt('FIRST ATTEMPT - This is the original image.'),
+        'enhanced': gptprocesses.build_extraction_prompt('RETRY ATTEMPT - This is a preprocessed image.'),
+        'text_layer': gptprocesses.build_extraction_prompt(
+            'TEXT LAYER - The invoice text below was taken from a digital PDF, not an image.'
+        ),
+        'batch_4': gptprocesses.build_batch_extraction_prompt([1, 2, 3, 4]),
+        'continuation': gptprocesses.build_continuation_prompt(
+            40, {'item_number': '40', 'description': 'Sample item'}, ['financial_summary', 'payment_details']
+        ),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--input-price", type=float, default=2.50, help="USD per 1M input tokens")
+    parser.add_argument("--builds", type=int, default=10000, help="prompt builds timed per version")
+    args = parser.parse_args()
+
+    count, encoding = token_counter()
+    rows = {}
+    for version, template in PROMPTS.items():
+        gptprocesses.ACTIVE_PROMPT = template
+        rows[version] = {kind: count(prompt) for kind, prompt in build_prompts().items()}
+        start = time.perf_counter()
+        for _ in range(args.builds):
+            gptprocesses.build_extraction_prompt('FIRST ATTEMPT - This is the original image.')
+        rows[version]['build us'] = (time.perf_counter() - start) * 1e6 / args.builds
+
+    kinds = list(next(iter(rows.values())))
+    print(f"prompt tokens ({encoding}); cost per 1000 image pages at ${args.input_price}/1M input tokens")
+    print(f"{'version':8} " + " ".join(f"{kind:>12}" for kind in kinds) + f" {'$/1k pages':>11}")
+    for version, row in rows.items():
+        cells = " ".join(f"{row[kind]:12.2f}" if kind == 'build us' else f"{row[kind]:12d}" for kind in kinds)
+        print(f"{version:8} {cells} {row['image'] * 1000 * args.input_price / 1_000_000:11.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Benchmark: pages lost and throughput against a rate-limited model API.
+
+The local stub model server has a quota like the provider's: a burst of
+--limit requests, refilled continuously at --limit per --window seconds;
+requests over it get a 429 with Retry-After.
+--pages extractions are started at once and run through try_process_image
+with different retry settings:
+
+  no retries    one attempt per call (what a bare client does)
+  sdk retries   the OpenAI SDK's own retries (OPENAI_MAX_RETRIES=2, the old default)
+  backoff       ModelScheduler retries only (Retry-After, jittered backoff)
+  scheduler     ModelScheduler with token buckets sized to the quota
+  tpm           scheduler plus a --tpm token budget, each call reserving
+                its prompt plus max_tokens until the answer reports usage
+  tpm streamed  the same with streamed answers, whose usage only arrives
+                in the last chunk
+
+--tpm defaults to a little over what the quota's requests actually use, so
+a call that never gave back the unused part of its reservation would make
+the token budget, not the request quota, the limit.
+
+Reports completed and lost pages, 429s served, and wall time next to the
+fastest the quota allows.
+
+Run from backend/:   python -m benchmarks.bench_rate_limit
+"""
+import argparse
+import asyncio
+import time
+
+from openai import AsyncOpenAI
+
+import gptprocesses
+from benchmarks.harness import NullWebSocket, make_sample_invoice_image
+from benchmarks.stub_model_server import app as stub_app, reset_quota, start_stub_server
+from model_scheduler import ModelCallFailed, ModelScheduler, set_model_scheduler
+
+# Default --tpm per request of quota: the stub's answers use ~2,900 tokens of the ~5,800 reserved
+TOKENS_PER_REQUEST = 3500
+
+
+def modes(args):
+    """name -> (SDK max_retries, scheduler, stream)"""
+    quota_rpm = args.limit * 60 / args.window
+    tpm = args.tpm or quota_rpm * TOKENS_PER_REQUEST
+    return {
+        'no retries': (0, ModelScheduler(rpm=0, tpm=0, max_attempts=1), False),
+        'sdk retries': (2, ModelScheduler(rpm=0, tpm=0, max_attempts=1), False),
+        'backoff': (0, ModelScheduler(rpm=0, tpm=0, deadline=args.deadline), False),
+        'scheduler': (0, ModelScheduler(rpm=quota_rpm, tpm=0, deadline=args.deadline,
+                                        burst_seconds=args.window), False),
+        'tpm': (0, ModelScheduler(rpm=quota_rpm, tpm=tpm, deadline=args.deadline,
+                                  burst_seconds=args.window), False),
+        'tpm streamed': (0, ModelScheduler(rpm=quota_rpm, tpm=tpm, deadline=args.deadline,
+                                           burst_seconds=args.window), True),
+    }
+
+
+async def extract(client, image):
+    try:
+        return await gptprocesses.try_process_image(client, "stub", image, NullWebSocket()) is not None
+    except ModelCallFailed:
+        return False
+
+
+async def run_mode(base_url, max_retries, image, pages):
+    client = AsyncOpenAI(api_key="stub", base_url=base_url, max_retries=max_retries)
+    try:
+        start = time.perf_counter()
+        done = await asyncio.gather(*[extract(client, image) for _ in range(pages)])
+        return sum(done), time.perf_counter() - start
+    finally:
+        await client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pages", type=int, default=30)
+    parser.add_argument("--limit", type=int, default=10, help="requests accepted per window")
+    parser.add_argument("--window", type=float, default=5.0, help="quota window in seconds")
+    parser.add_argument("--latency", type=float, default=0.2, help="stub seconds per completion")
+    parser.add_argument("--deadline", type=float, default=120.0, help="per-call deadline in seconds")
+    parser.add_argument("--tpm", type=float, default=0, help="token quota per minute for the tpm modes")
+    parser.add_argument("--port", type=int, default=8006)
+    args = parser.parse_args()
+
+    server, base_url = start_stub_server(port=args.port, latency=args.latency,
+                                         rate_limit=args.limit, rate_window=args.window)
+    image = make_sample_invoice_image(width=1240, height=1754)
+    quota_rpm = args.limit * 60 / args.window
+    fastest = max(0, args.pages - args.limit) * args.window / args.limit + args.latency
+    print(f"{args.pages} pages at once; quota {args.limit} requests / {args.window:g}s ({quota_rpm:.0f}/min), "
+          f"fastest possible {fastest:.1f}s")
+    print(f"{'mode':12} {'ok':>4} {'lost':>5} {'429s':>5} {'wall s':>7} {'vs fastest':>10} {'quota wait s':>12}")
+    try:
+        for name, (max_retries, scheduler, stream) in modes(args).items():
+            gptprocesses.STREAM_PARTIAL_RESULTS = stream
+            set_model_scheduler(scheduler)
+            reset_quota()
+            ok, wall = asyncio.run(run_mode(base_url, max_retries, image, args.pages))
+            print(f"{name:12} {ok:4d} {args.pages - ok:5d} {stub_app.state.rejected:5d} {wall:7.1f} "
+                  f"{wall / fastest:9.2f}x {scheduler.stats['waited_s']:12.1f}")
+    finally:
+        set_model_scheduler(None)
+        server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
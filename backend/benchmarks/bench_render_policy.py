@@ -0,0 +1,73 @@
+"""
+Benchmark: upload payload size and model latency per render policy.
+
+Renders synthetic PDFs (sparse/dense digital, scanned, ledger) with each
+render policy, then sends every page to the local stub model server with a
+simulated upload bandwidth so payload size shows up in request latency.
+Extraction quality cannot be judged against the stub; run the same pages
+against the real model before changing the default policy.
+
+Run from backend/:   python -m benchmarks.bench_render_policy
+"""
+import argparse
+import asyncio
+import base64
+import time
+from io import BytesIO
+
+from openai import AsyncOpenAI
+from PIL import Image
+
+from benchmarks.harness import NullWebSocket, make_sample_invoice_pdf
+from benchmarks.stub_model_server import start_stub_server
+from gptprocesses import try_process_image
+from process import iter_pdf_pages
+from render_policy import estimate_image_tokens
+
+POLICIES = ["fixed", "adaptive", "low_first"]
+KINDS = ["digital_sparse", "digital_dense", "scanned", "ledger"]
+
+
+async def time_model_calls(client, images):
+    start = time.perf_counter()
+    for image_data in images:
+        await try_process_image(client, "stub", image_data, NullWebSocket())
+    return (time.perf_counter() - start) / max(len(images), 1)
+
+
+async def run(args, client):
+    print(f"{'document':16} {'policy':10} {'px (w x h)':>12} {'payload KB':>11} {'~img tokens':>12} "
+          f"{'render ms':>10} {'call ms':>8}")
+    for kind in KINDS:
+        pdf_data = make_sample_invoice_pdf(args.pages, kind)
+        for policy in POLICIES:
+            start = time.perf_counter()
+            images = [image for _, image, _ in iter_pdf_pages(pdf_data, policy, use_text_layer=False)]
+            render_ms = (time.perf_counter() - start) * 1000 / len(images)
+            width, height = Image.open(BytesIO(images[0])).size
+            payload_kb = sum(len(base64.b64encode(image)) for image in images) / len(images) / 1024
+            call_ms = await time_model_calls(client, images) * 1000
+            print(f"{kind:16} {policy:10} {f'{width}x{height}':>12} {payload_kb:11.0f} "
+                  f"{estimate_image_tokens(width, height):12d} {render_ms:10.0f} {call_ms:8.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pages", type=int, default=2)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--upload-mbps", type=float, default=20.0, help="simulated upload bandwidth in Mbit/s")
+    parser.add_argument("--port", type=int, default=8002)
+    args = parser.parse_args()
+
+    server, base_url = start_stub_server(port=args.port, latency=args.latency,
+                                         upload_bps=args.upload_mbps * 1_000_000 / 8)
+    client = AsyncOpenAI(api_key="stub", base_url=base_url)
+
+    try:
+        asyncio.run(run(args, client))
+    finally:
+        server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
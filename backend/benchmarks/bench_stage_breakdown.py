@@ -0,0 +1,69 @@
+"""
+Benchmark: where the time goes, per pipeline stage, and what tracing costs.
+
+Extracts a synthetic PDF with process_multi_page_pdf against the local stub
+model server and prints the per-stage totals the tracing layer recorded,
+the same numbers /metrics exports. Stages nest (page > extract_with_retry >
+extract_image > model_completion ...), so totals add up to more than the
+wall time. Also times an empty span against a bare block to show the
+per-span overhead.
+
+Run from backend/:   python -m benchmarks.bench_stage_breakdown
+"""
+import argparse
+import asyncio
+import time
+
+from openai import AsyncOpenAI
+
+import tracing
+from benchmarks.harness import NullWebSocket, make_sample_invoice_pdf
+from benchmarks.stub_model_server import start_stub_server
+from process import process_multi_page_pdf
+
+
+def span_overhead_us(iterations=100000):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        pass
+    bare = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(iterations):
+        with tracing.span('overhead'):
+            pass
+    return (time.perf_counter() - start - bare) * 1e6 / iterations
+
+
+async def run(args, client):
+    pdf_data = make_sample_invoice_pdf(args.pages, args.kind)
+    start = time.perf_counter()
+    await process_multi_page_pdf(pdf_data, "bench.pdf", NullWebSocket(), client, "stub")
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pages", type=int, default=6)
+    parser.add_argument("--kind", default="scanned")
+    parser.add_argument("--latency", type=float, default=0.5, help="stub seconds per request")
+    parser.add_argument("--port", type=int, default=8007)
+    args = parser.parse_args()
+
+    tracing.TRACE_LOG = False
+    server, base_url = start_stub_server(port=args.port, latency=args.latency)
+    client = AsyncOpenAI(api_key="stub", base_url=base_url)
+    try:
+        wall = asyncio.run(run(args, client))
+    finally:
+        server.should_exit = True
+
+    print(f"{args.pages} {args.kind} pages in {wall:.2f}s wall")
+    print(f"{'stage':28} {'spans':>6} {'total s':>8} {'mean ms':>8} {'% wall':>7}")
+    totals = sorted(tracing.stage_totals().items(), key=lambda item: -item[1][1])
+    for stage, (count, total) in totals:
+        print(f"{stage:28} {count:6d} {total:8.3f} {total * 1000 / count:8.2f} {total / wall:7.1%}")
+    print(f"span overhead (logging off): {span_overhead_us():.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Benchmark: time to first extracted field with and without streamed partial results.
+
+Sends the same invoice image to the local stub model server, which simulates
+a time-to-first-token plus a per-output-token generation time, once as a
+regular completion and once streamed. Reports when the first section, the
+first line item and the full result reached the (fake) WebSocket.
+
+Run from backend/:   python -m benchmarks.bench_streaming
+"""
+import argparse
+import asyncio
+import time
+
+from openai import AsyncOpenAI
+
+import gptprocesses
+from benchmarks.harness import make_sample_invoice_image
+from benchmarks.stub_model_server import start_stub_server
+
+
+class TimingWebSocket:
+    """Records when the first partial section and the first line item arrive"""
+
+    def __init__(self, start):
+        self.start = start
+        self.first_section = None
+        self.first_item = None
+
+    async def send_text(self, text):
+        pass
+
+    async def send_json(self, data):
+        partial = data.get("partial") if isinstance(data, dict) else None
+        if not partial:
+            return
+        elapsed = time.perf_counter() - self.start
+        if self.first_section is None:
+            self.first_section = elapsed
+        if partial["index"] is not None and self.first_item is None:
+            self.first_item = elapsed
+
+
+def fmt(seconds):
+    return f"{seconds:8.2f}" if seconds is not None else f"{'-':>8}"
+
+
+async def run(args, client, image):
+    print(f"{'mode':10} {'1st section s':>13} {'1st item s':>10} {'full s':>8}")
+    for streaming in (False, True):
+        gptprocesses.STREAM_PARTIAL_RESULTS = streaming
+        start = time.perf_counter()
+        ws = TimingWebSocket(start)
+        result = await gptprocesses.try_process_image(client, "stub", image, ws)
+        full = time.perf_counter() - start
+        assert result, "extraction failed"
+        print(f"{'streamed' if streaming else 'blocking':10} {fmt(ws.first_section):>13} "
+              f"{fmt(ws.first_item):>10} {full:8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--latency", type=float, default=1.0, help="stub time to first token in seconds")
+    parser.add_argument("--token-ms", type=float, default=10.0, help="stub milliseconds per output token")
+    parser.add_argument("--port", type=int, default=8005)
+    args = parser.parse_args()
+
+    server, base_url = start_stub_server(port=args.port, latency=args.latency,
+                                         token_latency=args.token_ms / 1000)
+    client = AsyncOpenAI(api_key="stub", base_url=base_url)
+
+    try:
+        asyncio.run(run(args, client, make_sample_invoice_image()))
+    finally:
+        server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Benchmark: resolution the model sees on dense pages, whole vs tiled.
+
+Renders synthetic pages (the A3 ledger is the dense case) the way the image
+path does, plans tiles and reports, for the whole page and for the tiled
+bands, the text x-height in model pixels after the model's own downscale
+(fit to 2048, shortest side 768) and the estimated image tokens. Also checks
+that stitching overlapping bands keeps every row exactly once.
+
+Run from backend/:   python -m benchmarks.bench_tiling
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from benchmarks.harness import make_sample_invoice_pdf
+from render_policy import HIGH_RES_SETTINGS, MODEL_MAX_DIMENSION, estimate_image_tokens, render_pdf_page
+from tiling import MODEL_SHORT_SIDE, ink_mask, plan_tiles, stitch_tile_results, text_line_spans, tile_image
+
+
+def model_scale(width, height):
+    """Factor the model resizes a high-detail image by"""
+    scale = min(1.0, MODEL_MAX_DIMENSION / max(width, height))
+    return scale * min(1.0, MODEL_SHORT_SIDE / (min(width, height) * scale))
+
+
+def line_height(image_data):
+    gray = cv2.imdecode(np.frombuffer(image_data, np.uint8), cv2.IMREAD_GRAYSCALE)
+    spans = text_line_spans(ink_mask(gray))
+    return float(np.median([bottom - top for top, bottom in spans])), gray.shape
+
+
+def check_stitching(rows=70, bands=3, overlap=2):
+    """Overlapping bands of the same rows must stitch back to each row exactly once"""
+    items = [{'item_number': str(i), 'description': f'Item {i}', 'quantity': '1',
+              'unit_price': f'{i}.00', 'total_price': f'{i}.00'} for i in range(1, rows + 1)]
+    per_band = -(-rows // bands)
+    results = [{'invoice_header': {'vendor_name': 'Acme', 'invoice_number': 'N/A'}, 'line_items': []}]
+    for start in range(0, rows, per_band):
+        results.append({'invoice_header': {'vendor_name': 'N/A', 'invoice_number': 'INV-1'},
+                        'line_items': items[max(0, start - overlap):start + per_band]})
+    stitched = stitch_tile_results(results)
+    assert stitched['line_items'] == items, "overlapping rows were dropped or duplicated"
+    assert stitched['invoice_header'] == {'vendor_name': 'Acme', 'invoice_number': 'INV-1'}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--kinds", default="ledger,digital_dense,scanned")
+    args = parser.parse_args()
+
+    check_stitching()
+    print("stitching: overlapping bands keep every row once")
+    print(f"{'page':14} {'tiles':>5} {'plan ms':>8} {'line px whole':>13} {'line px tiled':>13} "
+          f"{'tokens whole':>12} {'tokens tiled':>12}")
+    for kind in args.kinds.split(','):
+        pdf = make_sample_invoice_pdf(1, kind)
+        page = render_pdf_page(pdf, 1)
+        height, (h, w) = line_height(page)
+        whole_px = height * model_scale(w, h)
+        whole_tokens = estimate_image_tokens(w, h)
+
+        start = time.perf_counter()
+        planned = plan_tiles(page)
+        plan_ms = (time.perf_counter() - start) * 1000
+        if planned is None:
+            print(f"{kind:14} {'-':>5} {plan_ms:8.0f} {whole_px:13.1f} {'-':>13} {whole_tokens:12d} {'-':>12}")
+            continue
+
+        # As process_invoice_tiled does: bands planned on the model-size render, cut from the high-res one
+        bands, tiles = tile_image(render_pdf_page(pdf, 1, HIGH_RES_SETTINGS), planned)
+        tiled_px, tiled_tokens = [], 0
+        for tile in tiles:
+            decoded = cv2.imdecode(np.frombuffer(tile, np.uint8), cv2.IMREAD_GRAYSCALE)
+            th, tw = decoded.shape
+            tiled_tokens += estimate_image_tokens(tw, th)
+        # Line height is measured on the table bands (the header band holds the larger title text)
+        for tile in tiles[1:]:
+            band_height, (th, tw) = line_height(tile)
+            tiled_px.append(band_height * model_scale(tw, th))
+        print(f"{kind:14} {len(tiles):5d} {plan_ms:8.0f} {whole_px:13.1f} {min(tiled_px):13.1f} "
+              f"{whole_tokens:12d} {tiled_tokens:12d}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Benchmark: /ws connection setup latency.
+
+Starts the real app under uvicorn (in a scratch working directory, stdout to
+a log file as in a deployment) and opens --connections WebSocket sessions,
+--concurrency at a time. Each one sends a tiny upload that fails straight
+away in the image path, so the timings are the per-connection work of the
+endpoint rather than extraction:
+
+  handshake     connect until the WebSocket is open
+  first reply   upload sent until the first message (the file format) arrives
+  session       connect until the final message
+
+Run from backend/:   python -m benchmarks.bench_ws_connect
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import websockets
+
+from benchmarks.bench_cpu_pool import wait_for_port
+from benchmarks.stub_model_server import start_stub_server
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def start_app(port, base_url, workdir, extra_args=()):
+    env = dict(os.environ, OPENAI_API_KEY="stub", OPENAI_BASE_URL=base_url,
+               EXTRACTION_CACHE_BACKEND="off", TRACE_LOG="0", PYTHONPATH=BACKEND_DIR)
+    log = open(os.path.join(workdir, "app.log"), "wb")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning", *extra_args],
+        cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+    wait_for_port(port)
+    return process
+
+
+async def session(url):
+    start = time.perf_counter()
+    async with websockets.connect(url, max_size=None) as ws:
+        opened = time.perf_counter()
+        await ws.send("probe.txt")
+        await ws.send(b"\0")
+        sent = time.perf_counter()
+        await ws.recv()
+        first = time.perf_counter()
+        async for message in ws:
+            if "processed successfully" in message:
+                break
+    return opened - start, first - sent, time.perf_counter() - start
+
+
+async def drive(url, connections, concurrency):
+    limit = asyncio.Semaphore(concurrency)
+
+    async def limited():
+        async with limit:
+            return await session(url)
+
+    start = time.perf_counter()
+    timings = await asyncio.gather(*[limited() for _ in range(connections)])
+    return timings, time.perf_counter() - start
+
+
+def percentiles(values):
+    ordered = sorted(values)
+    return (statistics.median(ordered) * 1000, ordered[int(len(ordered) * 0.99) - 1] * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--connections", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--port", type=int, default=8101)
+    args = parser.parse_args()
+
+    server, base_url = start_stub_server(port=8009, latency=0)
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            app = start_app(args.port, base_url, workdir)
+            try:
+                url = f"ws://127.0.0.1:{args.port}/ws"
+                asyncio.run(drive(url, 20, 1))  # warm up imports and the connection path
+                timings, elapsed = asyncio.run(drive(url, args.connections, args.concurrency))
+            finally:
+                app.terminate()
+                app.wait()
+            log_bytes = os.path.getsize(os.path.join(workdir, "app.log"))
+    finally:
+        server.should_exit = True
+
+    print(f"{args.connections} sessions, {args.concurrency} at a time: {args.connections / elapsed:.0f} sessions/s, "
+          f"{log_bytes / 1024:.0f} KB of app output")
+    print(f"{'':12} {'p50 ms':>7} {'p99 ms':>7}")
+    for name, values in zip(("handshake", "first reply", "session"), zip(*timings)):
+        p50, p99 = percentiles(values)
+        print(f"{name:12} {p50:7.2f} {p99:7.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Benchmark: large uploads over /ws, one frame versus the chunked protocol.
+
+Starts the real app under uvicorn (scratch working directory, stub model
+server) and uploads a large scanned PDF (--pages pages of incompressible
+scans, --mb-per-page MB each) three ways:
+
+  single frame   the old protocol: filename, then the whole file in one frame
+                 (needs --ws-max-size raised, uvicorn refuses frames over 16 MB)
+  chunked        upload_start / chunk frames / upload_end (uploads.py)
+  chunked+drop   as chunked, but the connection stalls halfway and the client
+                 reconnects and resumes from the offset the server reports while
+                 the stalled connection is still open (as when the network drops
+                 and the server has not noticed yet), so the new one takes over
+
+Each mode gets a fresh app; reported are the upload time, the bytes sent
+(resends included), whether the PDF was processed, and the app's peak RSS.
+
+Run from backend/:   python -m benchmarks.bench_ws_upload
+"""
+import argparse
+import asyncio
+import json
+import tempfile
+import time
+from io import BytesIO
+
+import fitz
+import numpy as np
+import websockets
+from PIL import Image
+
+from benchmarks.bench_ws_connect import start_app
+from benchmarks.stub_model_server import start_stub_server
+from uploads import CHUNK_HEADER
+
+# Chunks sent ahead of their acknowledgement
+WINDOW = 8
+
+
+def make_large_pdf(pages, mb_per_page):
+    """A PDF of noisy full-page scans, about mb_per_page MB per page"""
+    doc = fitz.open()
+    rng = np.random.default_rng(0)
+    side = int((mb_per_page * 1e6 / 1.3) ** 0.5)
+    for _ in range(pages):
+        noise = rng.integers(0, 256, (side, side), dtype=np.uint8)
+        buffer = BytesIO()
+        Image.fromarray(noise).save(buffer, "JPEG", quality=95)
+        page = doc.new_page(width=595, height=842)
+        page.insert_image(page.rect, stream=buffer.getvalue())
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def peak_rss_mb(pid):
+    with open(f"/proc/{pid}/status", "r") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+async def wait_for_result(ws):
+    async for message in ws:
+        if "processed successfully" in message:
+            return True
+    return False
+
+
+async def upload_single_frame(url, data):
+    async with websockets.connect(url, max_size=None) as ws:
+        await ws.send("bench.pdf")
+        await ws.send(data)
+        return len(data), await wait_for_result(ws)
+
+
+async def send_chunks(ws, data, offset, seq, chunk_size, stop_at=None):
+    """Send chunks from offset with up to WINDOW unacknowledged; returns bytes sent"""
+    sent, in_flight = 0, 0
+    while offset < len(data) or in_flight:
+        while offset < len(data) and in_flight < WINDOW:
+            if stop_at is not None and offset >= stop_at:
+                return sent
+            chunk = data[offset:offset + chunk_size]
+            await ws.send(CHUNK_HEADER.pack(seq, offset) + chunk)
+            offset += len(chunk)
+            seq += 1
+            sent += len(chunk)
+            in_flight += 1
+        message = json.loads(await ws.recv())
+        if message.get("type") != "upload_ack":
+            raise RuntimeError(f"upload failed: {message}")
+        in_flight -= 1
+    return sent
+
+
+async def upload_chunked(url, data, drop_at=None):
+    request = {"type": "upload_start", "filename": "bench.pdf", "size": len(data)}
+    sent = 0
+    stalled = None
+    if drop_at is not None:
+        stalled = await websockets.connect(url, max_size=None)
+        await stalled.send(json.dumps(request))
+        ready = json.loads(await stalled.recv())
+        sent += await send_chunks(stalled, data, ready["offset"], ready["seq"], ready["chunk_size"],
+                                  stop_at=int(len(data) * drop_at))
+        request["upload_id"] = ready["upload_id"]
+    try:
+        async with websockets.connect(url, max_size=None) as ws:
+            await ws.send(json.dumps(request))
+            ready = json.loads(await ws.recv())
+            if ready.get("type") != "upload_ready":
+                raise RuntimeError(f"resume failed: {ready}")
+            sent += await send_chunks(ws, data, ready["offset"], ready["seq"], ready["chunk_size"])
+            await ws.send(json.dumps({"type": "upload_end", "upload_id": ready["upload_id"]}))
+            return sent, await wait_for_result(ws)
+    finally:
+        if stalled is not None:
+            await stalled.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pages", type=int, default=6)
+    parser.add_argument("--mb-per-page", type=float, default=10)
+    parser.add_argument("--port", type=int, default=8102)
+    args = parser.parse_args()
+
+    data = make_large_pdf(args.pages, args.mb_per_page)
+    modes = {
+        "single frame": (lambda url: upload_single_frame(url, data), ("--ws-max-size", str(len(data) * 2))),
+        "chunked": (lambda url: upload_chunked(url, data), ()),
+        "chunked+drop": (lambda url: upload_chunked(url, data, drop_at=0.5), ()),
+    }
+    server, base_url = start_stub_server(port=8010, latency=0.1)
+    print(f"{args.pages}-page scanned PDF, {len(data) / 1e6:.1f} MB")
+    print(f"{'mode':14} {'sent MB':>8} {'total s':>8} {'processed':>10} {'app peak RSS MB':>16}")
+    try:
+        for name, (upload, app_args) in modes.items():
+            with tempfile.TemporaryDirectory() as workdir:
+                app = start_app(args.port, base_url, workdir, app_args)
+                try:
+                    start = time.perf_counter()
+                    sent, ok = asyncio.run(upload(f"ws://127.0.0.1:{args.port}/ws"))
+                    elapsed = time.perf_counter() - start
+                    rss = peak_rss_mb(app.pid)
+                finally:
+                    app.terminate()
+                    app.wait()
+            print(f"{name:14} {sent / 1e6:8.1f} {elapsed:8.2f} {str(ok):>10} {rss:16.0f}")
+    finally:
+        server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Shared helpers for the benchmark scripts"""
+from io import BytesIO
+
+import fitz
+from PIL import Image, ImageDraw
+
+
+class NullWebSocket:
+    """Collects the messages the pipeline would send to the browser"""
+
+    def __init__(self, echo=False):
+        self.messages = []
+        self.echo = echo
+
+    async def send_text(self, text):
+        self.messages.append(text)
+        if self.echo:
+            print(f"WS: {text}")
+
+    async def send_json(self, data):
+        self.messages.append(data)
+
+
+def make_sample_invoice_image(width=2480, height=3508, lines=40):
+    """Render a synthetic A4-at-300-DPI invoice and return it as JPEG bytes"""
+    image = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(image)
+    draw.text((150, 150), "TAX INVOICE  #INV-0001", fill="black")
+    for i in range(lines):
+        y = 400 + i * 70
+        draw.text((150, y), f"{i + 1}  Item description {i + 1}   2   $12.50   $25.00", fill="black")
+        draw.line((150, y + 50, width - 150, y + 50), fill="black")
+    buffer = BytesIO()
+    image.save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def make_sample_invoice_pdf(pages=1, kind="digital_dense"):
+    """Build a synthetic invoice PDF in memory and return its bytes.
+
+    kind: digital_sparse, digital_dense, scanned (image-only pages) or ledger (A3 landscape, dense)
+    """
+    doc = fitz.open()
+    for page_index in range(pages):
+        if kind == "scanned":
+            page = doc.new_page(width=595, height=842)
+            page.insert_image(page.rect, stream=make_sample_invoice_image(width=1654, height=2339))
+            continue
+        if kind == "ledger":
+            page = doc.new_page(width=1191, height=842)
+            rows, font_size, columns = 70, 7, 14
+        elif kind == "digital_sparse":
+            page = doc.new_page(width=595, height=842)
+            rows, font_size, columns = 6, 11, 4
+        else:
+            page = doc.new_page(width=595, height=842)
+            rows, font_size, columns = 45, 8, 6
+        page.insert_text((40, 40), f"TAX INVOICE  #INV-{page_index + 1:04d}   Page {page_index + 1}/{pages}", fontsize=14)
+        page.insert_text((40, 60), "Vendor: Hernandez Ltd, 668 Marie Isle, New Kimberg, AR 92381", fontsize=9)
+        column_width = (page.rect.width - 80) / columns
+        for row in range(rows):
+            y = 90 + row * (font_size + 3.5)
+            for column in range(columns):
+                text = f"{row + 1}" if column == 0 else f"${(row + 1) * (column + 3) * 1.25:,.2f}"
+                if column == 1:
+                    text = f"Item description {row + 1}"
+                page.insert_text((40 + column * column_width, y), text, fontsize=font_size)
+    data = doc.tobytes()
+    doc.close()
+    return data
@@ -0,0 +1,102 @@
+"""
+Load test: one slow model call must not stall the event loop.
+
+Runs N concurrent try_process_image calls against the local stub while a
+heartbeat task measures how late the loop wakes up. With the async client
+(or thread offload) the worst lag stays in milliseconds and the wall time is
+about one stub latency; the blocking baseline serialises every call. The
+async client runs twice, streaming partial results and not; the sync client
+and the baseline (which stands in for the old code) never stream.
+Exits with status 1 if any request fails or a non-baseline mode stalls the loop.
+
+Run from backend/:   python -m benchmarks.load_test_event_loop
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+from openai import AsyncOpenAI, OpenAI
+
+import gptprocesses
+from benchmarks.harness import NullWebSocket, make_sample_invoice_image
+from benchmarks.stub_model_server import start_stub_server
+from gptprocesses import try_process_image
+
+
+async def heartbeat(stop, interval=0.05):
+    """Return the worst observed event loop lag in seconds"""
+    worst = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - start - interval)
+    return worst
+
+
+class BlockingClient:
+    """Old behaviour: sync client called straight from the coroutine"""
+
+    def __init__(self, client):
+        self.chat = self
+        self.completions = self
+        self._client = client
+
+    async def create(self, **kwargs):
+        return self._client.chat.completions.create(**kwargs)
+
+
+async def run_mode(client, image_data, concurrency, stream=True):
+    gptprocesses.STREAM_PARTIAL_RESULTS = stream
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(heartbeat(stop))
+    start = time.perf_counter()
+    results = await asyncio.gather(*[
+        try_process_image(client, "stub", image_data, NullWebSocket())
+        for _ in range(concurrency)
+    ])
+    elapsed = time.perf_counter() - start
+    stop.set()
+    worst_lag = await lag_task
+    ok = sum(1 for r in results if r)
+    return elapsed, worst_lag, ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=1.0)
+    parser.add_argument("--port", type=int, default=8001)
+    args = parser.parse_args()
+
+    server, base_url = start_stub_server(port=args.port, latency=args.latency)
+    image_data = make_sample_invoice_image()
+    modes = {
+        "async client, streamed": (AsyncOpenAI(api_key="stub", base_url=base_url), True),
+        "async client": (AsyncOpenAI(api_key="stub", base_url=base_url), False),
+        "sync client (thread offload)": (OpenAI(api_key="stub", base_url=base_url), False),
+        "blocking baseline": (BlockingClient(OpenAI(api_key="stub", base_url=base_url)), False),
+    }
+
+    failed = False
+    try:
+        print(f"{'mode':32} {'wall(s)':>8} {'max lag(ms)':>12} {'ok':>4}")
+        for name, (client, stream) in modes.items():
+            elapsed, worst_lag, ok = asyncio.run(run_mode(client, image_data, args.concurrency, stream))
+            print(f"{name:32} {elapsed:8.2f} {worst_lag * 1000:12.1f} {ok:>4}/{args.concurrency}")
+            if ok != args.concurrency:
+                print(f"❌ {name}: {args.concurrency - ok} request(s) failed")
+                failed = True
+            elif name != "blocking baseline" and worst_lag > args.latency / 2:
+                print(f"❌ {name}: event loop was blocked by a model call")
+                failed = True
+    finally:
+        server.should_exit = True
+
+    if failed:
+        sys.exit(1)
+    print("✅ Model calls did not block the event loop")
+
+
+if __name__ == "__main__":
+    main()
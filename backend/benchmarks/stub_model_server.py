@@ -0,0 +1,312 @@
+"""
+Local stand-in for the OpenAI chat completions endpoint, used by the benchmarks.
+
+Run from backend/:   python -m benchmarks.stub_model_server
+Then point the app at it with OPENAI_BASE_URL=http://127.0.0.1:8001/v1
+"""
+import asyncio
+import base64
+import glob
+import itertools
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from io import BytesIO
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from PIL import Image
+
+from model_scheduler import TokenBucket
+from render_policy import estimate_image_tokens
+
+STUB_HOST = os.getenv('STUB_HOST', '127.0.0.1')
+STUB_PORT = int(os.getenv('STUB_PORT', '8001'))
+STUB_LATENCY = float(os.getenv('STUB_LATENCY', '2.0'))  # seconds per completion
+# Force quality_assessment.readability_score (e.g. "medium" drives the enhancement retry path)
+STUB_READABILITY = os.getenv('STUB_READABILITY')
+# Simulated upload bandwidth in bytes/second (0 = unlimited), so payload size shows up in latency
+STUB_UPLOAD_BPS = float(os.getenv('STUB_UPLOAD_BPS', '0'))
+# Simulated generation time in seconds per completion token (0 = none), so long answers cost time
+STUB_TOKEN_LATENCY = float(os.getenv('STUB_TOKEN_LATENCY', '0'))
+# Line items per invoice (0 = as in the fixture); large tables overflow max_tokens like real invoices
+STUB_LINE_ITEMS = int(os.getenv('STUB_LINE_ITEMS', '0'))
+# Quota like the provider's: a burst of STUB_RATE_LIMIT requests, refilled continuously at
+# STUB_RATE_LIMIT per STUB_RATE_WINDOW seconds (0 = unlimited); the rest get a 429 with Retry-After
+STUB_RATE_LIMIT = int(os.getenv('STUB_RATE_LIMIT', '0'))
+STUB_RATE_WINDOW = float(os.getenv('STUB_RATE_WINDOW', '60'))
+# Glob of saved results (e.g. resultjson/invoice_*.json) whose pages are replayed in turn,
+# one per completion; empty = always answer with invoice_2.json
+STUB_FIXTURES = os.getenv('STUB_FIXTURES', '')
+
+# Marker line of the multi-page batch prompt (see build_batch_extraction_prompt)
+BATCH_PAGES_PATTERN = re.compile(r"Page numbers, in image order: ([\d, ]+)")
+# Marker line of the continuation prompt (see build_continuation_prompt)
+CONTINUATION_PATTERN = re.compile(r"Last item_number received: (.*)")
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURE_PATH = os.path.join(BACKEND_DIR, 'invoice_2.json')
+
+app = FastAPI()
+app.state.latency = STUB_LATENCY
+app.state.upload_bps = STUB_UPLOAD_BPS
+app.state.readability = STUB_READABILITY
+app.state.token_latency = STUB_TOKEN_LATENCY
+app.state.line_items = STUB_LINE_ITEMS
+app.state.rate_limit = STUB_RATE_LIMIT
+app.state.rate_window = STUB_RATE_WINDOW
+app.state.quota = None
+app.state.rejected = 0
+
+
+def load_canned_content(fixture_path=FIXTURE_PATH):
+    """Load a saved extraction and return it as the model's JSON answer"""
+    with open(fixture_path, 'r', encoding='utf-8') as f:
+        saved = json.load(f)
+    return json.dumps(saved.get('extraction_data', saved), ensure_ascii=False)
+
+
+def load_replay_fixtures(pattern):
+    """Per-page model answers (JSON text) from saved results, without the pipeline's own additions"""
+    answers = []
+    for path in sorted(glob.glob(pattern)):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f).get('extraction_data', {})
+        for page in data.get('page_by_page_results') or [data]:
+            page = {key: value for key, value in page.items() if key != 'page_info'}
+            if page.get('line_items'):
+                answers.append(json.dumps(page, ensure_ascii=False))
+    if not answers:
+        raise SystemExit(f"No saved extractions with line items found under {pattern}")
+    return answers
+
+
+CANNED_CONTENT = load_canned_content()
+
+
+def set_fixtures(pattern=STUB_FIXTURES):
+    """Answer with the pages of the saved results matching pattern in turn (empty = CANNED_CONTENT)"""
+    app.state.fixtures = load_replay_fixtures(pattern) if pattern else [CANNED_CONTENT]
+    app.state.fixture_turn = itertools.count()
+
+
+set_fixtures()
+
+
+def next_fixture():
+    """The next recorded answer in the rotation"""
+    fixtures = app.state.fixtures
+    return fixtures[next(app.state.fixture_turn) % len(fixtures)]
+
+
+def canned_page(readability=None, line_items=0):
+    """The canned answer as a dict, optionally with a forced readability score and a longer item table"""
+    data = json.loads(next_fixture())
+    if readability:
+        data.setdefault("quality_assessment", {})["readability_score"] = readability
+    items = data.get("line_items") or []
+    if line_items and items:
+        data["line_items"] = [
+            {**items[i % len(items)], "item_number": str(i + 1)} for i in range(line_items)
+        ]
+    return data
+
+
+def canned_content(readability=None, line_items=0):
+    """The canned answer as the model's JSON text"""
+    if not readability and not line_items:
+        return next_fixture()
+    return json.dumps(canned_page(readability, line_items), ensure_ascii=False)
+
+
+def batch_content(page_numbers, readability=None, line_items=0):
+    """The canned answer repeated once per page, in the batch response schema"""
+    page = canned_page(readability, line_items)
+    return json.dumps({"pages": [{"page_number": n, **page} for n in page_numbers]}, ensure_ascii=False)
+
+
+def continuation_content(last_item_number, readability=None, line_items=0):
+    """Answer to a continuation prompt: the items after last_item_number plus the later sections"""
+    page = canned_page(readability, line_items)
+    items = page["line_items"]
+    numbers = [item.get("item_number") for item in items]
+    after = numbers.index(last_item_number) + 1 if last_item_number in numbers else 0
+    later_sections = list(page)[list(page).index("line_items") + 1:]
+    answer = {"line_items": items[after:], "table_complete": True}
+    answer.update({section: page[section] for section in later_sections})
+    return json.dumps(answer, ensure_ascii=False)
+
+
+def truncate_to_max_tokens(content, max_tokens):
+    """Cut the answer at max_tokens (~4 characters each) like the API; returns (content, finish_reason)"""
+    if max_tokens and len(content) // 4 > max_tokens:
+        return content[:max_tokens * 4], "length"
+    return content, "stop"
+
+
+def split_message(body):
+    """Return (prompt text, [image bytes]) from a chat completions request body"""
+    texts, images = [], []
+    for message in body.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            texts.append(content)
+            continue
+        for part in content or []:
+            if part.get("type") == "text":
+                texts.append(part["text"])
+            elif part.get("type") == "image_url":
+                images.append(base64.b64decode(part["image_url"]["url"].split(",", 1)[1]))
+    return "\n".join(texts), images
+
+
+def estimate_usage(prompt, images, content):
+    """Token usage in the API's shape: ~4 characters per text token, tiles for images"""
+    prompt_tokens = len(prompt) // 4
+    for image in images:
+        prompt_tokens += estimate_image_tokens(*Image.open(BytesIO(image)).size)
+    completion_tokens = len(content) // 4
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens
+    }
+
+
+def build_completion(model, content, usage, finish_reason="stop"):
+    """Shape a response body like the real chat completions API"""
+    return {
+        "id": f"chatcmpl-stub-{uuid.uuid4().hex[:12]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model or "stub",
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": finish_reason
+            }
+        ],
+        "usage": usage
+    }
+
+
+def build_chunk(completion_id, model, delta, finish_reason=None, usage=None):
+    """One server-sent event of a streamed completion (the usage-only chunk when usage is given)"""
+    chunk = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model or "stub",
+        "choices": [] if usage else [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+    }
+    if usage:
+        chunk["usage"] = usage
+    return f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+
+
+async def stream_completion(model, content, delay, token_latency, finish_reason="stop", chars_per_chunk=16,
+                            usage=None):
+    """Yield the answer as SSE chunks: first chunk after delay, then at token_latency per ~4 characters.
+
+    usage, if given, is sent in a last chunk without choices (stream_options.include_usage).
+    """
+    completion_id = f"chatcmpl-stub-{uuid.uuid4().hex[:12]}"
+    await asyncio.sleep(delay)
+    yield build_chunk(completion_id, model, {"role": "assistant", "content": ""})
+    for start in range(0, len(content), chars_per_chunk):
+        piece = content[start:start + chars_per_chunk]
+        yield build_chunk(completion_id, model, {"content": piece})
+        if token_latency:
+            await asyncio.sleep(token_latency * len(piece) / 4)
+    yield build_chunk(completion_id, model, {}, finish_reason)
+    if usage is not None:
+        yield build_chunk(completion_id, model, None, usage=usage)
+    yield "data: [DONE]\n\n"
+
+
+def reset_quota():
+    """Start with a full quota and no rejections"""
+    limit = app.state.rate_limit
+    app.state.quota = TokenBucket(limit / app.state.rate_window, limit) if limit else None
+    app.state.rejected = 0
+
+
+def rate_limited_response():
+    """A 429 like the provider's if the quota is used up, else None (request accepted)"""
+    quota = app.state.quota
+    if quota is None:
+        return None
+    retry_after = quota.wait_time(1)
+    if retry_after <= 0:
+        quota.take(1)
+        return None
+    app.state.rejected += 1
+    return JSONResponse(
+        status_code=429,
+        headers={"retry-after": str(max(1, round(retry_after))), "retry-after-ms": str(int(retry_after * 1000))},
+        content={"error": {"message": "Rate limit reached for requests", "type": "requests",
+                           "param": None, "code": "rate_limit_exceeded"}}
+    )
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    limited = rate_limited_response()
+    if limited is not None:
+        return limited
+    raw = await request.body()
+    body = json.loads(raw)
+    prompt, images = split_message(body)
+    batch = BATCH_PAGES_PATTERN.search(prompt)
+    continuation = CONTINUATION_PATTERN.search(prompt)
+    if batch:
+        page_numbers = [int(n) for n in batch.group(1).replace(",", " ").split()]
+        content = batch_content(page_numbers, app.state.readability, app.state.line_items)
+    elif continuation:
+        content = continuation_content(json.loads(continuation.group(1)), app.state.readability,
+                                       app.state.line_items)
+    else:
+        content = canned_content(app.state.readability, app.state.line_items)
+    content, finish_reason = truncate_to_max_tokens(content, body.get('max_tokens'))
+    usage = estimate_usage(prompt, images, content)
+
+    delay = app.state.latency
+    if app.state.upload_bps:
+        delay += len(raw) / app.state.upload_bps
+    if body.get('stream'):
+        include_usage = (body.get('stream_options') or {}).get('include_usage')
+        return StreamingResponse(stream_completion(body.get('model'), content, delay, app.state.token_latency,
+                                                   finish_reason, usage=usage if include_usage else None),
+                                 media_type="text/event-stream")
+    await asyncio.sleep(delay + app.state.token_latency * usage["completion_tokens"])
+    return build_completion(body.get('model'), content, usage, finish_reason)
+
+
+def start_stub_server(host=STUB_HOST, port=STUB_PORT, latency=STUB_LATENCY, upload_bps=STUB_UPLOAD_BPS,
+                      readability=STUB_READABILITY, token_latency=STUB_TOKEN_LATENCY, line_items=STUB_LINE_ITEMS,
+                      rate_limit=STUB_RATE_LIMIT, rate_window=STUB_RATE_WINDOW, fixtures=STUB_FIXTURES):
+    """Start the stub in a background thread and return (server, base_url)"""
+    set_fixtures(fixtures)
+    app.state.latency = latency
+    app.state.upload_bps = upload_bps
+    app.state.readability = readability
+    app.state.token_latency = token_latency
+    app.state.line_items = line_items
+    app.state.rate_limit = rate_limit
+    app.state.rate_window = rate_window
+    reset_quota()
+    server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, f"http://{host}:{port}/v1"
+
+
+if __name__ == "__main__":
+    uvicorn.run(app, host=STUB_HOST, port=STUB_PORT)
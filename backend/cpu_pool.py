@@ -0,0 +1,77 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+
+from tracing import span
+
+# thread  - OpenCV and Pillow release the GIL, so image work runs in parallel in threads;
+#           PyMuPDF is not thread-safe, so rasterisation is serialised behind a lock
+# process - everything, including rasterisation, runs in parallel worker processes
+#           (inputs such as the PDF bytes are pickled to the worker on every call; uploads
+#           spooled to disk are passed as a path instead)
+CPU_POOL_KIND = os.getenv('CPU_POOL_KIND', 'thread')
+CPU_POOL_WORKERS = int(os.getenv('CPU_POOL_WORKERS', str(os.cpu_count() or 2)))
+
+_executor = None
+_executor_lock = threading.Lock()
+_pdf_lock = threading.Lock()
+
+
+def get_cpu_executor():
+    """Process-wide executor for CPU-heavy image work, created on first use"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            workers = max(1, CPU_POOL_WORKERS)
+            if CPU_POOL_KIND == 'process':
+                _executor = ProcessPoolExecutor(max_workers=workers)
+            else:
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cpu")
+        return _executor
+
+
+def shutdown_cpu_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+def stage_name(func):
+    """Span name of a pooled call: the function's name, also through functools.partial"""
+    while isinstance(func, partial):
+        func = func.func
+    return getattr(func, '__name__', 'call')
+
+
+async def run_in_executor(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_cpu_executor(), partial(func, *args, **kwargs))
+
+
+async def run_cpu_bound(func, *args, **kwargs):
+    """Run OpenCV / Pillow work (preprocessing, resizing, JPEG encoding) off the event loop.
+
+    The span includes time spent waiting for a free worker.
+    """
+    with span(f"cpu.{stage_name(func)}"):
+        return await run_in_executor(func, *args, **kwargs)
+
+
+def _with_pdf_lock(func, *args, **kwargs):
+    with _pdf_lock:
+        return func(*args, **kwargs)
+
+
+async def run_pdf_bound(func, *args, **kwargs):
+    """Run PyMuPDF work (page preparation, rasterisation) off the event loop.
+
+    In thread mode calls are serialised, because MuPDF must not run on two threads at once.
+    """
+    with span(f"pdf.{stage_name(func)}"):
+        if CPU_POOL_KIND == 'process':
+            return await run_in_executor(func, *args, **kwargs)
+        return await run_in_executor(_with_pdf_lock, func, *args, **kwargs)
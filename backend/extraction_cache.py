@@ -0,0 +1,228 @@
+import copy
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+# memory | disk | tiered (memory in front of disk) | off
+EXTRACTION_CACHE_BACKEND = os.getenv('EXTRACTION_CACHE_BACKEND', 'tiered')
+EXTRACTION_CACHE_DIR = os.getenv('EXTRACTION_CACHE_DIR', os.path.join('cache', 'extractions'))
+EXTRACTION_CACHE_MAX_ENTRIES = int(os.getenv('EXTRACTION_CACHE_MAX_ENTRIES', '512'))
+EXTRACTION_CACHE_MAX_BYTES = int(os.getenv('EXTRACTION_CACHE_MAX_BYTES', str(200 * 1024 * 1024)))
+EXTRACTION_CACHE_MAX_AGE = float(os.getenv('EXTRACTION_CACHE_MAX_AGE', str(7 * 24 * 3600)))  # seconds
+# The disk backend keeps its total size in memory and rescans the directory only when over
+# EXTRACTION_CACHE_MAX_BYTES, or once every this many writes to expire old entries
+EXTRACTION_CACHE_EVICT_EVERY = int(os.getenv('EXTRACTION_CACHE_EVICT_EVERY', '100'))
+
+
+def make_cache_key(image_data, model, prompt_version):
+    """Content address for one extraction: page image bytes + model + prompt version"""
+    digest = hashlib.sha256()
+    digest.update(image_data)
+    digest.update(f"|{model}|{prompt_version}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class MemoryCacheBackend:
+    """In-process LRU with entry-count and age limits"""
+
+    def __init__(self, max_entries=EXTRACTION_CACHE_MAX_ENTRIES, max_age=EXTRACTION_CACHE_MAX_AGE):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._entries = OrderedDict()
+        # Lookups run in worker threads (see process.extract_with_cache)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            created, value = entry
+            if time.time() - created > self.max_age:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, created=None):
+        with self._lock:
+            self._entries[key] = (created or time.time(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DiskCacheBackend:
+    """One JSON file per key, evicted by age and by total directory size (oldest first)"""
+
+    def __init__(self, cache_dir=EXTRACTION_CACHE_DIR, max_bytes=EXTRACTION_CACHE_MAX_BYTES,
+                 max_age=EXTRACTION_CACHE_MAX_AGE, evict_every=EXTRACTION_CACHE_EVICT_EVERY):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.evict_every = max(1, evict_every)
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        # Bytes in the directory as of the last scan plus our writes since (None = not scanned yet)
+        self._total_bytes = None
+        self._writes_since_scan = 0
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.max_age:
+                os.unlink(path)
+                return None
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def set(self, key, value, created=None):
+        path = self._path(key)
+        # A temp file of its own: duplicate pages can write the same key from two threads at once
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self.cache_dir)
+        try:
+            with open(fd, 'w', encoding='utf-8') as f:
+                json.dump(value, f, ensure_ascii=False)
+            size = os.path.getsize(tmp_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        with self._lock:
+            try:
+                replaced = os.path.getsize(path)
+            except OSError:
+                replaced = 0
+            os.replace(tmp_path, path)
+            if self._total_bytes is None:
+                self._evict()
+                return
+            self._total_bytes += size - replaced
+            self._writes_since_scan += 1
+            if self._total_bytes > self.max_bytes or self._writes_since_scan >= self.evict_every:
+                self._evict()
+
+    def _evict(self):
+        """Scan the directory, drop expired entries and the oldest ones over the size limit"""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        now = time.time()
+        total = sum(size for _, size, _ in entries)
+        # Free some headroom, or a full cache would rescan on every write
+        target = self.max_bytes * 0.9 if total > self.max_bytes else self.max_bytes
+        for mtime, size, path in sorted(entries):
+            if total <= target and now - mtime <= self.max_age:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            total -= size
+        self._total_bytes = total
+        self._writes_since_scan = 0
+
+    def clear(self):
+        with self._lock:
+            for name in os.listdir(self.cache_dir):
+                if name.endswith('.json'):
+                    os.unlink(os.path.join(self.cache_dir, name))
+            self._total_bytes = 0
+
+    def __len__(self):
+        return len([name for name in os.listdir(self.cache_dir) if name.endswith('.json')])
+
+
+class ExtractionCache:
+    """Looks keys up in each backend in order and promotes hits to the faster ones"""
+
+    def __init__(self, backends):
+        self.backends = backends
+        self.hits = 0
+        self.misses = 0
+        # get() runs in worker threads
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        for i, backend in enumerate(self.backends):
+            value = backend.get(key)
+            if value is not None:
+                for faster in self.backends[:i]:
+                    faster.set(key, value)
+                with self._lock:
+                    self.hits += 1
+                # Callers decorate results in place (page_info, source_page), so hand out a copy
+                return copy.deepcopy(value)
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, value):
+        value = copy.deepcopy(value)
+        for backend in self.backends:
+            try:
+                backend.set(key, value)
+            except OSError as e:
+                print(f"❌ Failed to write extraction cache: {e}")
+
+    def clear(self):
+        for backend in self.backends:
+            backend.clear()
+
+    def stats(self):
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        lookups = hits + misses
+        return {
+            "backend": EXTRACTION_CACHE_BACKEND,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+            "entries": [len(backend) for backend in self.backends]
+        }
+
+
+def create_extraction_cache(backend=EXTRACTION_CACHE_BACKEND):
+    """Build the cache described by EXTRACTION_CACHE_BACKEND, or None when caching is off"""
+    if backend == 'memory':
+        return ExtractionCache([MemoryCacheBackend()])
+    if backend == 'disk':
+        return ExtractionCache([DiskCacheBackend()])
+    if backend == 'tiered':
+        return ExtractionCache([MemoryCacheBackend(), DiskCacheBackend()])
+    return None
+
+
+_extraction_cache = None
+_extraction_cache_created = False
+
+
+def get_extraction_cache():
+    """Process-wide extraction cache (None when disabled), created on first use"""
+    global _extraction_cache, _extraction_cache_created
+    if not _extraction_cache_created:
+        _extraction_cache = create_extraction_cache()
+        _extraction_cache_created = True
+    return _extraction_cache
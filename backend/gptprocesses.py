@@ -1,187 +1,83 @@
+import asyncio
 import base64
+import contextvars
 import json
+import os
+import time
+import openai
+from openai import OpenAI
+from openai.types import CompletionUsage
+from json_stream import JsonSectionStream, repair_truncated_json
+from prompts import EXTRACTION_SCHEMA, get_prompt
+from model_scheduler import ModelCallFailed, estimate_request_tokens, get_model_scheduler
+from tracing import annotate, record_usage, span, traced
 
-async def try_process_image(client, model, image_path, ws, is_preprocessed=False):
-    """Single attempt to process image with GPT-4o with enhanced error handling"""
-    base64_image = encode_image(image_path)
-    
-    # Enhanced prompt that explicitly asks about quality issues
-    prompt = f"""
-STRICT INSTRUCTION: Only output valid JSON, no markdown or explanations.
+# Register a new version in prompts.py whenever the extraction prompt changes, so cached
+# results are not reused across prompts
+ACTIVE_PROMPT = get_prompt()
+EXTRACTION_PROMPT_VERSION = ACTIVE_PROMPT.version
 
-{'RETRY ATTEMPT - This is a preprocessed image.' if is_preprocessed else 'FIRST ATTEMPT - This is the original image.'}
+# Output tokens per page in a batched request, capped below the model's completion limit
+BATCH_TOKENS_PER_PAGE = 4000
+MAX_BATCH_TOKENS = 16000
 
-First, assess if you can reliably extract data from this image:
-- If the image is too blurry, dark, or distorted to read text clearly, set "quality_too_poor" to true
-- If you can read most text despite some quality issues, set "quality_too_poor" to false
-- If this image is not a valid invoice, set "can_extract_data" to false and add "not invoice" to "quality_issues".
+# Stream completions and push each section to the client as soon as the model closes it
+STREAM_PARTIAL_RESULTS = os.getenv('STREAM_PARTIAL_RESULTS', '1') != '0'
 
+# (page_number, attempt) that partial results streamed from the current task belong to
+_partial_source = contextvars.ContextVar('partial_source', default=(1, 0))
 
-Extract ALL available information from this invoice and return as JSON:
-{{
-  "quality_assessment": {{
-    "quality_too_poor": true/false,
-    "quality_issues": ["list any specific quality problems"],
-    "readability_score": "high/medium/low",
-    "can_extract_data": true/false,
-    "preprocessing_recommended": true/false
-  }},
-  "invoice_header": {{
-    "vendor_name": "",
-    "vendor_address": "",
-    "vendor_phone": "",
-    "vendor_email": "",
-    "vendor_website": "",
-    "vendor_gst_number": "",
-    "vendor_pan": "",
-    "invoice_number": "",
-    "invoice_date": "",
-    "due_date": "",
-    "purchase_order_number": "",
-    "reference_number": "",
-    "currency": ""
-  }},
-  "customer_details": {{
-    "customer_name": "",
-    "customer_address": "",
-    "customer_phone": "",
-    "customer_email": "",
-    "customer_gst_number": "",
-    "customer_pan": "",
-    "billing_address": "",
-    "shipping_address": "",
-    "customer_contact_person": ""
-  }},
-  "line_items": [
-    {{
-      "item_number": "",
-      "description": "",
-      "hsn_sac_code": "",
-      "quantity": "",
-      "unit": "",
-      "unit_price": "",
-      "discount": "",
-      "tax_rate": "",
-      "tax_amount": "",
-      "total_price": ""
-    }}
-  ],
-  "financial_summary": {{
-    "subtotal": "",
-    "total_discount": "",
-    "taxable_amount": "",
-    "cgst": "",
-    "sgst": "",
-    "igst": "",
-    "cess": "",
-    "other_charges": "",
-    "shipping_charges": "",
-    "total_tax_amount": "",
-    "round_off": "",
-    "total_amount": "",
-    "amount_in_words": ""
-  }},
-  "payment_details": {{
-    "payment_terms": "",
-    "payment_method": "",
-    "bank_name": "",
-    "account_number": "",
-    "ifsc_code": "",
-    "branch": "",
-    "upi_id": "",
-    "advance_paid": "",
-    "balance_due": ""
-  }},
-  "terms_and_conditions": {{
-    "payment_terms": "",
-    "delivery_terms": "",
-    "warranty_terms": "",
-    "return_policy": "",
-    "late_payment_charges": "",
-    "jurisdiction": "",
-    "other_conditions": []
-  }},
-  "additional_info": {{
-    "notes": "",
-    "special_instructions": "",
-    "delivery_date": "",
-    "place_of_supply": "",
-    "reverse_charge": "",
-    "document_type": "",
-    "series": "",
-    "authorised_signatory": "",
-    "stamp_or_seal": "",
-    "qr_code_present": ""
-  }},
-  "detection_metadata": {{
-    "tables_detected": true/false,
-    "handwriting_detected": true/false,
-    "logo_detected": true/false,
-    "stamp_detected": true/false,
-    "signature_detected": true/false,
-    "barcode_qr_detected": true/false,
-    "multi_page_document": true/false,
-    "document_quality": "high/medium/low",
-    "extraction_confidence": "high/medium/low",
-    "unclear_fields": []
-  }}
-}}
+# Follow-up requests allowed per page when an answer hits max_tokens mid line-item table
+MAX_CONTINUATIONS = int(os.getenv('MAX_CONTINUATIONS', '3'))
 
-INSTRUCTIONS:
-- Be honest about image quality in the quality_assessment section
-- If quality_too_poor is true, still try to extract what you can see
-- For missing/unclear fields, use "N/A"
-# In your try_process_image function, enhance the currency instructions:
-
-CURRENCY DETECTION - IMPORTANT:
-- ALWAYS preserve currency symbols in amounts: $154.06, ₹10,000, €500, etc.
-- Include currency symbols in ALL amount fields: total_amount, subtotal, unit_price, etc.
-- Do NOT extract just numbers - include the currency symbol with the number
-- Look for currency symbols: ₹, $, €, £, ¥, etc.
-- Look for currency codes: INR, USD, EUR, GBP, etc.
-- Look for currency words: Rupees, Dollars, Euros, Pounds, etc.
-- Extract currency in BOTH invoice_header and financial_summary sections
-- If amounts have symbols like $100.00, preserve the $ in the JSON output
-
-- If text is completely unreadable due to quality, mention this in quality_issues
-- Extract ALL visible text and data fields
-- For terms and conditions, extract the full text even if lengthy
-- Include any fine print, disclaimers, or legal text
-- Capture payment terms like "Net 30", "Due on receipt", etc.
-- Extract tax breakdowns (CGST, SGST, IGST) if present
-- Include any special notes, delivery instructions, or remarks
-- Identify HSN/SAC codes for items if visible
-- Extract complete addresses with pin codes
-- Include contact details like phone, email, website
-- Capture bank details for payments
-- Note any stamps, signatures, or authentication marks
-- Return only valid JSON without any explanation.
-"""
+# Top-level sections of the extraction schema, in the order the model writes them
+EXTRACTION_SECTIONS = tuple(EXTRACTION_SCHEMA)
+
+# Attempt note for one horizontal band of a page split by tiling.py
+TILE_ATTEMPT_NOTE = (
+    'PAGE BAND - This image is one horizontal band of a larger invoice page. Extract only what is '
+    'visible in it and use "N/A" for anything cut off or not shown. A band holding only table rows '
+    'is still part of an invoice: return those rows as line_items and do not report "not invoice". '
+    'Skip a row that is cut off at the top or bottom edge.'
+)
+
+def build_extraction_prompt(attempt_note):
+    """Full extraction prompt; attempt_note tells the model what kind of input it is looking at"""
+    return ACTIVE_PROMPT.build(attempt_note)
+
+
+def set_partial_page(page_number):
+    """Tag partial results streamed from the current task (and its children) with page_number"""
+    _partial_source.set((page_number, 0))
+
+
+def next_partial_attempt():
+    """Start a new extraction attempt of the current page; its partial results replace the earlier ones"""
+    page_number, attempt = _partial_source.get()
+    _partial_source.set((page_number, attempt + 1))
+
+
+@traced('extract_image')
+async def try_process_image(client, model, image_data, ws, is_preprocessed=False, attempt_note=None):
+    """Single attempt to process image bytes with GPT-4o with enhanced error handling"""
+    base64_image = encode_image(image_data)
+    next_partial_attempt()
+    
+    # Enhanced prompt that explicitly asks about quality issues
+    prompt = build_extraction_prompt(attempt_note or (
+        'RETRY ATTEMPT - This is a preprocessed image.' if is_preprocessed else 'FIRST ATTEMPT - This is the original image.'
+    ))
     
     try:
-        response = client.chat.completions.create(
-            model=model,
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}"
-                            }
-                        }
-                    ]
-                }
-            ],
-            max_tokens=4000,  # 🔧 INCREASED from 2500 to 4000
-            temperature=0.1
+        content, finish_reason = await complete_streaming(
+            client, model, prompt, base64_image, ws,
+            max_tokens=4000  # 🔧 INCREASED from 2500 to 4000
         )
         
-        content = response.choices[0].message.content
         cleaned_content = clean_json_response(content)
         result = json.loads(cleaned_content)
+        if finish_reason == 'length':
+            result = await continue_truncated_result(client, model, result, ws, base64_image=base64_image)
 
 # 🔧 NEW: Enhance currency detection
         result = enhance_currency_detection(result)
@@ -190,54 +86,318 @@ CURRENCY DETECTION - IMPORTANT:
 
         
     except json.JSONDecodeError as e:
-        ws.send_text(f"❌ JSON parsing error: {e}")
+        await ws.send_text(f"❌ JSON parsing error: {e}")
         # 🔧 NEW: Try simplified extraction for large documents
-        return try_simplified_extraction(client, model, image_path, is_preprocessed)
+        return await try_simplified_extraction(client, model, image_data, is_preprocessed)
+    except ModelCallFailed:
+        # Quota or outage, not the image: retrying with an enhanced image would not help
+        raise
+    except Exception as e:
+        await ws.send_text(f"❌ Processing error: {e}")
+        return None
+
+
+def build_batch_extraction_prompt(page_numbers):
+    """Extraction prompt for several page images sent in one request, answered page by page"""
+    pages = ", ".join(str(n) for n in page_numbers)
+    return build_extraction_prompt(
+        f'MULTI-PAGE BATCH - You are given {len(page_numbers)} images, each one page of the same PDF.\n'
+        f'Page numbers, in image order: {pages}\n'
+        'Treat every image on its own: apply the quality assessment and the schema below to EACH page '
+        'separately and do not merge data across pages. Instead of a single object, return '
+        '{"pages": [{"page_number": <page number>, ...schema below...}, ...]} '
+        'with exactly one entry per image, in image order.'
+    )
+
+
+@traced('extract_image_batch')
+async def try_process_image_batch(client, model, images, page_numbers, ws):
+    """Extract several page images with one request.
+
+    Returns ({page_number: result or None}, usage). Pages the model skipped or answered
+    with something unusable come back as None so the caller can retry them one by one.
+    """
+    results = {page_number: None for page_number in page_numbers}
+    try:
+        response = await create_chat_completion(
+            client, model, build_batch_extraction_prompt(page_numbers),
+            [encode_image(image) for image in images],
+            max_tokens=min(BATCH_TOKENS_PER_PAGE * len(images), MAX_BATCH_TOKENS),
+            json_mode=ACTIVE_PROMPT.json_mode
+        )
+        content = response.choices[0].message.content
+        parsed = json.loads(clean_json_response(content))
+    except Exception as e:
+        await ws.send_text(f"❌ Batch processing error for pages {page_numbers}: {e}")
+        return results, None
+    truncated = response.choices[0].finish_reason == 'length'
+
+    pages = parsed.get('pages') if isinstance(parsed, dict) else parsed
+    if not isinstance(pages, list):
+        # A lone page object answers a batch of one
+        pages = [parsed] if len(page_numbers) == 1 and isinstance(parsed, dict) else []
+    for position, page_result in enumerate(pages):
+        if not isinstance(page_result, dict):
+            continue
+        page_number = page_result.pop('page_number', None)
+        if page_number not in results:
+            # Fall back to image order when the model drops or garbles the page number
+            page_number = page_numbers[position] if position < len(page_numbers) else None
+        if page_number is not None and results.get(page_number) is None:
+            if truncated and position == len(pages) - 1:
+                # The cut-off page is incomplete; leave it to the single-page path, which can continue it
+                continue
+            results[page_number] = enhance_currency_detection(page_result)
+    return results, getattr(response, 'usage', None)
+
+
+async def create_chat_completion(client, model, prompt, base64_image=None, max_tokens=4000, temperature=0.1,
+                                 stream=False, json_mode=False):
+    """Send one vision (or text-only, when base64_image is None) request without blocking the event loop.
+
+    base64_image may also be a list, to send several images in one request.
+    With stream=True a CompletionStream is returned instead of the completion;
+    json_mode asks the API to only return a syntactically valid JSON object.
+    Works with both AsyncOpenAI (awaited directly) and the sync OpenAI client
+    (offloaded to a worker thread). Every request goes through the process-wide
+    ModelScheduler, which waits for quota and retries 429s, timeouts and server errors.
+    """
+    content = [{"type": "text", "text": prompt}]
+    if base64_image is not None:
+        images = base64_image if isinstance(base64_image, list) else [base64_image]
+        for image in images:
+            content.append({
+                "type": "image_url",
+                "image_url": {
+                    "url": f"data:image/jpeg;base64,{image}"
+                }
+            })
+    kwargs = dict(
+        model=model,
+        messages=[{"role": "user", "content": content}],
+        max_tokens=max_tokens,
+        temperature=temperature
+    )
+    if stream:
+        kwargs['stream'] = True
+        # A last chunk carries the token usage
+        kwargs['stream_options'] = {"include_usage": True}
+    if json_mode:
+        kwargs['response_format'] = {"type": "json_object"}
+    scheduler = get_model_scheduler()
+    tokens = estimate_request_tokens(kwargs['messages'], max_tokens) if scheduler.tokens is not None else 0
+    deadline_at = time.monotonic() + scheduler.deadline
+    with span('model_request', model=model, images=len(content) - 1, stream=stream):
+        if isinstance(client, OpenAI):
+            response = await scheduler.run(lambda: asyncio.to_thread(client.chat.completions.create, **kwargs), tokens)
+        else:
+            create = client.chat.completions.with_raw_response.create if stream else client.chat.completions.create
+            response = await scheduler.run(lambda: create(**kwargs), tokens)
+        if stream:
+            return CompletionStream(response, scheduler, tokens, deadline_at)
+        record_usage(model, getattr(response, 'usage', None))
+    return response
+
+
+class CompletionStream:
+    """A streamed completion from create_chat_completion; async iteration yields its chunks as plain dicts.
+
+    Chunks are decoded with json.loads instead of the SDK's chunk models: those cost about
+    half a millisecond each on the event loop, and a burst of buffered events blocked it
+    for hundreds of milliseconds. The whole answer, not just the response headers, has to
+    arrive by deadline_at (time.monotonic()), and the usage in the last chunk gives the
+    quota back the part of the max_tokens reservation the answer did not use.
+    """
+
+    def __init__(self, response, scheduler, tokens, deadline_at):
+        self.response = response.http_response
+        self.scheduler = scheduler
+        self.tokens = tokens
+        self.deadline_at = deadline_at
+
+    async def __aiter__(self):
+        reads = self.response.aiter_bytes()
+        buffer = b''
+        try:
+            while True:
+                try:
+                    received = await asyncio.wait_for(reads.__anext__(), timeout=self.deadline_at - time.monotonic())
+                except StopAsyncIteration:
+                    return
+                except asyncio.TimeoutError:
+                    raise ModelCallFailed("model stream did not finish before the deadline") from None
+                *lines, buffer = (buffer + received).split(b'\n')
+                for line in lines:
+                    line = line.strip()
+                    if not line.startswith(b'data:'):
+                        continue
+                    data = line[5:].strip()
+                    if data == b'[DONE]':
+                        return
+                    chunk = self.decode(data)
+                    if chunk.get('usage'):
+                        self.scheduler.settle(self.tokens, CompletionUsage(**chunk['usage']))
+                    yield chunk
+        finally:
+            await self.response.aclose()
+
+    def decode(self, data):
+        """The chunk in the data of one SSE event; an error event raises openai.APIError"""
+        chunk = json.loads(data)
+        if chunk.get('error'):
+            error = chunk['error']
+            message = error.get('message') if isinstance(error, dict) else str(error)
+            raise openai.APIError(message or 'Error in the completion stream', self.response.request, body=error)
+        return chunk
+
+
+@traced('model_completion')
+async def complete_streaming(client, model, prompt, base64_image, ws, max_tokens=4000, temperature=0.1):
+    """Return (completion text, finish_reason), sending every section to ws as a partial result as soon as it closes.
+
+    Partial messages look like {"partial": {"page_number": ..., "attempt": ..., "section": ...,
+    "index": ..., "data": ...}}; index is set for single line items and None for whole sections.
+    A higher attempt for the same page (an enhanced or re-rendered retry) starts that page's
+    draft over; continuations keep the attempt and extend it. The sync client (or
+    STREAM_PARTIAL_RESULTS=0) gets one regular, non-streamed request instead.
+    """
+    json_mode = ACTIVE_PROMPT.json_mode
+    if not STREAM_PARTIAL_RESULTS or isinstance(client, OpenAI):
+        response = await create_chat_completion(client, model, prompt, base64_image, max_tokens, temperature,
+                                                json_mode=json_mode)
+        return response.choices[0].message.content, response.choices[0].finish_reason
+
+    response = await create_chat_completion(client, model, prompt, base64_image, max_tokens, temperature,
+                                            stream=True, json_mode=json_mode)
+    parser = JsonSectionStream()
+    page_number, attempt = _partial_source.get()
+    parts = []
+    finish_reason = None
+    async for chunk in response:
+        if not chunk.get('choices'):
+            if chunk.get('usage'):
+                record_usage(model, CompletionUsage(**chunk['usage']))
+            continue
+        choice = chunk['choices'][0]
+        finish_reason = choice.get('finish_reason') or finish_reason
+        delta = (choice.get('delta') or {}).get('content')
+        if not delta:
+            continue
+        parts.append(delta)
+        for section, index, data in parser.feed(delta):
+            if index is None and section in parser.itemized:
+                # Entries were already sent one by one
+                continue
+            await ws.send_json({"partial": {"page_number": page_number, "attempt": max(attempt, 1),
+                                            "section": section, "index": index, "data": data}})
+    annotate(finish_reason=finish_reason)
+    return ''.join(parts), finish_reason
+
+
+def build_continuation_prompt(items_received, last_item, missing_sections):
+    """Prompt for the rest of a line-item table after a cut-off answer"""
+    last_number = last_item.get('item_number', 'N/A') if last_item else 'N/A'
+    last_description = last_item.get('description', 'N/A') if last_item else 'N/A'
+    sections = ", ".join(f'"{section}"' for section in missing_sections) or 'none'
+    return build_extraction_prompt(
+        'CONTINUATION - A previous answer for this invoice was cut off because it was too long.\n'
+        f'Line items received so far: {items_received}\n'
+        f'Last item_number received: {json.dumps(last_number)}\n'
+        f'Last item description received: {json.dumps(last_description)}\n'
+        'Do NOT repeat any of those items. Return ONLY this JSON object:\n'
+        '{"line_items": [the items that come AFTER the last one received, in order, same fields as below], '
+        '"table_complete": true if you reached the last item of the table, otherwise false, '
+        f'plus these sections the previous answer never reached, same fields as below: {sections}}}'
+    )
+
+
+@traced('continuation')
+async def continue_truncated_result(client, model, result, ws, base64_image=None, page_text=None):
+    """Complete a result whose answer hit max_tokens, with up to MAX_CONTINUATIONS follow-up requests.
+
+    Every line item parsed so far is kept; each follow-up asks for the items after the last
+    item_number received (and for the sections the cut-off answer never reached), and the
+    answers are merged until the model reports the table complete.
+    """
+    items = result.get('line_items')
+    if not isinstance(items, list):
+        items = result['line_items'] = []
+    complete = False
+    for _ in range(MAX_CONTINUATIONS):
+        missing = [section for section in EXTRACTION_SECTIONS if section != 'line_items' and not result.get(section)]
+        await ws.send_text(f"✂️ Answer was cut off after {len(items)} line items; requesting the rest...")
+        prompt = build_continuation_prompt(len(items), items[-1] if items else None, missing)
+        if page_text is not None:
+            prompt = f"{prompt}\nINVOICE TEXT:\n{page_text}\n"
+        try:
+            content, finish_reason = await complete_streaming(client, model, prompt, base64_image, ws, max_tokens=4000)
+            part = json.loads(clean_json_response(content))
+        except Exception as e:
+            await ws.send_text(f"❌ Continuation failed, keeping {len(items)} line items: {e}")
+            break
+
+        seen = {(item.get('item_number'), item.get('description')) for item in items if isinstance(item, dict)}
+        new_items = [item for item in part.get('line_items') or []
+                     if isinstance(item, dict) and (item.get('item_number'), item.get('description')) not in seen]
+        items.extend(new_items)
+        for section in missing:
+            if part.get(section):
+                result[section] = part[section]
+        if finish_reason != 'length' and part.get('table_complete', True):
+            complete = True
+            break
+        if not new_items:
+            break
+    if complete:
+        await ws.send_text(f"🧩 Line item table merged: {len(items)} items")
+    else:
+        await ws.send_text(f"⚠️ Line item table may be incomplete: kept {len(items)} items")
+        result.setdefault('detection_metadata', {})['line_items_incomplete'] = True
+    return result
+
+
+@traced('extract_text')
+async def try_process_text(client, model, page_text, ws):
+    """Single attempt to extract an invoice from a PDF page's native text layer (no image)"""
+    prompt = build_extraction_prompt(
+        'TEXT LAYER - The invoice text below was taken from a digital PDF, not an image. '
+        'Columns are approximated with spacing. Image quality does not apply: use readability "high" '
+        'unless the text itself is garbled.'
+    )
+    prompt = f"{prompt}\nINVOICE TEXT:\n{page_text}\n"
+    next_partial_attempt()
+    
+    try:
+        content, finish_reason = await complete_streaming(client, model, prompt, None, ws, max_tokens=4000)
+        result = json.loads(clean_json_response(content))
+        if finish_reason == 'length':
+            result = await continue_truncated_result(client, model, result, ws, page_text=page_text)
+        result = enhance_currency_detection(result)
+        result.setdefault('detection_metadata', {})['extraction_method'] = 'text_layer'
+        return result
+    except ModelCallFailed:
+        raise
     except Exception as e:
-        ws.send_text(f"❌ Processing error: {e}")
+        await ws.send_text(f"❌ Text extraction error: {e}")
         return None
 
 
-def encode_image(file_path):
-    """Encode image to base64"""
-    with open(file_path, "rb") as image_file:
+@traced('encode_image')
+def encode_image(image):
+    """Encode image bytes (or an image file path) to base64"""
+    if isinstance(image, (bytes, bytearray)):
+        annotate(bytes=len(image))
+        return base64.b64encode(image).decode("utf-8")
+    with open(image, "rb") as image_file:
         return base64.b64encode(image_file.read()).decode("utf-8")
     
+@traced('parse_json')
 def clean_json_response(content):
-    """Clean markdown formatting and fix truncated JSON"""
-    content = content.strip()
-    
-    # Remove code block markers
-    if content.startswith('```json'):
-        content = content[7:]  # Remove ```
-    elif content.startswith('```'):
-        content = content[3:]   # Remove ```
-    
-    if content.endswith('```'):
-        content = content[:-3]  # Remove trailing ```
-    
-    content = content.strip()
-    
-    # 🔧 NEW: Fix common JSON truncation issues for large documents
-    if not content.endswith('}'):
-        # Remove trailing commas and incomplete entries
-        content = content.rstrip(',\n\r\t ')
-        
-        # Try to close incomplete strings
-        if content.count('"') % 2 == 1:
-            content += '"'
-        
-        # Close incomplete objects and arrays
-        open_braces = content.count('{') - content.count('}')
-        open_brackets = content.count('[') - content.count(']')
-        
-        if open_brackets > 0:
-            content += ']' * open_brackets
-        if open_braces > 0:
-            content += '}' * open_braces
-    
-    return content
+    """Strip markdown fences and repair truncated JSON, keeping every complete line item"""
+    annotate(bytes=len(content or ''))
+    return repair_truncated_json(content)
 
+@traced('currency_detection')
 def enhance_currency_detection(result):
     """Enhance currency detection and set defaults"""
     if not result:
@@ -334,9 +494,9 @@ def enhance_currency_detection(result):
     
     return result
 
-def try_simplified_extraction(client, model, image_path, is_preprocessed=False):
+async def try_simplified_extraction(client, model, image_data, is_preprocessed=False):
     """Simplified extraction for large documents that cause JSON truncation"""
-    base64_image = encode_image(image_path)
+    base64_image = encode_image(image_data)
     
     # Simplified prompt focusing on key data
     prompt = f"""
@@ -383,27 +543,12 @@ Extract main invoice details and count/sample the line items instead of listing
 """
     
     try:
-        response = client.chat.completions.create(
-            model=model,
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}"
-                            }
-                        }
-                    ]
-                }
-            ],
-            max_tokens=1500,  # Lower token limit for simplified response
-            temperature=0.1
+        response = await create_chat_completion(
+            client, model, prompt, base64_image,
+            max_tokens=1500  # Lower token limit for simplified response
         )
         
-        content = response.choices.message.content
+        content = response.choices[0].message.content
         cleaned_content = clean_json_response(content)
         result = json.loads(cleaned_content)
         
@@ -411,7 +556,7 @@ Extract main invoice details and count/sample the line items instead of listing
         return convert_simplified_to_standard_format(result)
         
     except Exception as e:
-        print("❌ Simplified extraction also failed: {e}")
+        print(f"❌ Simplified extraction also failed: {e}")
         return None
 def convert_simplified_to_standard_format(simplified_result):
     """Convert simplified extraction result to standard format"""
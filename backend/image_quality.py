@@ -0,0 +1,98 @@
+import os
+import cv2
+import numpy as np
+
+# Predict blur locally before the first model call, so blurry scans are enhanced
+# up front instead of after a wasted round trip
+QUALITY_PRESCREEN = os.getenv('QUALITY_PRESCREEN', '1') != '0'
+
+# Metrics are measured on a copy scaled to this width so thresholds do not depend
+# on scan resolution
+ANALYSIS_WIDTH = 1000
+
+# Laplacian variance inside text regions (higher = sharper edges)
+BLUR_TOO_BAD_SHARPNESS = float(os.getenv('BLUR_TOO_BAD_SHARPNESS', '100'))
+BLUR_MAYBE_SHARPNESS = float(os.getenv('BLUR_MAYBE_SHARPNESS', '500'))
+# Grey-level gap between paper and ink; faded or washed-out scans sit below this
+MIN_CONTRAST = 60.0
+# Degrees of rotation beyond which the page counts as poorly captured
+MAX_SKEW_DEGREES = 5.0
+# Share of the page covered by text regions; below this there is too little to judge
+MIN_TEXT_DENSITY = 0.01
+
+
+def text_region_mask(gray):
+    """Binary mask of text-like regions: dark strokes joined into word/line blobs"""
+    binary = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C,
+                                   cv2.THRESH_BINARY_INV, 25, 15)
+    return cv2.dilate(binary, cv2.getStructuringElement(cv2.MORPH_RECT, (9, 3)))
+
+
+def estimate_skew(mask):
+    """Dominant text-line angle in degrees (0 = level), from the minimum-area rectangles of line blobs"""
+    lines = cv2.dilate(mask, cv2.getStructuringElement(cv2.MORPH_RECT, (25, 1)))
+    contours, _ = cv2.findContours(lines, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    angles, weights = [], []
+    for contour in contours:
+        (_, _), (w, h), angle = cv2.minAreaRect(contour)
+        if w < h:
+            w, h = h, w
+            angle -= 90
+        # Only long, thin blobs are text lines
+        if w < 60 or w < 4 * h:
+            continue
+        angles.append((angle + 45) % 90 - 45)
+        weights.append(w)
+    if not angles:
+        return 0.0
+    return float(np.average(angles, weights=weights))
+
+
+def measure_image_quality(image_data):
+    """Sharpness, contrast, skew and text density of encoded image bytes, or None if undecodable"""
+    gray = cv2.imdecode(np.frombuffer(image_data, np.uint8), cv2.IMREAD_GRAYSCALE)
+    if gray is None:
+        return None
+
+    height, width = gray.shape
+    if width != ANALYSIS_WIDTH:
+        scale = ANALYSIS_WIDTH / width
+        interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+        gray = cv2.resize(gray, (ANALYSIS_WIDTH, max(1, int(height * scale))), interpolation=interpolation)
+
+    mask = text_region_mask(gray)
+    text_pixels = mask > 0
+    text_density = float(np.count_nonzero(text_pixels)) / mask.size
+    laplacian = cv2.Laplacian(gray, cv2.CV_64F)
+    # Measured over text regions only, so sparse pages are not mistaken for blurry ones
+    sharpness = float(laplacian[text_pixels].var()) if text_density > 0 else 0.0
+    contrast = 0.0
+    if 0 < text_density < 1:
+        # Paper level outside text regions against the darkest strokes inside them
+        contrast = float(np.median(gray[~text_pixels]) - np.percentile(gray[text_pixels], 10))
+
+    return {
+        'sharpness': round(sharpness, 1),
+        'contrast': round(contrast, 1),
+        'skew_degrees': round(estimate_skew(mask), 2),
+        'text_density': round(text_density, 4),
+    }
+
+
+def predict_image_quality(metrics):
+    """Map local metrics to the same labels analyze_invoice_quality derives from the model: good / blur_maybe / blur_too_bad"""
+    if not metrics or metrics['text_density'] < MIN_TEXT_DENSITY:
+        # Blank, undecodable or photo-like input: leave the verdict to the model
+        return 'good'
+    if metrics['sharpness'] < BLUR_TOO_BAD_SHARPNESS or metrics['contrast'] < MIN_CONTRAST / 2:
+        return 'blur_too_bad'
+    if (metrics['sharpness'] < BLUR_MAYBE_SHARPNESS or metrics['contrast'] < MIN_CONTRAST
+            or abs(metrics['skew_degrees']) > MAX_SKEW_DEGREES):
+        return 'blur_maybe'
+    return 'good'
+
+
+def prescreen_image(image_data):
+    """Return (predicted condition, metrics) for encoded image bytes"""
+    metrics = measure_image_quality(image_data)
+    return predict_image_quality(metrics), metrics
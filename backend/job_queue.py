@@ -0,0 +1,237 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+import uuid
+import zipfile
+from collections import OrderedDict
+from pathlib import Path
+from process import process_pdf, process_image
+
+BATCH_WORKERS = int(os.getenv('BATCH_WORKERS', '2'))
+BATCH_QUEUE_SIZE = int(os.getenv('BATCH_QUEUE_SIZE', '500'))
+# Finished jobs kept in memory for status lookups (oldest dropped first)
+MAX_FINISHED_JOBS = int(os.getenv('MAX_FINISHED_JOBS', '5000'))
+MAX_JOB_MESSAGES = 50
+# Zip entries larger than this (uncompressed) are skipped
+MAX_DOCUMENT_BYTES = int(os.getenv('MAX_DOCUMENT_BYTES', str(100 * 1024 * 1024)))
+# Uncompressed bytes unpacked from one zip archive; later entries are skipped
+MAX_ARCHIVE_BYTES = int(os.getenv('MAX_ARCHIVE_BYTES', str(1024 * 1024 * 1024)))
+# Queued documents wait on disk here (a subdirectory per server process), not in memory
+BATCH_SPOOL_DIR = os.getenv('BATCH_SPOOL_DIR', os.path.join(tempfile.gettempdir(), 'invoice_batch_jobs'))
+
+SUPPORTED_EXTENSIONS = {'pdf', 'jpg', 'jpeg', 'png', 'webp', 'bmp', 'tif', 'tiff'}
+
+
+class QueueFullError(Exception):
+    def __init__(self, message="Job queue is full, try again later"):
+        super().__init__(message)
+
+
+class JobReporter:
+    """Stands in for the WebSocket: keeps the last progress messages and captures the saved result"""
+
+    def __init__(self, job):
+        self.job = job
+
+    async def send_text(self, text):
+        messages = self.job['messages']
+        messages.append(text)
+        if len(messages) > MAX_JOB_MESSAGES:
+            del messages[0]
+
+    async def send_json(self, data):
+        result = data.get('result', {}).get('text') if isinstance(data, dict) else None
+        if result is not None:
+            self.job['result'] = result
+
+
+def file_extension(filename):
+    return filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+
+
+def remove_spool_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def spool_file(fileobj, spool_dir):
+    """Copy a file object into spool_dir in 1 MB blocks and return the new file's path"""
+    path = os.path.join(spool_dir, uuid.uuid4().hex)
+    with open(path, 'wb') as f:
+        shutil.copyfileobj(fileobj, f, 1024 * 1024)
+    return path
+
+
+def spool_upload(filename, fileobj, spool_dir, max_documents=None):
+    """Copy an upload's documents to spool_dir, unpacking zip archives; returns (documents, skipped).
+
+    documents is [(filename, path)]; skipped is [(filename, error)] for zip entries that are
+    not taken, error being a ValueError (unsupported, too large) or a QueueFullError once
+    max_documents (the queue's free slots, None for no limit) are spooled. Directories and
+    hidden entries (such as __MACOSX/._*) are not documents and are left out silently.
+    Blocking file I/O (and decompression), so run it in a thread.
+    """
+    if max_documents == 0:
+        return [], [(filename, QueueFullError())]
+    if file_extension(filename) != 'zip':
+        return [(filename, spool_file(fileobj, spool_dir))], []
+    documents, skipped = [], []
+    unpacked = 0
+    try:
+        with zipfile.ZipFile(fileobj) as archive:
+            for info in archive.infolist():
+                name = os.path.basename(info.filename)
+                if info.is_dir() or not name or name.startswith('.'):
+                    continue
+                if file_extension(name) not in SUPPORTED_EXTENSIONS:
+                    skipped.append((name, ValueError(f"Unsupported file type: {name}")))
+                elif info.file_size > MAX_DOCUMENT_BYTES:
+                    skipped.append((name, ValueError(f"File is over the {MAX_DOCUMENT_BYTES // 2**20} MB limit")))
+                elif max_documents is not None and len(documents) >= max_documents:
+                    skipped.append((name, QueueFullError()))
+                elif unpacked + info.file_size > MAX_ARCHIVE_BYTES:
+                    skipped.append((name, ValueError(
+                        f"Archive is over the {MAX_ARCHIVE_BYTES // 2**20} MB limit (uncompressed)")))
+                else:
+                    unpacked += info.file_size
+                    with archive.open(info) as member:
+                        documents.append((name, spool_file(member, spool_dir)))
+    except Exception:
+        for _, path in documents:
+            remove_spool_file(path)
+        raise
+    return documents, skipped
+
+
+class JobQueue:
+    """Bounded in-process job queue drained by a fixed pool of worker tasks"""
+
+    def __init__(self, client, model, workers=BATCH_WORKERS, maxsize=BATCH_QUEUE_SIZE, spool_root=BATCH_SPOOL_DIR):
+        self.client = client
+        self.model = model
+        self.worker_count = max(1, workers)
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.jobs = OrderedDict()
+        self.batches = {}
+        self.workers = []
+        self.spool_root = spool_root
+        self.spool_dir = None
+
+    async def start(self):
+        os.makedirs(self.spool_root, exist_ok=True)
+        self.spool_dir = tempfile.mkdtemp(prefix='queue_', dir=self.spool_root)
+        self.workers = [asyncio.create_task(self._worker()) for _ in range(self.worker_count)]
+
+    async def stop(self):
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+        if self.spool_dir:
+            await asyncio.to_thread(shutil.rmtree, self.spool_dir, True)
+
+    def submit(self, filename, path, batch_id=None):
+        """Queue one document spooled to path (see spool_upload); the queue owns the file from here.
+
+        Raises QueueFullError when the queue is at capacity and ValueError for unsupported
+        files; the spool file is removed in both cases.
+        """
+        if file_extension(filename) not in SUPPORTED_EXTENSIONS:
+            remove_spool_file(path)
+            raise ValueError(f"Unsupported file type: {filename}")
+        job = {
+            'job_id': uuid.uuid4().hex[:12],
+            'batch_id': batch_id,
+            'filename': filename,
+            'status': 'queued',
+            'created_at': time.time(),
+            'started_at': None,
+            'finished_at': None,
+            'messages': [],
+            'result': None,
+            'error': None
+        }
+        try:
+            self.queue.put_nowait((job, path))
+        except asyncio.QueueFull:
+            remove_spool_file(path)
+            raise QueueFullError()
+        self.jobs[job['job_id']] = job
+        if batch_id:
+            self.batches.setdefault(batch_id, []).append(job['job_id'])
+        self._prune()
+        return job
+
+    def get_job(self, job_id):
+        return self.jobs.get(job_id)
+
+    def get_batch(self, batch_id):
+        job_ids = self.batches.get(batch_id)
+        if job_ids is None:
+            return None
+        jobs = [self.jobs[job_id] for job_id in job_ids if job_id in self.jobs]
+        counts = {}
+        for job in jobs:
+            counts[job['status']] = counts.get(job['status'], 0) + 1
+        return {
+            'batch_id': batch_id,
+            'total': len(job_ids),
+            'counts': counts,
+            'jobs': [job_summary(job) for job in jobs]
+        }
+
+    def free_slots(self):
+        """Documents the queue can take right now, or None if it is unbounded"""
+        return max(0, self.queue.maxsize - self.queue.qsize()) if self.queue.maxsize > 0 else None
+
+    def stats(self):
+        return {
+            'workers': self.worker_count,
+            'queued': self.queue.qsize(),
+            'capacity': self.queue.maxsize,
+            'processing': sum(1 for job in self.jobs.values() if job['status'] == 'processing')
+        }
+
+    async def _worker(self):
+        while True:
+            job, path = await self.queue.get()
+            job['status'] = 'processing'
+            job['started_at'] = time.time()
+            reporter = JobReporter(job)
+            try:
+                # PDFs are rasterised straight from the spool file; images are read in whole
+                if file_extension(job['filename']) == 'pdf':
+                    await process_pdf(path, reporter, job['filename'], self.client, self.model)
+                else:
+                    data = await asyncio.to_thread(Path(path).read_bytes)
+                    await process_image(data, reporter, job['filename'], self.client, self.model)
+                job['status'] = 'done' if job['result'] is not None else 'failed'
+                if job['status'] == 'failed':
+                    job['error'] = job['messages'][-1] if job['messages'] else 'Processing failed'
+            except Exception as e:
+                job['status'] = 'failed'
+                job['error'] = str(e)
+            finally:
+                job['finished_at'] = time.time()
+                remove_spool_file(path)
+                self.queue.task_done()
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job['status'] in ('done', 'failed')]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            job = self.jobs.pop(job_id)
+            batch = self.batches.get(job['batch_id'])
+            if batch is not None:
+                batch.remove(job_id)
+                if not batch:
+                    del self.batches[job['batch_id']]
+
+
+def job_summary(job):
+    """Job fields without the (possibly large) result and message log"""
+    return {key: job[key] for key in ('job_id', 'batch_id', 'filename', 'status', 'created_at',
+                                      'started_at', 'finished_at', 'error')}
@@ -0,0 +1,177 @@
+import json
+
+# Top-level arrays whose entries are emitted one by one instead of as a whole
+ITEMIZED_SECTIONS = ('line_items',)
+
+
+class JsonSectionStream:
+    """Incremental parser for a streamed JSON object.
+
+    feed() takes raw text chunks as they arrive and returns the sections that became
+    complete: (key, None, value) for each top-level member, plus (key, index, item)
+    for each entry of an itemised array as soon as that entry closes. Anything before
+    the first '{' (such as a ```json fence) is ignored. Each character is scanned once.
+    """
+
+    def __init__(self, itemized=ITEMIZED_SECTIONS):
+        self.itemized = set(itemized)
+        self.text = ''
+        self.position = 0
+        self.stack = []
+        self.in_string = False
+        self.escape = False
+        self.string_start = None
+        self.last_string = None
+        self.key = None
+        self.value_start = None
+        self.item_start = None
+        self.item_index = 0
+
+    def feed(self, chunk):
+        self.text += chunk
+        events = []
+        text = self.text
+        for i in range(self.position, len(text)):
+            char = text[i]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == '\\':
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+                    if len(self.stack) == 1 and self.value_start is None:
+                        self.last_string = text[self.string_start + 1:i]
+                continue
+
+            depth = len(self.stack)
+            if char == '"':
+                self.in_string = True
+                self.string_start = i
+                if depth == 1 and self.key is not None and self.value_start is None:
+                    self.value_start = i
+            elif char == ':' and depth == 1 and self.value_start is None:
+                self.key = self.last_string
+            elif char in '{[':
+                if depth == 1 and self.key is not None and self.value_start is None:
+                    self.value_start = i
+                    self.item_index = 0
+                elif depth == 2 and char == '{' and self.stack[1] == '[' and self.key in self.itemized:
+                    self.item_start = i
+                self.stack.append(char)
+            elif char in '}]':
+                if not self.stack:
+                    continue
+                self.stack.pop()
+                depth = len(self.stack)
+                if depth == 2 and self.item_start is not None:
+                    events.append(self._decode(self.key, self.item_index, text[self.item_start:i + 1]))
+                    self.item_start = None
+                    self.item_index += 1
+                elif depth == 1 and self.value_start is not None:
+                    events.append(self._decode(self.key, None, text[self.value_start:i + 1]))
+                    self._end_member()
+                elif depth == 0 and self.value_start is not None:
+                    # Root closed right after a scalar value
+                    events.append(self._decode(self.key, None, text[self.value_start:i]))
+                    self._end_member()
+            elif char == ',' and depth == 1 and self.value_start is not None:
+                events.append(self._decode(self.key, None, text[self.value_start:i]))
+                self._end_member()
+            elif depth == 1 and self.key is not None and self.value_start is None and not char.isspace():
+                # Start of a number, true, false or null
+                self.value_start = i
+        self.position = len(text)
+        return [event for event in events if event is not None]
+
+    def _end_member(self):
+        self.key = None
+        self.value_start = None
+        self.last_string = None
+
+    @staticmethod
+    def _decode(key, index, raw):
+        try:
+            return key, index, json.loads(raw)
+        except json.JSONDecodeError:
+            return None
+
+
+class _Frame:
+    """An open object or array while scanning, with the cut that would drop it entirely"""
+    __slots__ = ('kind', 'expect_key', 'nested', 'cut_before')
+
+    def __init__(self, kind, cut_before):
+        self.kind = kind
+        self.expect_key = kind == '{'
+        self.nested = False
+        self.cut_before = cut_before
+
+
+def repair_truncated_json(content):
+    """Cut a possibly truncated JSON document back to its last complete value and close it.
+
+    Single pass with a stack of open containers; quotes, braces and brackets inside
+    strings are ignored, and containers are closed innermost first. Keys without a
+    value, half-written strings, numbers and literals are dropped. An unfinished flat
+    object inside an array (a line item, say) is dropped as a whole so every item kept
+    is complete. Text before the first '{' or '[' and after the root closes (markdown
+    fences) is removed. Returns the input stripped if it contains no JSON container.
+    """
+    text = content.strip()
+    start = min((i for i in (text.find('{'), text.find('[')) if i >= 0), default=-1)
+    if start < 0:
+        return text
+
+    stack = []
+    in_string = escape = in_scalar = False
+    string_is_key = False
+    safe = start  # text[start:safe] plus closers for the current stack is valid JSON
+    for i in range(start, len(text)):
+        char = text[i]
+        if in_string:
+            if escape:
+                escape = False
+            elif char == '\\':
+                escape = True
+            elif char == '"':
+                in_string = False
+                if not string_is_key:
+                    safe = i + 1
+            continue
+
+        if in_scalar:
+            if char in ',}] \t\r\n':
+                in_scalar = False
+                safe = i
+            else:
+                continue
+
+        top = stack[-1] if stack else None
+        if char == '"':
+            in_string = True
+            string_is_key = top is not None and top.kind == '{' and top.expect_key
+        elif char in '{[':
+            if top is not None:
+                top.nested = True
+            stack.append(_Frame(char, safe))
+            safe = i + 1
+        elif char in '}]':
+            stack.pop()
+            safe = i + 1
+            if not stack:
+                return text[start:safe]
+        elif char == ':':
+            if top is not None:
+                top.expect_key = False
+        elif char == ',':
+            if top is not None and top.kind == '{':
+                top.expect_key = True
+        elif not char.isspace():
+            in_scalar = True
+
+    if stack and stack[-1].kind == '{' and not stack[-1].nested and len(stack) > 1 and stack[-2].kind == '[':
+        # Unfinished record in an array: keep only the records before it
+        safe = stack.pop().cut_before
+    closers = ''.join('}' if frame.kind == '{' else ']' for frame in reversed(stack))
+    return text[start:safe] + closers
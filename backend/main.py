@@ -1,65 +1,205 @@
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, UploadFile, File
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
+from typing import List, Optional
+from dotenv import load_dotenv
+import asyncio
 import json
-from process import process_pdf, process_image
-app = FastAPI()
+import uuid
+import zipfile
+from pathlib import Path
 
-# Enable CORS for all origins (for both REST API and WebSockets)
-origins = [
-    "http://localhost:5173",  # Your React app's frontend URL
-    "http://localhost:3000",  # If you use another port, you can add that too
-]
+# Load .env before importing modules that read settings at import time
+load_dotenv()
 
+from process import process_pdf, process_image, create_results_directory
+from model_client import create_model_client, close_model_client
+from extraction_cache import get_extraction_cache
+from results_index import sync_results_index, query_results, get_result_entry
+from job_queue import JobQueue, QueueFullError, SUPPORTED_EXTENSIONS, file_extension, job_summary, spool_upload
+from cpu_pool import shutdown_cpu_executor
+from tracing import render_metrics
+from settings import load_settings
+from uploads import UploadError, UploadStore, parse_upload_start, receive_chunked_upload, remove_spool_file
+
+# Read once at import: CORS must be configured before the app starts
+settings = load_settings()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Configuration and shared clients are set up once here; connection handlers only read app.state
+    app.state.settings = settings
+    # One pooled model client for the whole process, shared by every connection
+    app.state.model_client = create_model_client()
+    app.state.model_name = settings.model_name
+    # Bring the results index up to date with anything stored while the app was down
+    app.state.results_dir = create_results_directory()
+    await asyncio.to_thread(sync_results_index, app.state.results_dir)
+    # /ws uploads are spooled here; partial uploads from before a restart cannot be resumed
+    app.state.upload_store = UploadStore()
+    await asyncio.to_thread(app.state.upload_store.reset)
+    # Batch uploads are processed by a fixed pool of background workers
+    app.state.job_queue = JobQueue(app.state.model_client, app.state.model_name)
+    await app.state.job_queue.start()
+    try:
+        yield
+    finally:
+        await app.state.job_queue.stop()
+        await close_model_client(app.state.model_client)
+        shutdown_cpu_executor()
+
+
+app = FastAPI(lifespan=lifespan)
+
+# Enable CORS for the frontend origins (for both REST API and WebSockets), see CORS_ORIGINS
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=origins,  # Allows CORS from these origins
+    allow_origins=list(settings.cors_origins),  # Allows CORS from these origins
     allow_credentials=True,
     allow_methods=["*"],  # Allow all HTTP methods (GET, POST, PUT, DELETE, etc.)
     allow_headers=["*"],  # Allow all headers
 )
 
+@app.get("/cache/stats")
+async def cache_stats():
+    cache = get_extraction_cache()
+    if cache is None:
+        return JSONResponse({"backend": "off"})
+    return cache.stats()
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Per-stage latency histograms, byte and token counters in the Prometheus text format"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/results")
+async def list_results(
+    vendor: Optional[str] = None,
+    invoice_number: Optional[str] = None,
+    gst_number: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    amount_min: Optional[float] = None,
+    amount_max: Optional[float] = None,
+    page: int = 1,
+    page_size: int = 50,
+):
+    """Search stored extractions by vendor prefix, invoice number, GST number, invoice date and total amount"""
+    return await asyncio.to_thread(
+        query_results, app.state.results_dir,
+        vendor=vendor, invoice_number=invoice_number, gst_number=gst_number,
+        date_from=date_from, date_to=date_to, amount_min=amount_min, amount_max=amount_max,
+        page=page, page_size=page_size
+    )
+
+@app.get("/results/{result_id}")
+async def get_result(result_id: str):
+    entry = await asyncio.to_thread(get_result_entry, result_id, app.state.results_dir)
+    if entry is None:
+        return JSONResponse({"error": "Result not found"}, status_code=404)
+    return entry
+
+@app.post("/batch")
+async def upload_batch(files: List[UploadFile] = File(...)):
+    """Queue many invoices (individual files and/or zip archives) for background processing"""
+    job_queue = app.state.job_queue
+    batch_id = uuid.uuid4().hex[:12]
+    accepted, rejected = [], []
+    queue_full = False
+    for upload in files:
+        if file_extension(upload.filename) not in SUPPORTED_EXTENSIONS | {'zip'}:
+            rejected.append({"filename": upload.filename, "reason": f"Unsupported file type: {upload.filename}"})
+            continue
+        # Copied (and unzipped) from the request's temp file to the queue's spool directory, off the loop;
+        # no more documents than the queue has room for
+        try:
+            documents, skipped = await asyncio.to_thread(
+                spool_upload, upload.filename, upload.file, job_queue.spool_dir, job_queue.free_slots()
+            )
+        except zipfile.BadZipFile:
+            rejected.append({"filename": upload.filename, "reason": "Invalid zip archive"})
+            continue
+        for filename, error in skipped:
+            queue_full = queue_full or isinstance(error, QueueFullError)
+            rejected.append({"filename": filename, "reason": str(error)})
+        for filename, path in documents:
+            try:
+                accepted.append(job_summary(job_queue.submit(filename, path, batch_id)))
+            except QueueFullError as e:
+                queue_full = True
+                rejected.append({"filename": filename, "reason": str(e)})
+            except ValueError as e:
+                rejected.append({"filename": filename, "reason": str(e)})
+    # 503 (retry later) only when the queue turned files away; invalid uploads are the client's error
+    status_code = 202 if accepted else 503 if queue_full else 400
+    return JSONResponse({"batch_id": batch_id, "jobs": accepted, "rejected": rejected}, status_code=status_code)
+
+@app.get("/batches/{batch_id}")
+async def get_batch(batch_id: str):
+    batch = app.state.job_queue.get_batch(batch_id)
+    if batch is None:
+        return JSONResponse({"error": "Batch not found"}, status_code=404)
+    return batch
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = app.state.job_queue.get_job(job_id)
+    if job is None:
+        return JSONResponse({"error": "Job not found"}, status_code=404)
+    return job
+
+@app.get("/jobs")
+async def job_queue_stats():
+    return app.state.job_queue.stats()
+
 # WebSocket endpoint to process the file
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
+    client = websocket.app.state.model_client
+    model = websocket.app.state.model_name
 
+    spool_path = None
     try:
-        json_file_path = "invoice_result.json"
-        with open(json_file_path, "r", encoding="utf-8") as f:
-            file_data = json.load(f)
-        # Receive the file from the frontend (simulated by the uploaded file path here)
-        file_name = await websocket.receive_text() 
-        uploaded_file = await websocket.receive_bytes()  # Get file in bytes
-        
-
-        # # Save the uploaded file
-        #  # Generate a unique file name
-        # file_path = os.path.join("uploads", file_name)
-        # os.makedirs(os.path.dirname(file_path), exist_ok=True)
-        
-        # with open(file_path, "wb") as f:
-        #     f.write(uploaded_file)
+        # Chunked uploads (see uploads.receive_chunked_upload) are spooled to disk; older clients
+        # send the filename and then the whole file in one frame
+        first_message = await websocket.receive_text()
+        upload_request = parse_upload_start(first_message)
+        if upload_request is not None:
+            try:
+                file_name, spool_path = await receive_chunked_upload(
+                    websocket, upload_request, websocket.app.state.upload_store
+                )
+            except UploadError as e:
+                await websocket.send_text(json.dumps({"type": "upload_error", "message": str(e)}))
+                await websocket.close(code=1008)
+                return
+            # PDFs are rasterised straight from the spool file
+            uploaded_file = spool_path
+        else:
+            file_name = first_message
+            uploaded_file = await websocket.receive_bytes()  # Get file in bytes
 
         # Send the file format
         file_extension = file_name.split('.')[-1].lower()
         await websocket.send_text(json.dumps({"message" : f"File format: {file_extension.upper()}", "type" : "success", "finished" : True} ))
-        print(file_data)
         # Send the file size
         # file_size = os.path.getsize(file_path)
         # await websocket.send_text(f"File size: {file_size} bytes")
 
         if file_extension == "pdf":
             await websocket.send_text("📄 **PDF file detected**")
-            # await websocket.send_json({"result" : {"text" : file_data} })
-            processing_result = await process_pdf(uploaded_file, websocket, file_name)
+            processing_result = await process_pdf(uploaded_file, websocket, file_name, client, model)
             
         else:
             #  await process_image(uploaded_file, websocket, file_name)
             await websocket.send_text("📄 **Image detected**")
-            await process_image(uploaded_file, websocket, file_name)     
-            # await websocket.send_json({"result" : {"text" : file_data} })
+            if spool_path:
+                uploaded_file = await asyncio.to_thread(Path(spool_path).read_bytes)
+            await process_image(uploaded_file, websocket, file_name, client, model)
 
               # Simulate processing completion
         await websocket.send_text(json.dumps({"message" : "File uploaded and processed successfully!", "type" : "success"}))
@@ -67,3 +207,6 @@ async def websocket_endpoint(websocket: WebSocket):
         print("Client disconnected")
     except Exception as e:
         print(e)
+    finally:
+        if spool_path:
+            remove_spool_file(spool_path)
@@ -0,0 +1,48 @@
+import os
+import httpx
+from openai import AsyncOpenAI
+
+# Connection pool and timeout settings for the shared model client
+OPENAI_MAX_CONNECTIONS = int(os.getenv('OPENAI_MAX_CONNECTIONS', '20'))
+OPENAI_MAX_KEEPALIVE = int(os.getenv('OPENAI_MAX_KEEPALIVE', '10'))
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv('OPENAI_KEEPALIVE_EXPIRY', '60'))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv('OPENAI_CONNECT_TIMEOUT', '10'))
+OPENAI_TIMEOUT = float(os.getenv('OPENAI_TIMEOUT', '120'))
+# Retries inside the SDK; model_scheduler retries (quota-aware) on top of these
+OPENAI_MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', '0'))
+
+
+def create_model_client(api_key=None, base_url=None):
+    """Create the process-wide AsyncOpenAI client backed by a keep-alive connection pool.
+
+    Returns None when no API key is configured.
+    """
+    api_key = api_key or os.getenv('OPENAI_API_KEY')
+    if not api_key:
+        return None
+
+    http_client = httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+            keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY
+        ),
+        timeout=httpx.Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT)
+    )
+    return AsyncOpenAI(
+        api_key=api_key,
+        base_url=base_url or os.getenv('OPENAI_BASE_URL') or None,
+        http_client=http_client,
+        max_retries=OPENAI_MAX_RETRIES
+    )
+
+
+def get_model_name():
+    """Model used for extraction"""
+    return os.getenv('OPENAI_MODEL', 'gpt-4o')
+
+
+async def close_model_client(client):
+    """Release the pooled connections held by the client"""
+    if client is not None:
+        await client.close()
@@ -0,0 +1,225 @@
+import asyncio
+import base64
+import os
+import random
+import time
+from io import BytesIO
+
+import openai
+from PIL import Image
+
+from render_policy import estimate_image_tokens
+from tracing import annotate, count_attempt
+
+# Provider quota per minute (0 = no client-side limit). Requests wait for budget
+# instead of being sent into a 429.
+MODEL_RPM_LIMIT = float(os.getenv('MODEL_RPM_LIMIT', '0'))
+MODEL_TPM_LIMIT = float(os.getenv('MODEL_TPM_LIMIT', '0'))
+# Seconds of quota that may be spent in one burst; providers enforce per-minute limits
+# over shorter periods too
+MODEL_RATE_BURST_SECONDS = float(os.getenv('MODEL_RATE_BURST_SECONDS', '10'))
+# Attempts per model call on 429s, timeouts, connection errors and 5xx responses
+MODEL_MAX_ATTEMPTS = int(os.getenv('MODEL_MAX_ATTEMPTS', '6'))
+# Exponential backoff with full jitter: a random wait up to min(max, base * 2^retry) seconds
+MODEL_BACKOFF_BASE = float(os.getenv('MODEL_BACKOFF_BASE', '1.0'))
+MODEL_BACKOFF_MAX = float(os.getenv('MODEL_BACKOFF_MAX', '60'))
+# Seconds one model call may take in total, including queueing for budget and retries
+MODEL_REQUEST_DEADLINE = float(os.getenv('MODEL_REQUEST_DEADLINE', '300'))
+
+# Errors worth another attempt; anything else (bad request, auth, ...) fails at once
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError,
+                    openai.InternalServerError, asyncio.TimeoutError)
+
+
+class ModelCallFailed(Exception):
+    """A model call ran out of attempts or hit its deadline; the message says why"""
+
+
+class TokenBucket:
+    """Budget that refills continuously at rate units/second up to capacity.
+
+    A request larger than the whole capacity is let through once the bucket is full and
+    drives it negative, so later requests wait for the debt to be paid back.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = max(capacity, 1.0)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """Seconds until amount can be taken (0 = now)"""
+        self.refill()
+        needed = min(amount, self.capacity)
+        return max(0.0, (needed - self.level) / self.rate)
+
+    def take(self, amount):
+        self.refill()
+        self.level -= amount
+
+    def give_back(self, amount):
+        self.refill()
+        self.level = min(self.capacity, self.level + amount)
+
+
+def make_bucket(per_minute, burst_seconds=MODEL_RATE_BURST_SECONDS):
+    if not per_minute:
+        return None
+    rate = per_minute / 60
+    return TokenBucket(rate, rate * burst_seconds)
+
+
+def retry_after_seconds(error):
+    """Server-requested wait from the Retry-After (or OpenAI's retry-after-ms) header, or None"""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000
+        if headers.get('retry-after'):
+            return float(headers['retry-after'])
+    except ValueError:
+        pass
+    return None
+
+
+def estimate_request_tokens(messages, max_tokens):
+    """Tokens the provider counts against the quota: the prompt plus max_tokens.
+
+    Text is estimated at ~4 characters per token; images from their size after the
+    model's resize (only the image header is decoded).
+    """
+    tokens = max_tokens or 0
+    for message in messages:
+        content = message.get('content')
+        parts = content if isinstance(content, list) else [{'type': 'text', 'text': content or ''}]
+        for part in parts:
+            if part.get('type') == 'text':
+                tokens += len(part.get('text') or '') // 4
+            elif part.get('type') == 'image_url':
+                url = part['image_url']['url']
+                try:
+                    width, height = Image.open(BytesIO(base64.b64decode(url.split(',', 1)[1]))).size
+                    tokens += estimate_image_tokens(width, height)
+                except Exception:
+                    tokens += estimate_image_tokens(2048, 2048)
+    return tokens
+
+
+class ModelScheduler:
+    """Admission control and retries for every model call in the process.
+
+    Calls wait for request and token budget (token buckets sized from the provider quota),
+    then run; 429s, timeouts and server errors are retried with jittered exponential
+    backoff. A Retry-After from the server pauses all calls, not just the one that got it,
+    since the quota is shared. Each call has one overall deadline.
+    """
+
+    def __init__(self, rpm=MODEL_RPM_LIMIT, tpm=MODEL_TPM_LIMIT, max_attempts=MODEL_MAX_ATTEMPTS,
+                 backoff_base=MODEL_BACKOFF_BASE, backoff_max=MODEL_BACKOFF_MAX,
+                 deadline=MODEL_REQUEST_DEADLINE, burst_seconds=MODEL_RATE_BURST_SECONDS):
+        self.requests = make_bucket(rpm, burst_seconds)
+        self.tokens = make_bucket(tpm, burst_seconds)
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.deadline = deadline
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+        self.stats = {'calls': 0, 'attempts': 0, 'rate_limited': 0, 'retried': 0, 'failed': 0, 'waited_s': 0.0}
+
+    async def acquire(self, tokens, deadline_at):
+        """Wait (in arrival order) until the quota has room for one request of this many tokens"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                wait = self.paused_until - now
+                for bucket, amount in ((self.requests, 1), (self.tokens, tokens)):
+                    if bucket is not None:
+                        wait = max(wait, bucket.wait_time(amount))
+                if wait <= 0:
+                    break
+                if now + wait > deadline_at:
+                    raise ModelCallFailed(f"quota wait of {wait:.0f}s would pass the deadline")
+                self.stats['waited_s'] += wait
+                annotate(quota_wait_s=round(wait, 3))
+                await asyncio.sleep(wait)
+            if self.requests is not None:
+                self.requests.take(1)
+            if self.tokens is not None:
+                self.tokens.take(tokens)
+
+    def settle(self, tokens, usage):
+        """Return the part of a tokens reservation the answer did not use (usage as reported by the API).
+
+        The estimate reserved max_tokens. run() settles regular responses itself; streamed ones
+        are settled from their final usage chunk.
+        """
+        if self.tokens is not None and usage is not None:
+            self.tokens.give_back(max(0, tokens - usage.total_tokens))
+
+    def backoff(self, retry):
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** retry))
+
+    async def run(self, send, tokens=0, deadline=None):
+        """Await send() (a zero-argument coroutine function) under the quota, retrying transient errors.
+
+        Returns its result, or raises ModelCallFailed once attempts or the deadline run out;
+        other API errors are raised unchanged.
+        """
+        self.stats['calls'] += 1
+        deadline_at = time.monotonic() + (deadline or self.deadline)
+        last_error = None
+        for attempt in range(self.max_attempts):
+            await self.acquire(tokens, deadline_at)
+            self.stats['attempts'] += 1
+            try:
+                result = await asyncio.wait_for(send(), timeout=deadline_at - time.monotonic())
+            except RETRYABLE_ERRORS as e:
+                last_error = e
+                count_attempt('rate_limited' if isinstance(e, openai.RateLimitError) else 'retryable_error')
+            else:
+                count_attempt('ok')
+                self.settle(tokens, getattr(result, 'usage', None))
+                return result
+
+            retry_after = retry_after_seconds(last_error)
+            if isinstance(last_error, openai.RateLimitError):
+                self.stats['rate_limited'] += 1
+                if retry_after is not None:
+                    self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+            # Jitter on top of Retry-After too, or every waiting call retries at the same instant
+            delay = (retry_after or 0) + self.backoff(attempt)
+            if attempt + 1 == self.max_attempts or time.monotonic() + delay >= deadline_at:
+                break
+            self.stats['retried'] += 1
+            annotate(retries=attempt + 1)
+            print(f"⏳ Model call failed ({type(last_error).__name__}); retry {attempt + 1} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+        self.stats['failed'] += 1
+        reason = type(last_error).__name__ if last_error else 'no attempt made'
+        raise ModelCallFailed(f"model call failed after {attempt + 1} attempt(s): {reason}") from last_error
+
+
+_model_scheduler = None
+
+
+def get_model_scheduler():
+    """Process-wide scheduler shared by every model call, created on first use"""
+    global _model_scheduler
+    if _model_scheduler is None:
+        _model_scheduler = ModelScheduler()
+    return _model_scheduler
+
+
+def set_model_scheduler(scheduler):
+    """Replace the process-wide scheduler (benchmarks use this to compare settings)"""
+    global _model_scheduler
+    _model_scheduler = scheduler
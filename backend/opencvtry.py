@@ -18,6 +18,8 @@ import numpy as np
 from pathlib import Path
 import warnings
 import fitz  # PyMuPDF
+from json_stream import repair_truncated_json
+from results_store import append_result_entry, get_store_summary, read_recent_results, master_results_path
 warnings.filterwarnings("ignore")
 
 
@@ -252,39 +254,8 @@ def enhance_currency_detection(result):
     return result
 
 def clean_json_response(content):
-    """Clean markdown formatting and fix truncated JSON"""
-    content = content.strip()
-    
-    # Remove code block markers
-    if content.startswith('```json'):
-        content = content[7:]  # Remove ```
-    elif content.startswith('```'):
-        content = content[3:]   # Remove ```
-    
-    if content.endswith('```'):
-        content = content[:-3]  # Remove trailing ```
-    
-    content = content.strip()
-    
-    # 🔧 NEW: Fix common JSON truncation issues for large documents
-    if not content.endswith('}'):
-        # Remove trailing commas and incomplete entries
-        content = content.rstrip(',\n\r\t ')
-        
-        # Try to close incomplete strings
-        if content.count('"') % 2 == 1:
-            content += '"'
-        
-        # Close incomplete objects and arrays
-        open_braces = content.count('{') - content.count('}')
-        open_brackets = content.count('[') - content.count(']')
-        
-        if open_brackets > 0:
-            content += ']' * open_brackets
-        if open_braces > 0:
-            content += '}' * open_braces
-    
-    return content
+    """Strip markdown fences and repair truncated JSON, keeping every complete line item"""
+    return repair_truncated_json(content)
 
 def create_results_directory():
     """Create results directory if it doesn't exist"""
@@ -325,8 +296,6 @@ def save_result_to_file(result, filename, results_dir="resultjson"):
 
 def append_to_master_results(result, filename, results_dir="resultjson"):
     """Append result to master results file"""
-    master_file = os.path.join(results_dir, "all_results.json")
-    
     # Create timestamp and unique ID
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     unique_id = str(uuid.uuid4())[:8]
@@ -340,49 +309,13 @@ def append_to_master_results(result, filename, results_dir="resultjson"):
         "extraction_data": result
     }
     
-    # Load existing results or create new list
-    if os.path.exists(master_file):
-        try:
-            with open(master_file, 'r', encoding='utf-8') as f:
-                all_results = json.load(f)
-            if not isinstance(all_results, list):
-                all_results = [all_results]  # Convert single object to list
-        except (json.JSONDecodeError, FileNotFoundError):
-            all_results = []
-    else:
-        all_results = []
-    
-    # Append new result
-    all_results.append(new_entry)
-    
-    # Save back to master file
-    with open(master_file, 'w', encoding='utf-8') as f:
-        json.dump(all_results, f, indent=2, ensure_ascii=False)
-    
-    return master_file, len(all_results)
+    # O(1) locked append to the JSON Lines store (migrates all_results.json on first use)
+    return append_result_entry(new_entry, results_dir)
 
 def get_results_summary(results_dir="resultjson"):
     """Get summary of all stored results"""
-    master_file = os.path.join(results_dir, "all_results.json")
-    
-    if not os.path.exists(master_file):
-        return {"total_files": 0, "latest_processing": None}
-    
     try:
-        with open(master_file, 'r', encoding='utf-8') as f:
-            all_results = json.load(f)
-        
-        if not isinstance(all_results, list):
-            all_results = [all_results]
-        
-        total_files = len(all_results)
-        latest_processing = all_results[-1]["processing_date"] if all_results else None
-        
-        return {
-            "total_files": total_files,
-            "latest_processing": latest_processing,
-            "results_directory": results_dir
-        }
+        return get_store_summary(results_dir)
     except:
         return {"total_files": 0, "latest_processing": None}
 
@@ -1282,7 +1215,7 @@ def main():
             st.info(f"🕐 **Latest:** {summary['latest_processing']}")
             
             # Download master results file
-            master_file_path = os.path.join("resultjson", "all_results.json")
+            master_file_path = master_results_path("resultjson")
             if os.path.exists(master_file_path):
                 with open(master_file_path, 'r', encoding='utf-8') as f:
                     master_data = f.read()
@@ -1290,8 +1223,8 @@ def main():
                 st.download_button(
                     label="📥 Download All Results",
                     data=master_data,
-                    file_name=f"all_invoice_results_{datetime.now().strftime('%Y%m%d')}.json",
-                    mime="application/json",
+                    file_name=f"all_invoice_results_{datetime.now().strftime('%Y%m%d')}.jsonl",
+                    mime="application/x-ndjson",
                     use_container_width=True
                 )
             
@@ -1376,7 +1309,7 @@ def main():
                                 
                                 st.success(f"💾 **Results automatically saved:**")
                                 st.write(f"📁 **Individual file:** `{os.path.basename(individual_file)}`")
-                                st.write(f"📋 **Master file:** `all_results.json` (Total: {total_count} documents)")
+                                st.write(f"📋 **Master file:** `all_results.jsonl` (Total: {total_count} documents)")
                                 
                             except Exception as e:
                                 st.error(f"❌ Failed to save results: {e}")
@@ -1440,7 +1373,7 @@ def main():
                                 st.success("✅ Invoice processed successfully!")
                                 st.success(f"💾 **Results automatically saved:**")
                                 st.write(f"📁 **Individual file:** `{os.path.basename(individual_file)}`")
-                                st.write(f"📋 **Master file:** `all_results.json` (Total: {total_count} documents)")
+                                st.write(f"📋 **Master file:** `all_results.jsonl` (Total: {total_count} documents)")
                                 st.write(f"📂 **Location:** `{results_dir}/`")
                                 
                             except Exception as e:
@@ -1500,17 +1433,16 @@ def main():
             st.header("📁 Processing History")
             
             # Show master results if available
-            master_file_path = os.path.join("resultjson", "all_results.json")
-            if os.path.exists(master_file_path):
+            summary = get_results_summary()
+            if summary["total_files"] > 0:
                 try:
-                    with open(master_file_path, 'r', encoding='utf-8') as f:
-                        all_results = json.load(f)
+                    recent_results = read_recent_results("resultjson", limit=10)
                     
-                    if isinstance(all_results, list) and all_results:
-                        st.write(f"**📊 Total Processed: {len(all_results)} documents**")
+                    if recent_results:
+                        st.write(f"**📊 Total Processed: {summary['total_files']} documents**")
                         
                         # Show recent results
-                        for i, entry in enumerate(reversed(all_results[-10:])):  # Show last 10
+                        for i, entry in enumerate(reversed(recent_results)):  # Show last 10
                             with st.expander(f"📄 {entry.get('source_filename', 'Unknown')} - {entry.get('processing_date', 'Unknown date')}"):
                                 if 'extraction_data' in entry:
                                     # Handle both PDF and single image results
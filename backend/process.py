@@ -1,4 +1,3 @@
-import tempfile
 import fitz
 import asyncio
 import os
@@ -6,33 +5,50 @@ import cv2
 import json
 import uuid
 import numpy as np
+from functools import partial
 from datetime import datetime
 from PIL import Image, ImageEnhance
 from io import BytesIO
 from pathlib import Path
-from openai import OpenAI
-from gptprocesses import try_process_image
+from gptprocesses import (
+    try_process_image, try_process_image_batch, try_process_text, set_partial_page, EXTRACTION_PROMPT_VERSION,
+    TILE_ATTEMPT_NOTE
+)
+from text_layer import get_page_text, OPENAI_TEXT_MODEL
+from extraction_cache import get_extraction_cache, make_cache_key
+from results_store import append_result_entry
+from results_index import sync_results_index
+from cpu_pool import run_cpu_bound, run_pdf_bound
+from model_scheduler import ModelCallFailed
+from tracing import annotate, traced
+from image_quality import QUALITY_PRESCREEN, prescreen_image
+from tiling import TILED_EXTRACTION, plan_tiles, tile_image, crop_bands, stitch_tile_results, merge_line_items
+from table_structure import TABLE_ROW_CHECK, detect_table_rows, missing_row_bands
+from render_policy import (
+    RENDER_POLICY, choose_render_settings, escalated_render_settings,
+    render_page, render_pdf_page, fit_image_bytes, open_pdf
+)
+
+# Maximum number of PDF pages sent to the model at the same time
+PAGE_CONCURRENCY = int(os.getenv('PAGE_CONCURRENCY', '4'))
+# PDF pages packed into one model request (1 = one request per page)
+PAGE_BATCH_SIZE = int(os.getenv('PAGE_BATCH_SIZE', '1'))
+
 # Simulated PDF processing function
-async def process_pdf(uploaded_file, websocket, filename):
+@traced('process_pdf')
+async def process_pdf(uploaded_file, websocket, filename, client, model):
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-            tmp_file.write(uploaded_file)
-            tmp_path = tmp_file.name
-
-        page_count = get_pdf_page_count(tmp_path)
+        page_count = await run_pdf_bound(get_pdf_page_count, uploaded_file)
+        annotate(bytes=document_size(uploaded_file), pages=page_count)
         await websocket.send_text(f"📊 **Pages:** {page_count}")
 
         results_dir = create_results_directory()
                     
                     # Process multi-page PDF  
-        result = await process_multi_page_pdf(tmp_path, filename, websocket)
+        result = await process_multi_page_pdf(uploaded_file, filename, websocket, client, model,
+                                              page_count=page_count)
         
         
-
-        # await websocket.send_text(result_json)
-        # Clean up temp PDF file
-        os.unlink(tmp_path)
-        
         if result:
             
         #     # Store result in session state
@@ -48,18 +64,19 @@ async def process_pdf(uploaded_file, websocket, filename):
         #             # Save individual file
             try:
 
-                individual_file, enhanced_result = save_result_to_file(
-                    result, filename, results_dir
+                individual_file, enhanced_result = await asyncio.to_thread(
+                    save_result_to_file, result, filename, results_dir
                 )
 
-        #                 # Append to master results
-                master_file, total_count = append_to_master_results(
-                    result, filename, results_dir
+        #                 # Append to master results (flock + fsync, so off the event loop)
+                master_file, total_count = await asyncio.to_thread(
+                    append_to_master_results, result, filename, results_dir
                 )
+                await refresh_results_index(results_dir)
                 await websocket.send_json({"result" : {"text" : enhanced_result} })
                 await websocket.send_text(f"💾 **Results automatically saved:**")
                 await websocket.send_text(f"📁 **Individual file:** `{os.path.basename(individual_file)}`")
-                await websocket.send_text(f"📋 **Master file:** `all_results.json` (Total: {total_count} documents)")
+                await websocket.send_text(f"📋 **Master file:** `all_results.jsonl` (Total: {total_count} documents)")
                     
             except Exception as e:
                 await websocket.send_text(f"❌ Failed to save results: {e}")
@@ -79,24 +96,25 @@ async def process_pdf(uploaded_file, websocket, filename):
         await websocket.send_text(f"Error {e}")
 
 
-async def process_image(uploaded_file, websocket, filename):
+@traced('process_image')
+async def process_image(uploaded_file, websocket, filename, client, model):
+        annotate(bytes=len(uploaded_file))
         try:
     # IMAGE PROCESSING (your existing code)
                 image = Image.open(BytesIO(uploaded_file))
-                                
-                
-                with tempfile.NamedTemporaryFile(delete=False, suffix=f".{filename.split('.')[-1]}") as tmp_file:
-                    tmp_file.write(uploaded_file)
-                    tmp_path = tmp_file.name
                 
                 # Create results directory
                 results_dir = create_results_directory()
                 
-                # Process with smart retry
-                result = await process_invoice_with_retry(tmp_path,websocket)
-                
-                # Clean up temp file
-                os.unlink(tmp_path)
+                # Process with smart retry, straight from the uploaded bytes
+                # (downscaled to what the model actually uses)
+                image_data = await run_cpu_bound(fit_image_bytes, uploaded_file)
+                set_partial_page(1)
+                rerender = None
+                if escalated_render_settings() and image_data != uploaded_file:
+                    # 'fixed' leaves the upload at full resolution
+                    rerender = partial(fit_image_bytes, uploaded_file, 'fixed')
+                result = await process_invoice_with_retry(image_data, websocket, client, model, rerender=rerender)
                 
                 if result:
                     # Store result in session state
@@ -122,20 +140,21 @@ async def process_image(uploaded_file, websocket, filename):
                     
                     try:
                         # Save individual file
-                        individual_file, enhanced_result = save_result_to_file(
-                            result, filename, results_dir
+                        individual_file, enhanced_result = await asyncio.to_thread(
+                            save_result_to_file, result, filename, results_dir
                         )
                         
-                        # Append to master results
-                        master_file, total_count = append_to_master_results(
-                            result, filename, results_dir
+                        # Append to master results (flock + fsync, so off the event loop)
+                        master_file, total_count = await asyncio.to_thread(
+                            append_to_master_results, result, filename, results_dir
                         )
+                        await refresh_results_index(results_dir)
                         
                         # Success messages
                         await websocket.send_json({"result" : {"text" : enhanced_result} })
                         await websocket.send_text(f"💾 **Results automatically saved:**")
                         await websocket.send_text(f"📁 **Individual file:** `{os.path.basename(individual_file)}`")
-                        await websocket.send_text(f"📋 **Master file:** `all_results.json` (Total: {total_count} documents)")
+                        await websocket.send_text(f"📋 **Master file:** `all_results.jsonl` (Total: {total_count} documents)")
                         await websocket.send_text(f"📂 **Location:** `{results_dir}/`")
                         
                     except Exception as e:
@@ -147,10 +166,16 @@ async def process_image(uploaded_file, websocket, filename):
         except Exception as e:
             await websocket.send_text(f"Error {e}")
 
-def get_pdf_page_count(pdf_path):
+def document_size(data):
+    """Size in bytes of an upload held in memory or spooled to a file"""
+    if isinstance(data, (bytes, bytearray)):
+        return len(data)
+    return os.path.getsize(data)
+
+def get_pdf_page_count(pdf_data):
     """Get number of pages in PDF"""
     try:
-        doc = fitz.open(pdf_path)
+        doc = open_pdf(pdf_data)
         page_count = len(doc)
         doc.close()
         return page_count
@@ -164,10 +189,16 @@ def create_results_directory():
         os.makedirs(results_dir)
     return results_dir
 
-async def process_multi_page_pdf(pdf_path, uploaded_filename, ws):
-    """Process multi-page PDF with smart retry for each page"""
-    # Get page count
-    page_count = get_pdf_page_count(pdf_path)
+async def process_multi_page_pdf(pdf_data, uploaded_filename, ws, client, model, max_concurrency=PAGE_CONCURRENCY,
+                                 policy=RENDER_POLICY, batch_size=PAGE_BATCH_SIZE, page_count=None):
+    """Process multi-page PDF with smart retry for each page, up to max_concurrency requests at once.
+
+    With batch_size > 1, consecutive pages are packed into one model request and
+    max_concurrency limits batches in flight rather than pages. page_count is counted
+    here unless the caller already did.
+    """
+    if page_count is None:
+        page_count = await run_pdf_bound(get_pdf_page_count, pdf_data)
     
     if page_count == 0:
         await ws.send_text("❌ Invalid PDF or no pages found")
@@ -175,65 +206,32 @@ async def process_multi_page_pdf(pdf_path, uploaded_filename, ws):
     print("Page cnt",page_count)
     await ws.send_text(f"📄 **PDF detected with {page_count} pages**")
     
-    # Convert PDF to images
-    # with st.spinner('🔄 Converting PDF pages to images...'):
-    #NEED TO IMPLEMENT SPINNER
-    try:
-        image_paths = pdf_to_images(pdf_path)
-    except Exception as e:
-        await ws.send_text("❌ Failed to convert PDF pages")
-    
-    
-    
-    # ADD DEBUG INFO
-    await ws.send_text(f"🖼️ **Successfully converted {len(image_paths)} pages to images**")
-    
-    # Process each pagezzzzz
-    all_page_results = []
-    
-    for i, image_path in enumerate(image_paths, 1):
-        await ws.send_text(f"🔄 **Processing Page {i}/{page_count}...**")
-        
-        # Process with smart retry
-        page_result =await  process_invoice_with_retry(image_path, ws)
-        print(page_result)
-        if page_result:
-            # ADD DEBUG: Show what was extracted from this page
-            vendor = page_result.get('invoice_header', {}).get('vendor_name', 'N/A')
-            line_items_count = len(page_result.get('line_items', []))
-            await ws.send_text(f"✅ Page {i} processed - Vendor: {vendor}, Line Items: {line_items_count}")
-            
-            # Add page metadata
-            page_result['page_info'] = {
-                'page_number': i,
-                'total_pages': page_count,
-                'source_pdf': uploaded_filename,
-                'page_image': Path(image_path).name
-            }
-            all_page_results.append(page_result)
+    # Render pages lazily: page N is only rasterised once a slot is free,
+    # so at most max_concurrency page images (or batches) are held in memory at a time
+    batch_size = max(1, batch_size)
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+    tasks = []
+    for first_page in range(1, page_count + 1, batch_size):
+        await semaphore.acquire()
+        if batch_size == 1:
+            task = process_pdf_page(pdf_data, first_page, page_count, uploaded_filename, ws, client, model,
+                                    semaphore, policy)
         else:
-            await ws.send_text(f"⚠️ Page {i} processing failed")
-            # Add failed page placeholder
-            all_page_results.append({
-                'page_info': {
-                    'page_number': i,
-                    'total_pages': page_count,
-                    'source_pdf': uploaded_filename,
-                    'processing_failed': True
-                },
-                'error': 'Page processing failed'
-            })
+            page_numbers = list(range(first_page, min(first_page + batch_size, page_count + 1)))
+            task = process_pdf_page_batch(pdf_data, page_numbers, page_count, uploaded_filename, ws, client, model,
+                                          semaphore, policy)
+        tasks.append(asyncio.create_task(task))
+    
+    # Collect pages as they finish, then reassemble in page order
+    results_by_page = {}
+    for task in asyncio.as_completed(tasks):
+        finished = await task
+        results_by_page.update(finished if isinstance(finished, list) else [finished])
+    all_page_results = [results_by_page[i] for i in sorted(results_by_page)]
     
     # ADD DEBUG: Show combination results
     await ws.send_text(f"📊 **Total processed results: {len(all_page_results)}**")
     
-    # Clean up temporary image files
-    for image_path in image_paths:
-        try:
-            os.unlink(image_path)
-        except:
-            pass
-    
     # Combine results
     combined_result = combine_pdf_page_results(all_page_results, uploaded_filename)
     
@@ -242,42 +240,230 @@ async def process_multi_page_pdf(pdf_path, uploaded_filename, ws):
     await ws.send_text(f"🔗 **Combined line items: {combined_line_items}**")
     return combined_result
 
-def pdf_to_images(pdf_path, dpi=300):
-    """Convert PDF pages to images using PyMuPDF (no poppler needed)"""
-    
-    doc = fitz.open(pdf_path)
-    output_paths = []
+@traced('page')
+async def process_pdf_page(pdf_data, page_number, page_count, uploaded_filename, ws, client, model, semaphore,
+                           policy=RENDER_POLICY):
+    """Prepare, extract and free the slot for a single PDF page; returns (page_number, page_result)
+
+    The caller acquires the semaphore before the page is prepared.
+    """
+    annotate(page=page_number)
+    try:
+        await ws.send_text(f"🔄 **Processing Page {page_number}/{page_count}...**")
+        page_result, extraction_source = await extract_pdf_page(pdf_data, page_number, ws, client, model, policy)
+    except ModelCallFailed as e:
+        await ws.send_text(f"❌ Page {page_number}: {e}")
+        page_result, extraction_source = None, 'image'
+    except Exception as e:
+        print(f"❌ Page {page_number} failed: {e}")
+        page_result, extraction_source = None, 'image'
+    finally:
+        semaphore.release()
     
-    pdf_file = Path(pdf_path)
-    temp_dir = pdf_file.parent
+    return await finish_pdf_page(page_number, page_count, uploaded_filename, ws, page_result, extraction_source)
+
+@traced('page_batch')
+async def process_pdf_page_batch(pdf_data, page_numbers, page_count, uploaded_filename, ws, client, model, semaphore,
+                                 policy=RENDER_POLICY):
+    """Extract several PDF pages with a single model request; returns [(page_number, page_result), ...]
+
+    Text-layer pages, pages the local pre-screen predicts to be blurry and pages the
+    batched answer does not cover cleanly go through the single-page path instead.
+    The caller acquires the semaphore before the pages are prepared.
+    """
+    annotate(pages=page_numbers)
+    results, sources = {}, {}
+    try:
+        if len(page_numbers) == 1:
+            await ws.send_text(f"🔄 **Processing Page {page_numbers[0]}/{page_count}...**")
+        else:
+            await ws.send_text(f"🔄 **Processing Pages {page_numbers[0]}-{page_numbers[-1]}/{page_count} "
+                               f"in one request...**")
+        prepared = {}
+        batchable = {}
+        for page_number in page_numbers:
+            prepared[page_number] = await run_pdf_bound(prepare_pdf_page, pdf_data, page_number, policy)
+            image_data, page_text = prepared[page_number]
+            if image_data is None or page_text is not None:
+                continue
+            if QUALITY_PRESCREEN and (await run_cpu_bound(prescreen_image, image_data))[0] != 'good':
+                continue
+            batchable[page_number] = image_data
+
+        if client is not None and len(batchable) > 1:
+            for page_number, page_result in (await extract_batch_with_cache(client, model, batchable, ws)).items():
+                if analyze_invoice_quality(page_result) == 'good':
+                    results[page_number], sources[page_number] = page_result, 'image_batch'
+
+        for page_number in page_numbers:
+            if page_number in results:
+                continue
+            try:
+                results[page_number], sources[page_number] = await extract_pdf_page(
+                    pdf_data, page_number, ws, client, model, policy, prepared[page_number]
+                )
+            except ModelCallFailed as e:
+                await ws.send_text(f"❌ Page {page_number}: {e}")
+            except Exception as e:
+                print(f"❌ Page {page_number} failed: {e}")
+    except Exception as e:
+        print(f"❌ Pages {page_numbers} failed: {e}")
+    finally:
+        semaphore.release()
+
+    return [
+        await finish_pdf_page(page_number, page_count, uploaded_filename, ws,
+                              results.get(page_number), sources.get(page_number, 'image'))
+        for page_number in page_numbers
+    ]
+
+async def extract_pdf_page(pdf_data, page_number, ws, client, model, policy=RENDER_POLICY, prepared=None):
+    """Extract one PDF page on its own; returns (page_result, extraction_source)
+
+    Pages with a usable text layer are extracted without an image and only rendered if
+    that fails. prepared is an already computed prepare_pdf_page result.
+    """
+    extraction_source = 'image'
+    # Partial results streamed while extracting this page are tagged with its number
+    set_partial_page(page_number)
+    if prepared is None:
+        prepared = await run_pdf_bound(prepare_pdf_page, pdf_data, page_number, policy)
+    image_data, page_text = prepared
+    high_res = escalated_render_settings(policy)
+    rerender = partial(render_pdf_page, pdf_data, page_number, high_res) if high_res else None
+    
+    page_result = None
+    if page_text is not None:
+        # Fast path: born-digital page, no rasterisation needed
+        page_result = await process_text_page(page_text, ws, client, model)
+        if page_result:
+            extraction_source = 'text_layer'
+        else:
+            await ws.send_text(f"🖼️ Page {page_number}: text layer extraction failed, using the page image")
+            image_data = await run_pdf_bound(render_pdf_page, pdf_data, page_number, None, policy)
     
-    for page_num in range(len(doc)):
-        page = doc.load_page(page_num)
-        mat = fitz.Matrix(dpi/72, dpi/72)  # Convert DPI to scale factor
-        pix = page.get_pixmap(matrix=mat)
+    # Process with smart retry
+    if not page_result and image_data is not None:
+        page_result = await process_invoice_with_retry(image_data, ws, client, model, rerender=rerender)
+    return page_result, extraction_source
+
+async def finish_pdf_page(page_number, page_count, uploaded_filename, ws, page_result, extraction_source):
+    """Report a page and attach its page_info, or build the failed-page placeholder; returns (page_number, page_result)"""
+    print(page_result)
+    if page_result:
+        # ADD DEBUG: Show what was extracted from this page
+        vendor = page_result.get('invoice_header', {}).get('vendor_name', 'N/A')
+        line_items_count = len(page_result.get('line_items', []))
+        await ws.send_text(f"✅ Page {page_number} processed - Vendor: {vendor}, Line Items: {line_items_count}")
         
-        image_path = temp_dir / f"{pdf_file.stem}_page_{page_num+1}.jpg"
-        pix.save(str(image_path))
-        output_paths.append(str(image_path))
-    
-    doc.close()
-    return output_paths
-
-async def process_invoice_with_retry(image_path, ws):
-    from dotenv import load_dotenv
-    load_dotenv()
-    API_KEY = os.getenv('OPENAI_API_KEY')
-    MODEL = os.getenv('OPENAI_MODEL', 'gpt-4o')
-    if not API_KEY:
+        # Add page metadata
+        page_result['page_info'] = {
+            'page_number': page_number,
+            'total_pages': page_count,
+            'source_pdf': uploaded_filename,
+            'page_image': f"page_{page_number}.jpg",
+            'extraction_source': extraction_source
+        }
+        return page_number, page_result
+    
+    await ws.send_text(f"⚠️ Page {page_number} processing failed")
+    # Add failed page placeholder
+    return page_number, {
+        'page_info': {
+            'page_number': page_number,
+            'total_pages': page_count,
+            'source_pdf': uploaded_filename,
+            'processing_failed': True
+        },
+        'error': 'Page processing failed'
+    }
+
+def prepare_page(page, policy=RENDER_POLICY, use_text_layer=True):
+    """Return (jpeg_bytes, page_text) for a fitz page.
+
+    Pages with a usable native text layer come back as page_text and are not rendered;
+    other pages are rendered to in-memory JPEG bytes with resolution and quality chosen
+    by the render policy. Both are None if the page failed to render.
+    """
+    try:
+        page_text = get_page_text(page) if use_text_layer else None
+        if page_text is not None:
+            return None, page_text
+        return render_page(page, choose_render_settings(page, policy)), None
+    except Exception as e:
+        print(f"❌ Failed to render page {page.number + 1}: {e}")
+        return None, None
+
+def prepare_pdf_page(pdf_data, page_number, policy=RENDER_POLICY, use_text_layer=True):
+    """Open the PDF (bytes or path) and prepare a single page (1-based); runs in the CPU pool"""
+    doc = open_pdf(pdf_data)
+    try:
+        return prepare_page(doc.load_page(page_number - 1), policy, use_text_layer)
+    finally:
+        doc.close()
+
+def iter_pdf_pages(pdf_data, policy=RENDER_POLICY, use_text_layer=True):
+    """Lazily prepare PDF pages, one page per next() call; yields (page_number, jpeg_bytes, page_text)"""
+    doc = open_pdf(pdf_data)
+    try:
+        for page_num in range(len(doc)):
+            image_data, page_text = prepare_page(doc.load_page(page_num), policy, use_text_layer)
+            yield page_num + 1, image_data, page_text
+    finally:
+        doc.close()
+
+def pdf_to_images(pdf_data, policy=RENDER_POLICY):
+    """Render all PDF pages to in-memory JPEG bytes using PyMuPDF (no poppler, no temp files)"""
+    return [image_data for _, image_data, _ in iter_pdf_pages(pdf_data, policy, use_text_layer=False)]
+
+@traced('extract_with_retry')
+async def process_invoice_with_retry(image_data, ws, client, model, rerender=None):
+    """Extract one image with the shared model client, enhancing and retrying if it is blurry.
+
+    A local OpenCV pre-screen predicts blur before the first call, so images that would
+    need enhancement are enhanced up front and usually cost one model call instead of two.
+    rerender, if given, returns a higher-resolution version of the image for one retry
+    before falling back to OpenCV enhancement.
+    """
+    if client is None:
         await ws.send_text("❌ OpenAI API key not found. Please check your .env file.")
         return None
 
-    client = OpenAI(api_key=API_KEY)
+    if TILED_EXTRACTION:
+        result = await process_invoice_tiled(image_data, ws, client, model, full_res=rerender)
+        if result:
+            return result
+
+    prediction, metrics = 'good', None
+    if QUALITY_PRESCREEN:
+        prediction, metrics = await run_cpu_bound(prescreen_image, image_data)
 
-    await ws.send_text("🔄 **Step 1:** Trying with original image...")
-    result = await try_process_image(client, MODEL, image_path,ws,  is_preprocessed=False)
+    if prediction == 'good':
+        await ws.send_text("🔄 **Step 1:** Trying with original image...")
+        result = await extract_with_cache(client, model, image_data, ws, is_preprocessed=False)
+        preprocessed = False
+    else:
+        await ws.send_text(f"🔎 **Step 1:** Local quality check predicts {prediction} "
+                           f"(sharpness {metrics['sharpness']:.0f}, contrast {metrics['contrast']:.0f}, "
+                           f"skew {metrics['skew_degrees']:.1f}°) - enhancing before the first call...")
+        enhanced_image = await run_cpu_bound(preprocess_image_enhanced, image_data)
+        download_preprocessed_image(enhanced_image)
+        result = await extract_with_cache(client, model, enhanced_image, ws, is_preprocessed=True)
+        preprocessed = True
+        if analyze_invoice_quality(result) in ('blur_too_bad', 'no_data'):
+            # The prediction was wrong or enhancement hurt: fall back to the original image
+            await ws.send_text("🔄 Enhanced image was not readable; trying the original image...")
+            result = await extract_with_cache(client, model, image_data, ws, is_preprocessed=False)
+            preprocessed = False
     condition = analyze_invoice_quality(result)
 
+    if condition in ('blur_maybe', 'blur_too_bad', 'no_data') and rerender is not None:
+        await ws.send_text("🔍 Retrying with a higher-resolution image...")
+        image_data = await run_pdf_bound(rerender)
+        result = await extract_with_cache(client, model, image_data, ws, is_preprocessed=False)
+        preprocessed = False
+        condition = analyze_invoice_quality(result)
+
     if condition == 'not_invoice':
         await ws.send_text("❌ Uploaded file is not a valid invoice. Please upload a proper invoice document.")
         return None
@@ -286,11 +472,11 @@ async def process_invoice_with_retry(image_path, ws):
         await ws.send_text("❌ Uploaded invoice is too blurry or unreadable.")
         return None
 
-    if condition == 'blur_maybe':
+    if condition == 'blur_maybe' and not preprocessed:
         await ws.send_text("⚠️ Uploaded invoice is blurry; attempting enhancement.")
-        preprocessed_path = preprocess_image_enhanced(image_path)
-        download_preprocessed_image(preprocessed_path)
-        result = await try_process_image(client, MODEL, preprocessed_path,ws, is_preprocessed=True)
+        preprocessed_image = await run_cpu_bound(preprocess_image_enhanced, image_data)
+        download_preprocessed_image(preprocessed_image)
+        result = await extract_with_cache(client, model, preprocessed_image, ws, is_preprocessed=True)
         condition = analyze_invoice_quality(result)
 
         if condition == 'not_invoice':
@@ -300,8 +486,165 @@ async def process_invoice_with_retry(image_path, ws):
         if condition == 'blur_too_bad':
             await ws.send_text("❌ Uploaded invoice is too blurry even after enhancement.")
             return None
+
+    if result and TABLE_ROW_CHECK:
+        result = await recover_missing_rows(result, image_data, ws, client, model)
+
+    if result and metrics is not None:
+        # Copy rather than mutate: the result may be an object held by the extraction cache
+        detection_metadata = dict(result.get('detection_metadata') or {})
+        detection_metadata['local_quality'] = {'prediction': prediction, **metrics}
+        result = {**result, 'detection_metadata': detection_metadata}
     print("returning")
     return result
+
+class TileWebSocket:
+    """Forwards status text but not streamed partial sections, which would mix up tiles in the client"""
+
+    def __init__(self, ws):
+        self.ws = ws
+
+    async def send_text(self, text):
+        await self.ws.send_text(text)
+
+    async def send_json(self, data):
+        pass
+
+@traced('tiled_extraction')
+async def process_invoice_tiled(image_data, ws, client, model, full_res=None):
+    """Extract a very dense page as a header band plus overlapping table-row bands, in parallel.
+
+    image_data decides whether the page is dense enough to tile; full_res, if given, returns
+    the higher-resolution image that is actually cut into bands. Returns None when the page
+    is not tiled or the stitched result is unusable, so the caller extracts it whole.
+    """
+    bands = await run_cpu_bound(plan_tiles, image_data)
+    if bands is None:
+        return None
+    source = await run_pdf_bound(full_res) if full_res is not None else image_data
+    bands, tiles = await run_cpu_bound(tile_image, source, bands)
+    if not tiles:
+        return None
+
+    await ws.send_text(f"🧩 Dense page: extracting {len(tiles)} bands in parallel...")
+    tile_ws = TileWebSocket(ws)
+    results = await asyncio.gather(*[
+        extract_with_cache(client, model, tile, tile_ws, attempt_note=TILE_ATTEMPT_NOTE) for tile in tiles
+    ])
+    result = stitch_tile_results(results)
+    if analyze_invoice_quality(result) in ('not_invoice', 'blur_too_bad', 'no_data'):
+        await ws.send_text("🔄 Tiled extraction was not usable; extracting the whole page...")
+        return None
+
+    detection_metadata = dict(result.get('detection_metadata') or {})
+    detection_metadata['tiles'] = {'count': len(tiles), 'failed': sum(1 for r in results if not r), 'bands': bands}
+    result['detection_metadata'] = detection_metadata
+    if TABLE_ROW_CHECK:
+        result = await recover_missing_rows(result, source, ws, client, model)
+    return result
+
+@traced('row_recovery')
+async def recover_missing_rows(result, image_data, ws, client, model):
+    """Count the line-item rows on the page image and re-extract only the rows missing from result.
+
+    The model is assumed to have read the table from the top, so the rows after the ones it
+    returned are cut into bands (with a little overlap) and extracted on their own.
+    """
+    table = await run_cpu_bound(detect_table_rows, image_data)
+    if table is None:
+        return result
+    items = result.get('line_items') or []
+    table_rows = {'expected': len(table['rows']), 'extracted': len(items), 'columns': table['columns']}
+
+    bands = missing_row_bands(table, len(items))
+    if bands:
+        await ws.send_text(f"🧮 Table has {len(table['rows'])} rows but {len(items)} line items were extracted; "
+                           f"re-extracting the missing rows...")
+        tiles = await run_cpu_bound(crop_bands, image_data, bands)
+        tile_ws = TileWebSocket(ws)
+        band_results = await asyncio.gather(*[
+            extract_with_cache(client, model, tile, tile_ws, attempt_note=TILE_ATTEMPT_NOTE) for tile in tiles
+        ])
+        recovered = items
+        for band_result in band_results:
+            recovered = merge_line_items(recovered, band_result and band_result.get('line_items'))
+        table_rows['recovered'] = len(recovered) - len(items)
+        await ws.send_text(f"🧮 Recovered {table_rows['recovered']} line item(s)")
+        # Copy rather than mutate: the result may be an object held by the extraction cache
+        result = {**result, 'line_items': recovered}
+
+    detection_metadata = dict(result.get('detection_metadata') or {})
+    detection_metadata['table_rows'] = table_rows
+    return {**result, 'detection_metadata': detection_metadata}
+
+async def extract_with_cache(client, model, image_data, ws, is_preprocessed=False, attempt_note=None):
+    """try_process_image, skipped when the same image bytes were already extracted with this model and prompt"""
+    cache = get_extraction_cache()
+    if cache is None:
+        return await try_process_image(client, model, image_data, ws, is_preprocessed=is_preprocessed,
+                                       attempt_note=attempt_note)
+
+    variant = 'tile' if attempt_note == TILE_ATTEMPT_NOTE else 'preprocessed' if is_preprocessed else 'original'
+    # Hashing and the disk tier run off the event loop
+    key = await asyncio.to_thread(make_cache_key, image_data, model, f"{EXTRACTION_PROMPT_VERSION}:{variant}")
+    result = await asyncio.to_thread(cache.get, key)
+    if result is not None:
+        await ws.send_text("♻️ Reusing cached extraction for an identical image")
+        return result
+
+    result = await try_process_image(client, model, image_data, ws, is_preprocessed=is_preprocessed,
+                                     attempt_note=attempt_note)
+    if result:
+        await asyncio.to_thread(cache.set, key, result)
+    return result
+
+async def extract_batch_with_cache(client, model, images_by_page, ws):
+    """try_process_image_batch for {page_number: image bytes}, skipping pages already extracted in a batch"""
+    cache = get_extraction_cache()
+    prompt_version = f"{EXTRACTION_PROMPT_VERSION}:batch"
+    results, keys = {}, {}
+    for page_number, image_data in images_by_page.items():
+        if cache is not None:
+            keys[page_number] = await asyncio.to_thread(make_cache_key, image_data, model, prompt_version)
+            results[page_number] = await asyncio.to_thread(cache.get, keys[page_number])
+    pending = [page_number for page_number in images_by_page if results.get(page_number) is None]
+    if len(pending) < len(images_by_page):
+        await ws.send_text(f"♻️ Reusing cached extractions for {len(images_by_page) - len(pending)} page(s)")
+    if not pending:
+        return results
+
+    batch_results, _ = await try_process_image_batch(
+        client, model, [images_by_page[page_number] for page_number in pending], pending, ws
+    )
+    for page_number, page_result in batch_results.items():
+        results[page_number] = page_result
+        if page_result and cache is not None:
+            await asyncio.to_thread(cache.set, keys[page_number], page_result)
+    return results
+
+@traced('text_page')
+async def process_text_page(page_text, ws, client, model):
+    """Extract a page from its native text layer, with the same caching as image pages"""
+    if client is None:
+        await ws.send_text("❌ OpenAI API key not found. Please check your .env file.")
+        return None
+
+    text_model = OPENAI_TEXT_MODEL or model
+    cache = get_extraction_cache()
+    key = make_cache_key(page_text.encode("utf-8"), text_model, f"{EXTRACTION_PROMPT_VERSION}:text")
+    result = await asyncio.to_thread(cache.get, key) if cache is not None else None
+    if result is not None:
+        await ws.send_text("♻️ Reusing cached extraction for identical page text")
+        return result
+
+    await ws.send_text("⚡ Digital PDF page detected - extracting from the text layer")
+    result = await try_process_text(client, text_model, page_text, ws)
+    if analyze_invoice_quality(result) in ('not_invoice', 'no_data'):
+        return None
+    if cache is not None:
+        await asyncio.to_thread(cache.set, key, result)
+    return result
+
 def analyze_invoice_quality(result):
     if not result:
         return 'no_data'
@@ -322,16 +665,16 @@ def analyze_invoice_quality(result):
         return 'blur_maybe'
     return 'good'
 
-def preprocess_image_enhanced(image_path):
+def preprocess_image_enhanced(image_data):
     """
     Enhanced preprocessing using OpenCV: grayscale, noise removal, adaptive binarization, morphological closing, and resize.
-    Returns the processed image path (or original if failure).
+    Takes and returns encoded image bytes (returns the original bytes if preprocessing fails).
     """
     try:
-        # Load image
-        image = cv2.imread(image_path)
+        # Decode image
+        image = cv2.imdecode(np.frombuffer(image_data, np.uint8), cv2.IMREAD_COLOR)
         if image is None:
-            raise ValueError(f"Image not found or invalid: {image_path}")
+            raise ValueError("Image data is empty or invalid")
         
         # 1. Convert to grayscale
         gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
@@ -355,17 +698,18 @@ def preprocess_image_enhanced(image_path):
             scale = max_size / max(height, width)
             morph = cv2.resize(morph, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
 
-        # Save processed image
-        file_path = Path(image_path)
-        processed_path = str(file_path.parent / f"{file_path.stem}_enhanced.jpg")
-        cv2.imwrite(processed_path, morph)
+        # Encode processed image
+        ok, encoded = cv2.imencode(".jpg", morph)
+        if not ok:
+            raise ValueError("JPEG encoding failed")
 
-        return processed_path
+        return encoded.tobytes()
     
     except Exception as e:
         print(f"❌ OpenCV preprocessing failed: {e}")
-        return image_path
+        return image_data
     
+@traced('combine_pages')
 def combine_pdf_page_results(page_results, pdf_filename):
     """Combine results from all PDF pages into a structured format"""
     
@@ -471,17 +815,17 @@ def combine_pdf_page_results(page_results, pdf_filename):
     return combined_result
 
 
-def download_preprocessed_image(preprocessed_image_path):
-    if not os.path.exists(preprocessed_image_path):
+def download_preprocessed_image(preprocessed_image):
+    if not preprocessed_image:
         return
-    # with open(preprocessed_image_path, "rb") as file:
-    #     st.download_button(
+    # st.download_button(
     #         label="📥 Download Preprocessed Image",
-    #         data=file,
-    #         file_name=os.path.basename(preprocessed_image_path),
+    #         data=preprocessed_image,
+    #         file_name="preprocessed.jpg",
     #         mime="image/jpeg"
     #     )
 
+@traced('save_result')
 def save_result_to_file(result, filename, results_dir="resultjson"):
     """Save individual result to a separate JSON file"""
     if not result:
@@ -498,7 +842,8 @@ def save_result_to_file(result, filename, results_dir="resultjson"):
             "processing_date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             "unique_id": unique_id,
             "filename": filename,
-            "file_id": f"{timestamp}_{unique_id}"
+            "file_id": f"{timestamp}_{unique_id}",
+            "prompt_version": EXTRACTION_PROMPT_VERSION
         },
         "extraction_data": result
     }
@@ -512,10 +857,9 @@ def save_result_to_file(result, filename, results_dir="resultjson"):
     
     return individual_path, enhanced_result
 
+@traced('append_master_results')
 def append_to_master_results(result, filename, results_dir="resultjson"):
-    """Append result to master results file"""
-    master_file = os.path.join(results_dir, "all_results.json")
-    
+    """Append result to master results file; blocks on the store lock, so call it in a thread"""
     # Create timestamp and unique ID
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     unique_id = str(uuid.uuid4())[:8]
@@ -526,26 +870,19 @@ def append_to_master_results(result, filename, results_dir="resultjson"):
         "timestamp": datetime.now().isoformat(),
         "processing_date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
         "source_filename": filename,
+        "prompt_version": EXTRACTION_PROMPT_VERSION,
         "extraction_data": result
     }
     
-    # Load existing results or create new list
-    if os.path.exists(master_file):
-        try:
-            with open(master_file, 'r', encoding='utf-8') as f:
-                all_results = json.load(f)
-            if not isinstance(all_results, list):
-                all_results = [all_results]  # Convert single object to list
-        except (json.JSONDecodeError, FileNotFoundError):
-            all_results = []
-    else:
-        all_results = []
-    
-    # Append new result
-    all_results.append(new_entry)
-    
-    # Save back to master file
-    with open(master_file, 'w', encoding='utf-8') as f:
-        json.dump(all_results, f, indent=2, ensure_ascii=False)
+    # O(1) locked append to the JSON Lines store (migrates all_results.json on first use)
+    master_file, total_count = append_result_entry(new_entry, results_dir)
     
-    return master_file, len(all_results)
\ No newline at end of file
+    return master_file, total_count
+
+async def refresh_results_index(results_dir="resultjson"):
+    """Bring the query index up to date after a save (SQLite work, so in a thread)"""
+    # The index can always catch up later from the store, so a failure here is not fatal
+    try:
+        await asyncio.to_thread(sync_results_index, results_dir)
+    except Exception as e:
+        print(f"❌ Failed to update results index: {e}")
\ No newline at end of file
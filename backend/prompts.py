@@ -0,0 +1,266 @@
+import json
+import os
+
+# v1 - the original prompt: pretty-printed skeleton, instructions repeated, stray comment line
+# v2 - compact: minified schema generated from EXTRACTION_SCHEMA, each instruction once,
+#      and JSON mode so the API only returns parseable JSON objects
+PROMPT_VERSION = os.getenv('EXTRACTION_PROMPT_VERSION', 'v2')
+
+ATTEMPT_NOTE = '{attempt_note}'
+
+# Every field the extraction returns, in output order. "" is a string field;
+# other values show the expected type or allowed values.
+EXTRACTION_SCHEMA = {
+    "quality_assessment": {
+        "quality_too_poor": False,
+        "quality_issues": [""],
+        "readability_score": "high|medium|low",
+        "can_extract_data": True,
+        "preprocessing_recommended": False,
+    },
+    "invoice_header": dict.fromkeys([
+        "vendor_name", "vendor_address", "vendor_phone", "vendor_email", "vendor_website",
+        "vendor_gst_number", "vendor_pan", "invoice_number", "invoice_date", "due_date",
+        "purchase_order_number", "reference_number", "currency",
+    ], ""),
+    "customer_details": dict.fromkeys([
+        "customer_name", "customer_address", "customer_phone", "customer_email", "customer_gst_number",
+        "customer_pan", "billing_address", "shipping_address", "customer_contact_person",
+    ], ""),
+    "line_items": [dict.fromkeys([
+        "item_number", "description", "hsn_sac_code", "quantity", "unit", "unit_price", "discount",
+        "tax_rate", "tax_amount", "total_price",
+    ], "")],
+    "financial_summary": dict.fromkeys([
+        "subtotal", "total_discount", "taxable_amount", "cgst", "sgst", "igst", "cess", "other_charges",
+        "shipping_charges", "total_tax_amount", "round_off", "total_amount", "amount_in_words",
+    ], ""),
+    "payment_details": dict.fromkeys([
+        "payment_terms", "payment_method", "bank_name", "account_number", "ifsc_code", "branch", "upi_id",
+        "advance_paid", "balance_due",
+    ], ""),
+    "terms_and_conditions": {
+        **dict.fromkeys([
+            "payment_terms", "delivery_terms", "warranty_terms", "return_policy", "late_payment_charges",
+            "jurisdiction",
+        ], ""),
+        "other_conditions": [""],
+    },
+    "additional_info": dict.fromkeys([
+        "notes", "special_instructions", "delivery_date", "place_of_supply", "reverse_charge", "document_type",
+        "series", "authorised_signatory", "stamp_or_seal", "qr_code_present",
+    ], ""),
+    "detection_metadata": {
+        **dict.fromkeys([
+            "tables_detected", "handwriting_detected", "logo_detected", "stamp_detected", "signature_detected",
+            "barcode_qr_detected", "multi_page_document",
+        ], False),
+        "document_quality": "high|medium|low",
+        "extraction_confidence": "high|medium|low",
+        "unclear_fields": [""],
+    },
+}
+
+
+class PromptTemplate:
+    """A prompt precompiled into the text before and after the attempt note"""
+
+    def __init__(self, version, text, json_mode=False):
+        self.version = version
+        self.head, self.tail = text.split(ATTEMPT_NOTE)
+        self.json_mode = json_mode
+
+    def build(self, attempt_note):
+        return self.head + attempt_note + self.tail
+
+
+def compact_schema(schema=EXTRACTION_SCHEMA):
+    """The schema as minified JSON"""
+    return json.dumps(schema, separators=(',', ':'), ensure_ascii=False)
+
+
+V1_TEXT = """
+STRICT INSTRUCTION: Only output valid JSON, no markdown or explanations.
+
+{attempt_note}
+
+First, assess if you can reliably extract data from this image:
+- If the image is too blurry, dark, or distorted to read text clearly, set "quality_too_poor" to true
+- If you can read most text despite some quality issues, set "quality_too_poor" to false
+- If this image is not a valid invoice, set "can_extract_data" to false and add "not invoice" to "quality_issues".
+
+
+Extract ALL available information from this invoice and return as JSON:
+{
+  "quality_assessment": {
+    "quality_too_poor": true/false,
+    "quality_issues": ["list any specific quality problems"],
+    "readability_score": "high/medium/low",
+    "can_extract_data": true/false,
+    "preprocessing_recommended": true/false
+  },
+  "invoice_header": {
+    "vendor_name": "",
+    "vendor_address": "",
+    "vendor_phone": "",
+    "vendor_email": "",
+    "vendor_website": "",
+    "vendor_gst_number": "",
+    "vendor_pan": "",
+    "invoice_number": "",
+    "invoice_date": "",
+    "due_date": "",
+    "purchase_order_number": "",
+    "reference_number": "",
+    "currency": ""
+  },
+  "customer_details": {
+    "customer_name": "",
+    "customer_address": "",
+    "customer_phone": "",
+    "customer_email": "",
+    "customer_gst_number": "",
+    "customer_pan": "",
+    "billing_address": "",
+    "shipping_address": "",
+    "customer_contact_person": ""
+  },
+  "line_items": [
+    {
+      "item_number": "",
+      "description": "",
+      "hsn_sac_code": "",
+      "quantity": "",
+      "unit": "",
+      "unit_price": "",
+      "discount": "",
+      "tax_rate": "",
+      "tax_amount": "",
+      "total_price": ""
+    }
+  ],
+  "financial_summary": {
+    "subtotal": "",
+    "total_discount": "",
+    "taxable_amount": "",
+    "cgst": "",
+    "sgst": "",
+    "igst": "",
+    "cess": "",
+    "other_charges": "",
+    "shipping_charges": "",
+    "total_tax_amount": "",
+    "round_off": "",
+    "total_amount": "",
+    "amount_in_words": ""
+  },
+  "payment_details": {
+    "payment_terms": "",
+    "payment_method": "",
+    "bank_name": "",
+    "account_number": "",
+    "ifsc_code": "",
+    "branch": "",
+    "upi_id": "",
+    "advance_paid": "",
+    "balance_due": ""
+  },
+  "terms_and_conditions": {
+    "payment_terms": "",
+    "delivery_terms": "",
+    "warranty_terms": "",
+    "return_policy": "",
+    "late_payment_charges": "",
+    "jurisdiction": "",
+    "other_conditions": []
+  },
+  "additional_info": {
+    "notes": "",
+    "special_instructions": "",
+    "delivery_date": "",
+    "place_of_supply": "",
+    "reverse_charge": "",
+    "document_type": "",
+    "series": "",
+    "authorised_signatory": "",
+    "stamp_or_seal": "",
+    "qr_code_present": ""
+  },
+  "detection_metadata": {
+    "tables_detected": true/false,
+    "handwriting_detected": true/false,
+    "logo_detected": true/false,
+    "stamp_detected": true/false,
+    "signature_detected": true/false,
+    "barcode_qr_detected": true/false,
+    "multi_page_document": true/false,
+    "document_quality": "high/medium/low",
+    "extraction_confidence": "high/medium/low",
+    "unclear_fields": []
+  }
+}
+
+INSTRUCTIONS:
+- Be honest about image quality in the quality_assessment section
+- If quality_too_poor is true, still try to extract what you can see
+- For missing/unclear fields, use "N/A"
+# In your try_process_image function, enhance the currency instructions:
+
+CURRENCY DETECTION - IMPORTANT:
+- ALWAYS preserve currency symbols in amounts: $154.06, ₹10,000, €500, etc.
+- Include currency symbols in ALL amount fields: total_amount, subtotal, unit_price, etc.
+- Do NOT extract just numbers - include the currency symbol with the number
+- Look for currency symbols: ₹, $, €, £, ¥, etc.
+- Look for currency codes: INR, USD, EUR, GBP, etc.
+- Look for currency words: Rupees, Dollars, Euros, Pounds, etc.
+- Extract currency in BOTH invoice_header and financial_summary sections
+- If amounts have symbols like $100.00, preserve the $ in the JSON output
+
+- If text is completely unreadable due to quality, mention this in quality_issues
+- Extract ALL visible text and data fields
+- For terms and conditions, extract the full text even if lengthy
+- Include any fine print, disclaimers, or legal text
+- Capture payment terms like "Net 30", "Due on receipt", etc.
+- Extract tax breakdowns (CGST, SGST, IGST) if present
+- Include any special notes, delivery instructions, or remarks
+- Identify HSN/SAC codes for items if visible
+- Extract complete addresses with pin codes
+- Include contact details like phone, email, website
+- Capture bank details for payments
+- Note any stamps, signatures, or authentication marks
+- Return only valid JSON without any explanation.
+"""
+
+V2_TEXT = f"""Return ONLY one valid JSON object, no markdown or explanations.
+
+{ATTEMPT_NOTE}
+
+Quality first: set quality_too_poor true if the image is too blurry, dark or distorted to read text clearly \
+(still extract what you can), false if most text is readable; be honest and list problems, including \
+unreadable text, in quality_issues. If it is not an invoice, set can_extract_data false and add "not invoice" \
+to quality_issues.
+
+Schema (values show the type; lists may hold any number of entries):
+{compact_schema()}
+
+Rules:
+- Use "N/A" for missing or unclear fields. Extract ALL visible data: full addresses with pin codes, contact \
+details, bank details, HSN/SAC codes, tax breakdowns (CGST/SGST/IGST), payment terms such as "Net 30", notes, \
+delivery instructions, fine print and the full terms and conditions text.
+- Keep the currency symbol in every amount ($154.06, ₹10,000, €500). Set currency in invoice_header from \
+symbols (₹ $ € £ ¥), codes (INR, USD, EUR, GBP) or words (Rupees, Dollars, Euros, Pounds).
+- Record stamps, signatures and other authentication marks.
+"""
+
+PROMPTS = {
+    'v1': PromptTemplate('v1', V1_TEXT),
+    'v2': PromptTemplate('v2', V2_TEXT, json_mode=True),
+}
+
+
+def get_prompt(version=PROMPT_VERSION):
+    """Look up a registered prompt version"""
+    try:
+        return PROMPTS[version]
+    except KeyError:
+        raise ValueError(f"Unknown extraction prompt version {version!r}; known: {', '.join(PROMPTS)}") from None
@@ -0,0 +1,117 @@
+import os
+import fitz
+from io import BytesIO
+from PIL import Image
+
+# fixed     - legacy behaviour: every page at 300 DPI, JPEG quality 95
+# adaptive  - pick DPI / quality / max dimension from page size and text density
+# low_first - start small and re-render at high resolution only if the model struggles
+RENDER_POLICY = os.getenv('RENDER_POLICY', 'adaptive')
+
+# The vision model downsizes anything larger than 2048px on its long side,
+# so pixels beyond that only cost upload bytes and latency
+MODEL_MAX_DIMENSION = 2048
+
+FIXED_SETTINGS = {'dpi': 300, 'jpg_quality': 95, 'max_dimension': None}
+HIGH_RES_SETTINGS = {'dpi': 300, 'jpg_quality': 90, 'max_dimension': 3072}
+LOW_RES_SETTINGS = {'dpi': 110, 'jpg_quality': 70, 'max_dimension': 1280}
+
+# Words per square inch above which a digital page counts as dense
+DENSE_TEXT_THRESHOLD = 3
+# Below this many words the page is treated as scanned (no usable text layer)
+MIN_TEXT_LAYER_WORDS = 20
+
+
+def page_text_density(page):
+    """Return (word_count, words per square inch) from the page's text layer"""
+    word_count = len(page.get_text("words"))
+    width_in = page.rect.width / 72
+    height_in = page.rect.height / 72
+    area = max(width_in * height_in, 1e-6)
+    return word_count, word_count / area
+
+
+def choose_render_settings(page, policy=RENDER_POLICY):
+    """Pick DPI, JPEG quality and maximum pixel dimension for a PDF page"""
+    if policy == 'fixed':
+        return dict(FIXED_SETTINGS)
+    if policy == 'low_first':
+        return dict(LOW_RES_SETTINGS)
+
+    word_count, density = page_text_density(page)
+    if word_count < MIN_TEXT_LAYER_WORDS:
+        # Scanned page: keep enough resolution for the model to read the raster
+        return {'dpi': 200, 'jpg_quality': 85, 'max_dimension': MODEL_MAX_DIMENSION}
+    if density >= DENSE_TEXT_THRESHOLD:
+        # Dense digital page (long tables, small print)
+        return {'dpi': 200, 'jpg_quality': 80, 'max_dimension': MODEL_MAX_DIMENSION}
+    # Sparse digital page: clean vector text survives a low DPI well
+    return {'dpi': 150, 'jpg_quality': 75, 'max_dimension': 1600}
+
+
+def escalated_render_settings(policy=RENDER_POLICY):
+    """Settings for the high-res retry, or None if the policy does not escalate"""
+    if policy == 'low_first':
+        return dict(HIGH_RES_SETTINGS)
+    return None
+
+
+def render_page(page, settings):
+    """Render a fitz page to JPEG bytes using the given render settings"""
+    scale = settings['dpi'] / 72
+    max_dimension = settings.get('max_dimension')
+    if max_dimension:
+        longest_side = max(page.rect.width, page.rect.height) * scale
+        if longest_side > max_dimension:
+            scale *= max_dimension / longest_side
+    pix = page.get_pixmap(matrix=fitz.Matrix(scale, scale))
+    return pix.tobytes("jpg", jpg_quality=settings['jpg_quality'])
+
+
+def open_pdf(pdf_data):
+    """Open a PDF from in-memory bytes or a file path with PyMuPDF (a path is read lazily, page by page)"""
+    if isinstance(pdf_data, (bytes, bytearray)):
+        return fitz.open(stream=pdf_data, filetype="pdf")
+    return fitz.open(pdf_data)
+
+
+def render_pdf_page(pdf_data, page_number, settings=None, policy=RENDER_POLICY):
+    """Open the PDF (bytes or path) and render a single page (1-based); settings default to the policy's choice"""
+    doc = open_pdf(pdf_data)
+    try:
+        page = doc.load_page(page_number - 1)
+        return render_page(page, settings or choose_render_settings(page, policy))
+    finally:
+        doc.close()
+
+
+def fit_image_bytes(image_data, policy=RENDER_POLICY):
+    """Downscale an uploaded image so it is no larger than the model will use.
+
+    Returns the original bytes when the image is already small enough or the policy is fixed.
+    """
+    if policy == 'fixed':
+        return image_data
+    max_dimension = LOW_RES_SETTINGS['max_dimension'] if policy == 'low_first' else MODEL_MAX_DIMENSION
+    jpg_quality = LOW_RES_SETTINGS['jpg_quality'] if policy == 'low_first' else 85
+    try:
+        image = Image.open(BytesIO(image_data))
+        if max(image.size) <= max_dimension:
+            return image_data
+        image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+        buffer = BytesIO()
+        image.convert("RGB").save(buffer, "JPEG", quality=jpg_quality)
+        return buffer.getvalue()
+    except Exception as e:
+        print(f"❌ Image resize failed: {e}")
+        return image_data
+
+
+def estimate_image_tokens(width, height):
+    """Approximate vision input tokens for a high-detail image (512px tiles after resize)"""
+    scale = min(1.0, MODEL_MAX_DIMENSION / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    tiles = -(-int(width) // 512) * -(-int(height) // 512)
+    return 85 + 170 * tiles
@@ -0,0 +1,247 @@
+import json
+import os
+import re
+import sqlite3
+from datetime import datetime
+from dateutil import parser as date_parser
+from results_store import master_results_path, migrate_legacy_results
+
+# SQLite index over the JSON Lines master store; the store stays the source of truth
+RESULTS_INDEX_FILE = "results_index.sqlite3"
+MAX_PAGE_SIZE = 200
+# Tried before dateutil's (much slower) fuzzy parser; month-first like dateutil's default
+COMMON_DATE_FORMATS = ("%m/%d/%Y", "%d/%m/%Y", "%Y-%m-%d", "%d-%m-%Y", "%d.%m.%Y", "%d %b %Y", "%d %B %Y")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    seq INTEGER PRIMARY KEY,
+    id TEXT,
+    store_offset INTEGER NOT NULL,
+    processing_date TEXT,
+    source_filename TEXT,
+    vendor_name TEXT,
+    vendor_name_norm TEXT,
+    invoice_number TEXT,
+    vendor_gst_number TEXT,
+    customer_gst_number TEXT,
+    invoice_date TEXT,
+    total_amount REAL,
+    currency TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_results_id ON results(id);
+CREATE INDEX IF NOT EXISTS idx_results_vendor ON results(vendor_name_norm);
+CREATE INDEX IF NOT EXISTS idx_results_invoice_number ON results(invoice_number);
+CREATE INDEX IF NOT EXISTS idx_results_vendor_gst ON results(vendor_gst_number);
+CREATE INDEX IF NOT EXISTS idx_results_customer_gst ON results(customer_gst_number);
+CREATE INDEX IF NOT EXISTS idx_results_invoice_date ON results(invoice_date);
+CREATE INDEX IF NOT EXISTS idx_results_total_amount ON results(total_amount);
+CREATE TABLE IF NOT EXISTS index_state (
+    key TEXT PRIMARY KEY,
+    value INTEGER
+);
+"""
+
+
+def results_index_path(results_dir="resultjson"):
+    return os.path.join(results_dir, RESULTS_INDEX_FILE)
+
+
+def connect_index(results_dir="resultjson"):
+    conn = sqlite3.connect(results_index_path(results_dir), timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def clean_value(value):
+    """None for the model's empty/placeholder values"""
+    if value is None:
+        return None
+    value = str(value).strip()
+    if not value or value.upper() == 'N/A':
+        return None
+    return value
+
+
+def parse_amount(value):
+    """Parse amounts like '$1 129,04', '₹10,000.00' or '400.40' into a float"""
+    value = clean_value(value)
+    if value is None:
+        return None
+    digits = re.sub(r"[^\d,.\-]", "", value)
+    if not re.search(r"\d", digits):
+        return None
+    if ',' in digits and '.' in digits:
+        # Whichever separator comes last is the decimal point
+        if digits.rfind(',') > digits.rfind('.'):
+            digits = digits.replace('.', '').replace(',', '.')
+        else:
+            digits = digits.replace(',', '')
+    elif ',' in digits:
+        # '400,40' is a decimal comma, '10,000' is a thousands separator
+        if re.search(r",\d{1,2}$", digits):
+            digits = digits.replace(',', '.')
+        else:
+            digits = digits.replace(',', '')
+    try:
+        return float(digits)
+    except ValueError:
+        return None
+
+
+def parse_date(value):
+    """Parse an invoice date into ISO format (YYYY-MM-DD), or None"""
+    value = clean_value(value)
+    if value is None:
+        return None
+    for date_format in COMMON_DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format).date().isoformat()
+        except ValueError:
+            continue
+    try:
+        return date_parser.parse(value, fuzzy=True).date().isoformat()
+    except (ValueError, OverflowError):
+        return None
+
+
+def index_row(entry, store_offset):
+    """Flatten a stored entry (image or combined PDF result) into an index row"""
+    extraction = entry.get('extraction_data') or {}
+    data = extraction.get('combined_data') or extraction
+    header = data.get('invoice_header') or {}
+    customer = data.get('customer_details') or {}
+    financial = data.get('financial_summary') or {}
+    vendor_name = clean_value(header.get('vendor_name'))
+    return {
+        "seq": entry.get("seq"),
+        "id": entry.get("id"),
+        "store_offset": store_offset,
+        "processing_date": entry.get("processing_date"),
+        "source_filename": entry.get("source_filename"),
+        "vendor_name": vendor_name,
+        "vendor_name_norm": vendor_name.lower() if vendor_name else None,
+        "invoice_number": clean_value(header.get('invoice_number')),
+        "vendor_gst_number": (clean_value(header.get('vendor_gst_number')) or '').upper() or None,
+        "customer_gst_number": (clean_value(customer.get('customer_gst_number')) or '').upper() or None,
+        "invoice_date": parse_date(header.get('invoice_date')),
+        "total_amount": parse_amount(financial.get('total_amount') or header.get('total_amount')),
+        "currency": clean_value(financial.get('currency') or header.get('currency')),
+    }
+
+
+def sync_results_index(results_dir="resultjson"):
+    """Index every store entry written since the last sync; returns how many were added.
+
+    Reads the JSON Lines store from the byte offset where the previous sync stopped,
+    so the cost is proportional to new entries only.
+    """
+    migrate_legacy_results(results_dir)
+    path = master_results_path(results_dir)
+    if not os.path.exists(path):
+        return 0
+
+    conn = connect_index(results_dir)
+    try:
+        row = conn.execute("SELECT value FROM index_state WHERE key = 'store_offset'").fetchone()
+        offset = row["value"] if row else 0
+        if offset > os.path.getsize(path):
+            # Store was replaced: rebuild from scratch
+            conn.execute("DELETE FROM results")
+            offset = 0
+
+        rows = []
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            while True:
+                line = f.readline()
+                if not line or not line.endswith(b"\n"):
+                    break  # stop before a line that is still being written
+                line_offset = offset
+                offset += len(line)
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                rows.append(index_row(entry, line_offset))
+
+        with conn:
+            conn.executemany(
+                """INSERT OR REPLACE INTO results VALUES (
+                    :seq, :id, :store_offset, :processing_date, :source_filename, :vendor_name,
+                    :vendor_name_norm, :invoice_number, :vendor_gst_number, :customer_gst_number,
+                    :invoice_date, :total_amount, :currency)""",
+                rows
+            )
+            conn.execute("INSERT OR REPLACE INTO index_state VALUES ('store_offset', ?)", (offset,))
+        return len(rows)
+    finally:
+        conn.close()
+
+
+def query_results(results_dir="resultjson", vendor=None, invoice_number=None, gst_number=None,
+                  date_from=None, date_to=None, amount_min=None, amount_max=None,
+                  page=1, page_size=50):
+    """Filter indexed results; returns {"total", "page", "page_size", "items"} (newest first)"""
+    conditions = []
+    params = []
+    if vendor:
+        # Prefix match on the normalised name keeps the vendor index usable
+        prefix = vendor.strip().lower()
+        conditions.append("vendor_name_norm >= ? AND vendor_name_norm < ?")
+        params += [prefix, prefix + "\uffff"]
+    if invoice_number:
+        conditions.append("invoice_number = ?")
+        params.append(invoice_number.strip())
+    if gst_number:
+        gst_number = gst_number.strip().upper()
+        conditions.append("(vendor_gst_number = ? OR customer_gst_number = ?)")
+        params += [gst_number, gst_number]
+    if date_from:
+        conditions.append("invoice_date >= ?")
+        params.append(parse_date(date_from) or date_from)
+    if date_to:
+        conditions.append("invoice_date <= ?")
+        params.append(parse_date(date_to) or date_to)
+    if amount_min is not None:
+        conditions.append("total_amount >= ?")
+        params.append(amount_min)
+    if amount_max is not None:
+        conditions.append("total_amount <= ?")
+        params.append(amount_max)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    page = max(1, page)
+    page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+    conn = connect_index(results_dir)
+    try:
+        total = conn.execute(f"SELECT COUNT(*) FROM results {where}", params).fetchone()[0]
+        rows = conn.execute(
+            f"""SELECT seq, id, processing_date, source_filename, vendor_name, invoice_number,
+                       vendor_gst_number, customer_gst_number, invoice_date, total_amount, currency
+                FROM results {where} ORDER BY seq DESC LIMIT ? OFFSET ?""",
+            params + [page_size, (page - 1) * page_size]
+        ).fetchall()
+    finally:
+        conn.close()
+    return {
+        "total": total,
+        "page": page,
+        "page_size": page_size,
+        "items": [dict(row) for row in rows]
+    }
+
+
+def get_result_entry(result_id, results_dir="resultjson"):
+    """Full stored entry for an id, read directly at its byte offset in the store"""
+    conn = connect_index(results_dir)
+    try:
+        row = conn.execute("SELECT store_offset FROM results WHERE id = ?", (result_id,)).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    with open(master_results_path(results_dir), 'rb') as f:
+        f.seek(row["store_offset"])
+        return json.loads(f.readline())
@@ -0,0 +1,192 @@
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to the in-process lock only
+    fcntl = None
+
+# Append-only master store: one JSON entry per line, each carrying a running "seq"
+MASTER_RESULTS_FILE = "all_results.jsonl"
+# Legacy single-array file, migrated into the JSON Lines store on first use
+LEGACY_MASTER_FILE = "all_results.json"
+
+_write_lock = threading.Lock()
+
+
+def master_results_path(results_dir="resultjson"):
+    return os.path.join(results_dir, MASTER_RESULTS_FILE)
+
+
+@contextmanager
+def store_lock(results_dir="resultjson"):
+    """Serialise writers: the thread lock within this process, an exclusive flock across processes"""
+    lock_path = os.path.join(results_dir, f"{MASTER_RESULTS_FILE}.lock")
+    with _write_lock:
+        with open(lock_path, 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def iter_lines_reversed(f, block_size=4096):
+    """Yield the non-empty lines of a binary file, last first, reading it backwards in blocks"""
+    f.seek(0, os.SEEK_END)
+    position = f.tell()
+    buffer = b""
+    while position > 0:
+        step = min(block_size, position)
+        position -= step
+        f.seek(position)
+        lines = (f.read(step) + buffer).split(b"\n")
+        # The first line may go on in the block before this one
+        buffer = lines.pop(0) if position > 0 else b""
+        for line in reversed(lines):
+            if line.strip():
+                yield line
+
+
+def read_last_entry(f):
+    """The last entry that parses, scanning back past damaged lines (a torn write at the end)"""
+    for line in iter_lines_reversed(f):
+        try:
+            entry = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(entry, dict) and isinstance(entry.get("seq"), int):
+            return entry
+    return None
+
+
+def ends_with_newline(f):
+    f.seek(0, os.SEEK_END)
+    if f.tell() == 0:
+        return True
+    f.seek(-1, os.SEEK_END)
+    return f.read(1) == b"\n"
+
+
+def migrate_legacy_results(results_dir="resultjson"):
+    """Convert all_results.json (one big array) into the JSON Lines store.
+
+    Runs once, when the store does not exist yet; the legacy file is left untouched.
+    Returns the number of migrated entries.
+    """
+    legacy_path = os.path.join(results_dir, LEGACY_MASTER_FILE)
+    path = master_results_path(results_dir)
+    if os.path.exists(path) or not os.path.exists(legacy_path):
+        return 0
+    with store_lock(results_dir):
+        return _migrate_legacy_results_locked(results_dir)
+
+
+def _migrate_legacy_results_locked(results_dir):
+    legacy_path = os.path.join(results_dir, LEGACY_MASTER_FILE)
+    path = master_results_path(results_dir)
+    if os.path.exists(path) or not os.path.exists(legacy_path):
+        return 0
+
+    try:
+        with open(legacy_path, 'r', encoding='utf-8') as f:
+            legacy_results = json.load(f)
+    except (json.JSONDecodeError, OSError) as e:
+        print(f"❌ Could not migrate {legacy_path}: {e}")
+        return 0
+    if not isinstance(legacy_results, list):
+        legacy_results = [legacy_results]
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for seq, entry in enumerate(legacy_results, 1):
+            entry = dict(entry, seq=seq)
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    # Atomic: readers see either no store or the complete migrated store
+    os.replace(tmp_path, path)
+    return len(legacy_results)
+
+
+def append_result_entry(entry, results_dir="resultjson"):
+    """Append one entry to the master store in O(1); returns (store path, total entry count)"""
+    with store_lock(results_dir):
+        _migrate_legacy_results_locked(results_dir)
+        with open(master_results_path(results_dir), 'a+b') as f:
+            last_entry = read_last_entry(f)
+            seq = (last_entry or {}).get("seq", 0) + 1
+            line = (json.dumps(dict(entry, seq=seq), ensure_ascii=False) + "\n").encode("utf-8")
+            # A crash or a full disk can still leave a torn last line (fsync only makes complete
+            # writes durable): end it first, so readers skip it as one damaged line
+            if not ends_with_newline(f):
+                line = b"\n" + line
+            # Single write on an O_APPEND descriptor, so concurrent appenders never interleave
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+    return master_results_path(results_dir), seq
+
+
+def iter_result_entries(results_dir="resultjson"):
+    """Yield every stored entry, oldest first, skipping damaged lines"""
+    migrate_legacy_results(results_dir)
+    path = master_results_path(results_dir)
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+def read_recent_results(results_dir="resultjson", limit=10, block_size=65536):
+    """Return up to `limit` newest entries (newest last) by reading the end of the store only"""
+    migrate_legacy_results(results_dir)
+    path = master_results_path(results_dir)
+    if not os.path.exists(path) or limit <= 0:
+        return []
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        buffer = b""
+        while position > 0 and buffer.count(b"\n") <= limit:
+            step = min(block_size, position)
+            position -= step
+            f.seek(position)
+            buffer = f.read(step) + buffer
+    lines = buffer.split(b"\n")
+    if position > 0:
+        lines = lines[1:]  # first line may be cut in half
+    entries = []
+    for line in lines:
+        if line.strip():
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return entries[-limit:]
+
+
+def get_store_summary(results_dir="resultjson"):
+    """Entry count and latest processing date, read from the last line only"""
+    migrate_legacy_results(results_dir)
+    path = master_results_path(results_dir)
+    if not os.path.exists(path):
+        return {"total_files": 0, "latest_processing": None}
+    with open(path, 'rb') as f:
+        last_entry = read_last_entry(f) or {}
+    return {
+        "total_files": last_entry.get("seq", 0),
+        "latest_processing": last_entry.get("processing_date"),
+        "results_directory": results_dir
+    }
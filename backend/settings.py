@@ -0,0 +1,25 @@
+import os
+from dataclasses import dataclass
+
+from model_client import get_model_name
+
+# Browser origins allowed to call the API and open /ws (comma-separated)
+CORS_ORIGINS = os.getenv('CORS_ORIGINS', 'http://localhost:5173,http://localhost:3000')
+
+
+@dataclass(frozen=True)
+class Settings:
+    """App configuration, read from the environment once at startup.
+
+    Request handlers take what they need from app.state.settings instead of
+    reading files or the environment per connection.
+    """
+    model_name: str
+    cors_origins: tuple
+
+
+def load_settings():
+    return Settings(
+        model_name=get_model_name(),
+        cors_origins=tuple(origin.strip() for origin in CORS_ORIGINS.split(',') if origin.strip()),
+    )
@@ -0,0 +1,141 @@
+import os
+import cv2
+import numpy as np
+from tiling import ink_mask, max_band_height, text_line_spans
+
+# Count line-item rows on the page image and re-extract only the rows the model left out
+# (opt-in: one more OpenCV pass over every extracted page)
+TABLE_ROW_CHECK = os.getenv('TABLE_ROW_CHECK', '0') == '1'
+# Text columns a line needs to count as a table row (number, description, amounts, ...)
+MIN_TABLE_COLUMNS = 3
+# Tables with fewer rows are not checked
+MIN_TABLE_ROWS = 3
+# Rows the model may be short by before re-extraction: the column header row also looks
+# like a table row
+ROW_COUNT_TOLERANCE = 1
+# Rows repeated above each re-extracted band, to line it up with the rows already extracted
+OVERLAP_ROWS = 2
+
+
+def runs(mask):
+    """(start, end) of each run of True values in a 1-D boolean array"""
+    padded = np.concatenate(([False], mask, [False])).astype(np.int8)
+    edges = np.flatnonzero(np.diff(padded))
+    return list(zip(edges[::2], edges[1::2]))
+
+
+def column_clusters(line_ink, min_gap):
+    """Number of text blocks on one line separated by at least min_gap pixels of white"""
+    blocks = runs(np.count_nonzero(line_ink, axis=0) > 0)
+    clusters = 1 if blocks else 0
+    for (_, end), (start, _) in zip(blocks, blocks[1:]):
+        if start - end >= min_gap:
+            clusters += 1
+    return clusters
+
+
+def rule_positions(binary, kernel, rows=None):
+    """Centre coordinates of ruling lines kept by a morphological open with a long thin kernel.
+
+    rows limits the search to a (top, bottom) stretch of the page. The open runs on the whole
+    page either way, since strokes cut by a crop's edge would pass as rules.
+    """
+    lines = cv2.morphologyEx(binary, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, kernel))
+    if rows is not None:
+        lines = lines[rows[0]:rows[1]]
+    axis = 1 if kernel[0] > kernel[1] else 0
+    return [int(start + end) // 2 for start, end in runs(np.count_nonzero(lines, axis=axis) > 0)]
+
+
+def table_body(candidates, max_interruption=2):
+    """Longest stretch of candidate lines, allowing a few other lines (wrapped cells) in between"""
+    best, current, since_last = [], [], 0
+    for index, is_row in enumerate(candidates):
+        if is_row:
+            current.append(index)
+            since_last = 0
+        elif current:
+            since_last += 1
+            if since_last > max_interruption:
+                best, current = max(best, current, key=len), []
+    return max(best, current, key=len)
+
+
+def detect_table_rows(image_data):
+    """Find the line-item table on a page image and return its rows, or None if there is no table.
+
+    Text lines with at least MIN_TABLE_COLUMNS separated blocks are row candidates and the
+    longest run of them is the table body. Horizontal rules (long horizontal kernel) mark
+    row boundaries when the table is ruled, so wrapped cells stay one row; otherwise a
+    wrapped line joins the row above it. Vertical rules give the column count of a grid.
+    Returns {'rows': [(top, bottom), ...], 'columns': n, 'ruled': bool, 'width': w}.
+    """
+    gray = cv2.imdecode(np.frombuffer(image_data, np.uint8), cv2.IMREAD_GRAYSCALE)
+    if gray is None:
+        return None
+    height, width = gray.shape
+    binary = ink_mask(gray)
+    spans = text_line_spans(binary)
+    if len(spans) < MIN_TABLE_ROWS:
+        return None
+
+    line_height = float(np.median([bottom - top for top, bottom in spans]))
+    horizontal = rule_positions(binary, (max(width // 4, 1), 1))
+    # Ruling lines are removed before counting blocks, so grid borders do not join cells
+    vertical_kernel = (1, max(int(line_height * 2), 1))
+    cells = cv2.subtract(binary, cv2.morphologyEx(binary, cv2.MORPH_OPEN,
+                                                  cv2.getStructuringElement(cv2.MORPH_RECT, vertical_kernel)))
+    clusters = [column_clusters(cells[top:bottom], max(line_height, 2)) for top, bottom in spans]
+    # Titles and totals lines can have a few blocks too; rows have most of the table's columns
+    wide = [count for count in clusters if count >= MIN_TABLE_COLUMNS]
+    if not wide:
+        return None
+    min_columns = max(MIN_TABLE_COLUMNS, int(np.ceil(np.median(wide) * 0.6)))
+    body = table_body([count >= min_columns for count in clusters])
+    if len(body) < MIN_TABLE_ROWS:
+        return None
+    lines = range(body[0], body[-1] + 1)
+    body_top, body_bottom = spans[body[0]][0], spans[body[-1]][1]
+
+    # Ruled table: rows are the intervals between horizontal rules that hold a candidate line
+    inner_rules = [y for y in horizontal if body_top <= y <= body_bottom]
+    ruled = len(inner_rules) >= (len(body) - 1) // 2 and len(inner_rules) > 0
+    rows = {}
+    for index in lines:
+        top, bottom = spans[index]
+        if ruled:
+            row_id = sum(1 for y in inner_rules if y < top)
+        elif index in body:
+            row_id = index
+        else:
+            row_id = max(i for i in body if i < index)
+        if ruled and row_id not in rows and index not in body:
+            continue
+        row_top, row_bottom = rows.get(row_id, (top, bottom))
+        rows[row_id] = (min(row_top, top), max(row_bottom, bottom))
+
+    vertical = rule_positions(binary, vertical_kernel, (body_top, body_bottom + 1))
+    columns = len(vertical) - 1 if len(vertical) >= 3 else int(np.median([clusters[i] for i in body]))
+    return {'rows': [rows[row_id] for row_id in sorted(rows)], 'columns': columns, 'ruled': ruled, 'width': width}
+
+
+def missing_row_bands(table, extracted_count):
+    """(top, bottom) bands covering the rows after the first extracted_count, each small enough
+    that the model does not downscale it again, or [] when the model's count is close enough"""
+    rows = table['rows']
+    if extracted_count >= len(rows) - ROW_COUNT_TOLERANCE:
+        return []
+    start = max(0, extracted_count - OVERLAP_ROWS)
+    limit = max_band_height(table['width'])
+    bands, band_top, band_bottom = [], None, None
+    for top, bottom in rows[start:]:
+        if band_top is not None and bottom - band_top > limit:
+            bands.append((band_top, band_bottom))
+            band_top = None
+        if band_top is None:
+            band_top = top
+        band_bottom = bottom
+    bands.append((band_top, band_bottom))
+    # Pad each band into the white space around it so no glyph is clipped
+    pad = max(2, int(np.median([bottom - top for top, bottom in rows]) // 2))
+    return [(max(0, top - pad), bottom + pad) for top, bottom in bands]
@@ -0,0 +1,81 @@
+import os
+from render_policy import MIN_TEXT_LAYER_WORDS
+
+# Send born-digital pages to the model as text instead of rendered pixels
+TEXT_FAST_PATH = os.getenv('TEXT_FAST_PATH', '1') != '0'
+# Model for text-only extraction; defaults to the main extraction model
+OPENAI_TEXT_MODEL = os.getenv('OPENAI_TEXT_MODEL')
+
+# Pages whose embedded images cover more than this share are treated as scans,
+# even if they carry an (often unreliable) OCR text layer
+MAX_IMAGE_COVERAGE = 0.5
+# Share of replacement/control characters above which the text layer is garbage
+MAX_GARBLED_RATIO = 0.05
+
+
+def page_image_coverage(page):
+    """Fraction of the page area covered by embedded images"""
+    page_area = max(page.rect.width * page.rect.height, 1e-6)
+    covered = 0.0
+    for info in page.get_image_info():
+        x0, y0, x1, y1 = info["bbox"]
+        covered += max(0.0, x1 - x0) * max(0.0, y1 - y0)
+    return min(1.0, covered / page_area)
+
+
+def garbled_ratio(text):
+    """Share of characters that are unicode replacement chars or non-printable"""
+    if not text:
+        return 1.0
+    bad = sum(1 for ch in text if ch == '�' or (not ch.isprintable() and ch not in '\n\t'))
+    return bad / len(text)
+
+
+def is_text_layer_usable(page, words=None):
+    """Decide whether a PDF page's native text layer is good enough to skip the image"""
+    words = page.get_text("words") if words is None else words
+    if len(words) < MIN_TEXT_LAYER_WORDS:
+        return False
+    if garbled_ratio(" ".join(w[4] for w in words)) > MAX_GARBLED_RATIO:
+        return False
+    return page_image_coverage(page) <= MAX_IMAGE_COVERAGE
+
+
+def extract_page_layout_text(page, words=None):
+    """Rebuild the page as plain text from word boxes, keeping rows and approximate column gaps"""
+    words = page.get_text("words") if words is None else words
+    if not words:
+        return ""
+
+    # Group words into visual rows by their vertical centre
+    rows = []
+    for x0, y0, x1, y1, text, *_ in sorted(words, key=lambda w: ((w[1] + w[3]) / 2, w[0])):
+        y_mid = (y0 + y1) / 2
+        height = max(y1 - y0, 1.0)
+        if rows and abs(rows[-1]["y"] - y_mid) < height * 0.5:
+            rows[-1]["words"].append((x0, x1, text))
+        else:
+            rows.append({"y": y_mid, "words": [(x0, x1, text)]})
+
+    # Keep wide horizontal gaps visible so table columns stay apart
+    lines = []
+    for row in rows:
+        line = ""
+        last_x1 = None
+        for x0, x1, text in sorted(row["words"]):
+            if last_x1 is not None:
+                line += "   " if x0 - last_x1 > 12 else " "
+            line += text
+            last_x1 = x1
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def get_page_text(page):
+    """Layout text for the page when its text layer is usable, else None"""
+    if not TEXT_FAST_PATH:
+        return None
+    words = page.get_text("words")
+    if not is_text_layer_usable(page, words):
+        return None
+    return extract_page_layout_text(page, words)
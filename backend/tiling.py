@@ -0,0 +1,211 @@
+import os
+import cv2
+import numpy as np
+from render_policy import MODEL_MAX_DIMENSION
+
+# Split very dense pages into a header band and overlapping table-row bands,
+# each sent at a resolution the model does not have to shrink
+TILED_EXTRACTION = os.getenv('TILED_EXTRACTION', '0') == '1'
+# Text lines on a page from which it counts as dense enough to tile
+TILE_MIN_TEXT_LINES = int(os.getenv('TILE_MIN_TEXT_LINES', '50'))
+# Upper bound on tiles (= parallel model calls) per page
+MAX_TILES = int(os.getenv('MAX_TILES', '6'))
+# The model scales a high-detail image's short side down to this many pixels
+MODEL_SHORT_SIDE = 768
+# Text lines each band repeats from the band above, so no row is only ever seen cut in half
+OVERLAP_LINES = 2
+# Line items compared when de-duplicating rows that appear in two overlapping bands
+OVERLAP_WINDOW = 6
+
+
+def ink_mask(gray):
+    """Binary mask of dark strokes (text and ruling lines) on a grayscale page"""
+    return cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV, 25, 15)
+
+
+def text_line_spans(binary):
+    """(top, bottom) pixel rows of each text line, from the horizontal ink projection"""
+    # Remove ruling lines so they do not merge neighbouring rows
+    width = binary.shape[1]
+    rules = cv2.morphologyEx(binary, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (max(width // 8, 1), 1)))
+    ink = cv2.subtract(binary, rules)
+    profile = np.count_nonzero(ink, axis=1)
+    has_ink = profile > max(2, width // 400)
+
+    spans, start = [], None
+    for y, inked in enumerate(has_ink):
+        if inked and start is None:
+            start = y
+        elif not inked and start is not None:
+            spans.append((start, y))
+            start = None
+    if start is not None:
+        spans.append((start, len(has_ink)))
+    # Drop specks shorter than a quarter of a typical line
+    if spans:
+        typical = np.median([bottom - top for top, bottom in spans])
+        spans = [(top, bottom) for top, bottom in spans if bottom - top >= typical / 4]
+    return spans
+
+
+def table_top(binary, spans):
+    """Row where the line-item table starts: the first long horizontal rule, else the widest gap
+    between text lines in the top third of the page"""
+    height, width = binary.shape
+    rules = cv2.morphologyEx(binary, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (width // 2, 1)))
+    rule_rows = np.flatnonzero(np.count_nonzero(rules, axis=1))
+    rule_rows = rule_rows[(rule_rows > height * 0.05) & (rule_rows < height / 3)]
+    if len(rule_rows):
+        return int(rule_rows[0])
+
+    gaps = [(spans[i + 1][0] - spans[i][1], spans[i][1]) for i in range(len(spans) - 1)
+            if spans[i + 1][0] < height / 3]
+    if gaps:
+        return max(gaps)[1]
+    return int(height * 0.15)
+
+
+def max_band_height(width):
+    """Tallest full-width band whose short side the model keeps (no second downscale)"""
+    fit = min(1.0, MODEL_MAX_DIMENSION / width)
+    return int(MODEL_SHORT_SIDE / fit)
+
+
+def plan_tiles(image_data, min_text_lines=TILE_MIN_TEXT_LINES, max_tiles=MAX_TILES):
+    """Return [(top, bottom), ...] full-width bands for a dense page, or None if it should be sent whole.
+
+    The first band is the header (everything above the line-item table); the rest split the
+    table at gaps between text lines, each starting OVERLAP_LINES lines above the previous cut.
+    The last band ends at the bottom of the image, so bands[-1][1] is the planned image's height.
+    """
+    gray = cv2.imdecode(np.frombuffer(image_data, np.uint8), cv2.IMREAD_GRAYSCALE)
+    if gray is None:
+        return None
+    height, width = gray.shape
+    # Short pages already reach the model at full-width-band resolution
+    if height <= max_band_height(width):
+        return None
+    binary = ink_mask(gray)
+    spans = text_line_spans(binary)
+    if len(spans) < min_text_lines:
+        return None
+
+    header_bottom = table_top(binary, spans)
+    rows = [span for span in spans if span[0] >= header_bottom]
+    if not rows:
+        return None
+    band_limit = max_band_height(width)
+    band_count = min(max_tiles - 1, -(-(height - header_bottom) // band_limit))
+    if band_count < 1:
+        return None
+    rows_per_band = -(-len(rows) // band_count)
+
+    bands = [(0, header_bottom)]
+    for first in range(0, len(rows), rows_per_band):
+        start = max(0, first - OVERLAP_LINES)
+        top = rows[start][0] - 2 if start else header_bottom
+        last = min(first + rows_per_band, len(rows)) - 1
+        bottom = rows[last + 1][0] - 1 if last + 1 < len(rows) else height
+        bands.append((max(0, top), min(height, bottom)))
+    return bands
+
+
+def scale_bands(bands, planned_height, height):
+    """Bands planned on a planned_height-pixel-high render of a page, moved to a height-pixel one"""
+    scale = height / planned_height
+    return [(max(0, int(top * scale)), min(height, int(round(bottom * scale)))) for top, bottom in bands]
+
+
+def crop_bands(image_data, bands, jpg_quality=90):
+    """JPEG bytes for each (top, bottom) band of the image"""
+    image = cv2.imdecode(np.frombuffer(image_data, np.uint8), cv2.IMREAD_COLOR)
+    return encode_bands(image, bands, jpg_quality)
+
+
+def encode_bands(image, bands, jpg_quality=90):
+    tiles = []
+    for top, bottom in bands:
+        ok, encoded = cv2.imencode(".jpg", image[top:bottom], [cv2.IMWRITE_JPEG_QUALITY, jpg_quality])
+        if not ok:
+            raise ValueError("JPEG encoding failed")
+        tiles.append(encoded.tobytes())
+    return tiles
+
+
+def tile_image(image_data, bands=None, min_text_lines=TILE_MIN_TEXT_LINES, max_tiles=MAX_TILES):
+    """Return (bands, tile JPEG bytes) for a dense page, or (None, None); runs in the CPU pool.
+
+    bands already planned by plan_tiles (possibly on a lower-resolution render of the same
+    page) are scaled to image_data instead of analysing the page again.
+    """
+    if bands is None:
+        bands = plan_tiles(image_data, min_text_lines, max_tiles)
+    if not bands:
+        return None, None
+    image = cv2.imdecode(np.frombuffer(image_data, np.uint8), cv2.IMREAD_COLOR)
+    bands = scale_bands(bands, bands[-1][1], image.shape[0])
+    return bands, encode_bands(image, bands)
+
+
+def is_blank(value):
+    return value in (None, "", "N/A", [], {})
+
+
+def row_key(item):
+    """Identity of a line item for overlap de-duplication (item numbers may restart per tile)"""
+    return tuple(str(item.get(field, "")).strip().lower()
+                 for field in ('description', 'quantity', 'unit_price', 'total_price'))
+
+
+def merge_line_items(items, band_items):
+    """items followed by band_items, minus the leading band rows that repeat the tail of items"""
+    band_items = [item for item in band_items or [] if isinstance(item, dict)]
+    recent = {row_key(item) for item in items[-OVERLAP_WINDOW:]}
+    skip = 0
+    while skip < len(band_items) and row_key(band_items[skip]) in recent:
+        skip += 1
+    return items + band_items[skip:]
+
+
+def stitch_tile_results(results):
+    """Merge per-tile extractions (header tile first) into one page result.
+
+    Object sections take each field from the first tile that has a value; line items are
+    concatenated in tile order, skipping rows that repeat the tail of the previous tile.
+    """
+    results = [result for result in results if result]
+    if not results:
+        return None
+
+    merged = {}
+    items = []
+    for result in results:
+        items = merge_line_items(items, result.get('line_items'))
+
+        for section, value in result.items():
+            if section in ('line_items', 'quality_assessment'):
+                continue
+            if isinstance(value, dict):
+                target = merged.setdefault(section, {})
+                for field, field_value in value.items():
+                    if is_blank(target.get(field)) and not is_blank(field_value):
+                        target[field] = field_value
+                    else:
+                        target.setdefault(field, field_value)
+            elif is_blank(merged.get(section)):
+                merged[section] = value
+
+    # Quality: judged on the tiles that could be read; the page is too poor only if all were
+    assessments = [result.get('quality_assessment') or {} for result in results]
+    readable = [qa for qa in assessments if qa.get('can_extract_data', True)] or assessments
+    order = {'low': 0, 'medium': 1, 'high': 2}
+    merged['quality_assessment'] = {
+        'quality_too_poor': all(qa.get('quality_too_poor', False) for qa in readable),
+        'quality_issues': sorted({str(issue) for qa in readable for issue in qa.get('quality_issues') or []}),
+        'readability_score': min((str(qa.get('readability_score', 'high')).lower() for qa in readable),
+                                 key=lambda score: order.get(score, 2)),
+        'can_extract_data': any(qa.get('can_extract_data', True) for qa in assessments),
+        'preprocessing_recommended': any(qa.get('preprocessing_recommended', False) for qa in readable),
+    }
+    merged['line_items'] = items
+    return merged
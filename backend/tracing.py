@@ -0,0 +1,204 @@
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# Record a span per pipeline stage (timings feed the /metrics endpoint)
+TRACING = os.getenv('TRACING', '1') != '0'
+# Also write every finished span as one JSON line to the 'invoice.trace' logger (stderr by default)
+TRACE_LOG = os.getenv('TRACE_LOG', '1') != '0'
+
+# Histogram buckets in seconds, from a JSON parse to a slow multi-page model call
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+# Span attributes that child spans inherit, so every stage of a page can be grouped by page
+INHERITED_ATTRS = ('page',)
+
+trace_logger = logging.getLogger('invoice.trace')
+if TRACE_LOG and not trace_logger.handlers:
+    _handler = logging.StreamHandler(sys.stderr)
+    _handler.setFormatter(logging.Formatter('%(message)s'))
+    trace_logger.addHandler(_handler)
+    trace_logger.setLevel(logging.INFO)
+    trace_logger.propagate = False
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+class MetricsRegistry:
+    """Counters and histograms kept in memory and rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help = {}
+        self._counters = {}
+        self._histograms = {}
+
+    def describe(self, name, kind, help_text):
+        self._help[name] = (kind, help_text)
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            buckets, total, count = self._histograms.get(key, ([0] * len(DURATION_BUCKETS), 0.0, 0))
+            for index, bound in enumerate(DURATION_BUCKETS):
+                if value <= bound:
+                    buckets[index] += 1
+            self._histograms[key] = (buckets, total + value, count + 1)
+
+    def histogram_totals(self, name):
+        """{label values: (count, sum)} of one histogram"""
+        with self._lock:
+            return {labels: (count, total) for (metric, labels), (_, total, count) in self._histograms.items()
+                    if metric == name}
+
+    def render(self):
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: (list(buckets), total, count)
+                          for key, (buckets, total, count) in self._histograms.items()}
+        lines = []
+        for name in sorted({name for name, _ in counters} | {name for name, _ in histograms}):
+            kind, help_text = self._help.get(name, ('untyped', ''))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{format_labels(labels)} {value:g}")
+            for (metric, labels), (buckets, total, count) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                for bound, bucket_count in zip(DURATION_BUCKETS, buckets):
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', f'{bound:g}'),))} {bucket_count}")
+                lines.append(f"{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {count}")
+                lines.append(f"{name}_sum{format_labels(labels)} {total:.6f}")
+                lines.append(f"{name}_count{format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+
+metrics = MetricsRegistry()
+metrics.describe('invoice_stage_duration_seconds', 'histogram', 'Wall time per pipeline stage')
+metrics.describe('invoice_stage_errors_total', 'counter', 'Stages that raised')
+metrics.describe('invoice_stage_bytes_total', 'counter', 'Bytes handled per pipeline stage')
+metrics.describe('invoice_model_tokens_total', 'counter', 'Model tokens reported by the API')
+metrics.describe('invoice_model_attempts_total', 'counter', 'Model API attempts by outcome')
+
+
+class Span:
+    """One timed stage; attrs end up in the span's log line"""
+
+    def __init__(self, name, parent, attrs):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex[:16]
+        self.span_id = uuid.uuid4().hex[:8]
+        self.parent_id = parent.span_id if parent else None
+        self.attrs = {key: parent.attrs[key] for key in INHERITED_ATTRS if parent and key in parent.attrs}
+        self.attrs.update(attrs)
+        self.start = time.perf_counter()
+        self.duration = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+
+def finish_span(current):
+    stage = current.name
+    metrics.observe('invoice_stage_duration_seconds', current.duration, stage=stage)
+    if 'bytes' in current.attrs:
+        metrics.inc('invoice_stage_bytes_total', current.attrs['bytes'], stage=stage)
+    if 'error' in current.attrs:
+        metrics.inc('invoice_stage_errors_total', stage=stage)
+    if TRACE_LOG:
+        trace_logger.info(json.dumps({
+            'ts': round(time.time(), 3), 'trace_id': current.trace_id, 'span_id': current.span_id,
+            'parent_id': current.parent_id, 'stage': stage, 'duration_ms': round(current.duration * 1000, 2),
+            **current.attrs
+        }, default=str, ensure_ascii=False))
+
+
+@contextmanager
+def span(name, **attrs):
+    """Time the enclosed block as a stage; nested spans (also across awaits and tasks) become children"""
+    if not TRACING:
+        yield None
+        return
+    current = Span(name, _current_span.get(), attrs)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.attrs['error'] = type(e).__name__
+        raise
+    finally:
+        current.duration = time.perf_counter() - current.start
+        _current_span.reset(token)
+        finish_span(current)
+
+
+def traced(name):
+    """Decorator: run every call of a sync or async function inside span(name)"""
+    def decorate(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def annotate(**attrs):
+    """Add attributes (byte sizes, counts, ...) to the innermost open span, if any"""
+    current = _current_span.get()
+    if current is not None:
+        current.set(**attrs)
+
+
+def record_usage(model, usage):
+    """Count the token usage of one model response and attach it to the current span"""
+    if usage is None:
+        return
+    prompt_tokens = getattr(usage, 'prompt_tokens', 0) or 0
+    completion_tokens = getattr(usage, 'completion_tokens', 0) or 0
+    metrics.inc('invoice_model_tokens_total', prompt_tokens, model=model, kind='prompt')
+    metrics.inc('invoice_model_tokens_total', completion_tokens, model=model, kind='completion')
+    annotate(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+
+def count_attempt(outcome):
+    metrics.inc('invoice_model_attempts_total', outcome=outcome)
+
+
+def stage_totals():
+    """{stage: (spans, total seconds)} recorded so far"""
+    return {dict(labels)['stage']: totals
+            for labels, totals in metrics.histogram_totals('invoice_stage_duration_seconds').items()}
+
+
+def render_metrics():
+    """All metrics in the Prometheus text exposition format"""
+    return metrics.render()
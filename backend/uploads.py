@@ -0,0 +1,210 @@
+import asyncio
+import json
+import os
+import struct
+import tempfile
+import time
+import uuid
+
+from fastapi import WebSocketDisconnect
+
+from job_queue import MAX_DOCUMENT_BYTES, remove_spool_file
+
+# Largest upload accepted over /ws; larger files are refused before any bytes are sent
+MAX_UPLOAD_BYTES = int(os.getenv('MAX_UPLOAD_BYTES', str(MAX_DOCUMENT_BYTES)))
+# Chunk size the server asks clients to use (a chunk is one WebSocket frame, so keep it
+# well under uvicorn's --ws-max-size of 16 MB)
+UPLOAD_CHUNK_BYTES = int(os.getenv('UPLOAD_CHUNK_BYTES', str(1024 * 1024)))
+# Seconds an interrupted upload is kept for the client to resume
+UPLOAD_RESUME_TTL = float(os.getenv('UPLOAD_RESUME_TTL', '900'))
+# Where uploads are spooled while they arrive and while they are processed
+UPLOAD_DIR = os.getenv('UPLOAD_DIR', os.path.join(tempfile.gettempdir(), 'invoice_uploads'))
+
+# Each binary frame starts with the chunk's sequence number and byte offset (big-endian)
+CHUNK_HEADER = struct.Struct('>IQ')
+
+
+class UploadError(Exception):
+    """The client broke the upload protocol or the size cap; the message is sent back to it"""
+
+
+class PartialUpload:
+    """An upload being spooled to disk; survives the connection so it can be resumed"""
+
+    def __init__(self, upload_id, filename, size, path):
+        self.upload_id = upload_id
+        self.filename = filename
+        self.size = size
+        self.path = path
+        self.received = 0
+        self.next_seq = 0
+        self.updated = time.monotonic()
+        # Task of the connection receiving the upload, None between connections
+        self.receiver = None
+        self.taken_over = False
+        self.released = asyncio.Event()
+
+    def describe(self):
+        return {"type": "upload_ready", "upload_id": self.upload_id, "offset": self.received,
+                "seq": self.next_seq, "chunk_size": UPLOAD_CHUNK_BYTES}
+
+
+class UploadStore:
+    """Uploads in progress, by upload ID.
+
+    Kept in memory, so resuming works as long as the client reconnects to the same
+    server process within UPLOAD_RESUME_TTL seconds.
+    """
+
+    def __init__(self, directory=UPLOAD_DIR, max_bytes=MAX_UPLOAD_BYTES, ttl=UPLOAD_RESUME_TTL):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.uploads = {}
+
+    def reset(self):
+        """Drop spool files left behind by an earlier run (their uploads cannot be resumed).
+
+        Only files idle for longer than the resume TTL go, so other server processes
+        sharing the directory keep theirs.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        cutoff = time.time() - self.ttl
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                remove_spool_file(entry.path)
+
+    def start(self, filename, size, upload_id=None):
+        """Resume upload_id if it matches, else begin a new upload of size bytes"""
+        self.sweep()
+        if not isinstance(size, int) or size <= 0:
+            raise UploadError("Upload size missing or invalid")
+        if size > self.max_bytes:
+            raise UploadError(f"File is {size / 2**20:.1f} MB; the limit is {self.max_bytes / 2**20:.0f} MB")
+        upload = self.uploads.get(upload_id)
+        if upload is None or upload.filename != filename or upload.size != size:
+            upload_id = uuid.uuid4().hex
+            upload = PartialUpload(upload_id, filename, size, os.path.join(self.directory, upload_id))
+            open(upload.path, 'wb').close()
+            self.uploads[upload_id] = upload
+        upload.updated = time.monotonic()
+        return upload
+
+    async def claim(self, upload):
+        """Make the current task the receiver of upload.
+
+        A client whose connection dropped can reconnect before the server notices the old
+        connection is gone. Its receiver is then cancelled, and the new connection takes
+        over once the old one has let go of the upload (and finished any chunk write).
+        """
+        while upload.receiver is not None:
+            if not upload.taken_over:
+                upload.taken_over = True
+                upload.receiver.cancel()
+            await upload.released.wait()
+        upload.receiver = asyncio.current_task()
+        upload.released.clear()
+
+    def write(self, upload, seq, offset, data):
+        """Append one chunk; returns False for a chunk already received (resent after a reconnect)"""
+        if offset + len(data) <= upload.received and seq < upload.next_seq:
+            return False
+        if seq != upload.next_seq or offset != upload.received:
+            raise UploadError(f"Expected chunk {upload.next_seq} at offset {upload.received}, "
+                              f"got chunk {seq} at offset {offset}")
+        if upload.received + len(data) > upload.size:
+            raise UploadError("Upload is larger than announced")
+        with open(upload.path, 'ab') as f:
+            f.write(data)
+        upload.received += len(data)
+        upload.next_seq += 1
+        upload.updated = time.monotonic()
+        return True
+
+    def release(self, upload):
+        """The connection went away; keep what arrived so the client can resume"""
+        upload.receiver = None
+        upload.taken_over = False
+        upload.updated = time.monotonic()
+        upload.released.set()
+
+    def finish(self, upload):
+        """Stop tracking a complete upload; the caller owns (and must remove) its spool file"""
+        if upload.received != upload.size:
+            raise UploadError(f"Upload incomplete: {upload.received} of {upload.size} bytes")
+        self.uploads.pop(upload.upload_id, None)
+        return upload.path
+
+    def discard(self, upload):
+        self.uploads.pop(upload.upload_id, None)
+        remove_spool_file(upload.path)
+
+    def sweep(self):
+        """Remove interrupted uploads nobody resumed in time"""
+        cutoff = time.monotonic() - self.ttl
+        for upload in [u for u in self.uploads.values() if u.receiver is None and u.updated < cutoff]:
+            self.discard(upload)
+
+
+def parse_json_message(text):
+    try:
+        message = json.loads(text or '')
+    except ValueError:
+        return None
+    return message if isinstance(message, dict) else None
+
+
+def parse_upload_start(text):
+    """The upload_start request in a text frame, or None for the legacy protocol (a bare filename)"""
+    message = parse_json_message(text)
+    return message if message and message.get('type') == 'upload_start' else None
+
+
+async def receive_chunked_upload(websocket, request, store):
+    """Receive an upload announced by request into a spool file and return (filename, path).
+
+    Protocol, after the client's {"type": "upload_start", "filename", "size"[, "upload_id"]}:
+      server: {"type": "upload_ready", "upload_id", "offset", "seq", "chunk_size"}
+      client: binary frames, CHUNK_HEADER (seq, offset) + up to chunk_size bytes,
+              starting at the offset and sequence number the server asked for
+      server: {"type": "upload_ack", "seq", "offset"} after each chunk is on disk
+      client: {"type": "upload_end", "upload_id"} once every byte is acknowledged
+    A client that lost the connection reconnects with the same upload_id and carries on
+    from the offset in upload_ready, even if this server still thinks the old connection
+    is open (it is taken over, and ends as a disconnect). Protocol errors are sent as
+    {"type": "upload_error"} and end the connection; the partial upload is kept for a retry.
+    """
+    filename = os.path.basename(str(request.get('filename') or 'upload'))
+    upload = store.start(filename, request.get('size'), request.get('upload_id'))
+    await store.claim(upload)
+    writing = None
+    try:
+        await websocket.send_text(json.dumps(upload.describe()))
+        while True:
+            message = await websocket.receive()
+            if message['type'] == 'websocket.disconnect':
+                raise WebSocketDisconnect(message.get('code', 1000))
+            if message.get('bytes') is not None:
+                frame = message['bytes']
+                if len(frame) < CHUNK_HEADER.size or len(frame) - CHUNK_HEADER.size > UPLOAD_CHUNK_BYTES:
+                    raise UploadError("Malformed or oversized chunk")
+                seq, offset = CHUNK_HEADER.unpack_from(frame)
+                data = memoryview(frame)[CHUNK_HEADER.size:]
+                # Shielded: the write must not be abandoned halfway if the upload is taken over
+                writing = asyncio.ensure_future(asyncio.to_thread(store.write, upload, seq, offset, data))
+                await asyncio.shield(writing)
+                await websocket.send_text(json.dumps({"type": "upload_ack", "seq": seq, "offset": upload.received}))
+            elif (parse_json_message(message.get('text')) or {}).get('type') == 'upload_end':
+                path = store.finish(upload)
+                return filename, path
+            else:
+                raise UploadError("Expected a chunk or upload_end")
+    except asyncio.CancelledError:
+        if not upload.taken_over:
+            raise
+        # The client resumed the upload on a new connection; this one is stale
+        raise WebSocketDisconnect(1001) from None
+    finally:
+        if writing is not None and not writing.done():
+            await asyncio.wait({writing})
+        store.release(upload)
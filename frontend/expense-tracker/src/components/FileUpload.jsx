@@ -2,6 +2,32 @@ import React, { useState, useEffect, useRef } from "react";
 import { FileImage, X } from "lucide-react";
 import "./FileUpload.css";
 
+const WS_URL = 'ws://localhost:8000/ws';
+// Must match the server (uploads.py): chunk frames start with a uint32 sequence number
+// and a uint64 byte offset, and files over MAX_UPLOAD_BYTES are refused
+const CHUNK_HEADER_BYTES = 12;
+const MAX_UPLOAD_BYTES = 100 * 1024 * 1024;
+// Chunks sent ahead of their acknowledgement
+const UPLOAD_WINDOW = 8;
+// Reconnects before an interrupted upload is given up
+const MAX_UPLOAD_RETRIES = 5;
+
+// Merge the per-page drafts of streamed sections, in page order: line items from
+// every page, other sections from the first page that has them
+const combinePartialDrafts = (pages) => {
+    const combined = {};
+    Object.keys(pages).map(Number).sort((a, b) => a - b).forEach((pageNumber) => {
+        Object.entries(pages[pageNumber].draft).forEach(([section, data]) => {
+            if (Array.isArray(data)) {
+                combined[section] = [...(combined[section] || []), ...data];
+            } else if (!(section in combined)) {
+                combined[section] = data;
+            }
+        });
+    });
+    return combined;
+};
+
 // Message component to display each status as a block
 const StatusMessage = ({ message, type }) => {
     let messageStyle = '';
@@ -32,8 +58,11 @@ const FileUpload = ({ onFileSelect, setResult }) => {
     const [imagePreview, setImagePreview] = useState(null);
     const [isProcessing, setIsProcessing] = useState(false);
     const [statusMessages, setStatusMessages] = useState([]);
+    const [uploadProgress, setUploadProgress] = useState(null);
     const [socket, setSocket] = useState(null);
     const fileInputRef = useRef(null);
+    // Sections streamed in before the final result arrives, by page: { page_number: { attempt, draft } }
+    const partialRef = useRef({});
 
     useEffect(() => {
     }, []);
@@ -42,90 +71,190 @@ const FileUpload = ({ onFileSelect, setResult }) => {
         setFile(e.target.files[0]);
     };
 
-    const handleUpload = async () => {
-        if (!file) return;
-
-        setStatusMessages([]);
-        setIsProcessing(true);
+    const handleServerMessage = (event) => {
+        let parsed = null;
+        let finished = null
+        try {
+            parsed = JSON.parse(event.data);
+        } catch {
+            parsed = null;
+        }
 
-        const ws = new WebSocket('ws://localhost:8000/ws');
+        if (parsed) {
+            let result = null;
 
-        ws.onopen = () => {
-            ws.send(file.name);
-            ws.send(file);
-        };
-        ws.onmessage = (event) => {
-            let parsed = null;
-            let finished = null
+            // If it's valid JSON, parse and display
+            const messageData = parsed
             try {
-                parsed = JSON.parse(event.data);
-            } catch {
-                parsed = null;
+                result = messageData.result;
             }
-
-            if (parsed) {
-                let result = null;
-
-                // If it's valid JSON, parse and display
-                const messageData = parsed
-                try {
-                    result = messageData.result;
-                }
-                catch {
-                    result = null;
-                }
-                if (result) {
-                    console.log("result", result.text);
-                    let parsedResult = result.text;
-                    // If it's a stringified JSON, parse it
-                    if (typeof parsedResult === "string") {
-                        try {
-                            parsedResult = JSON.parse(parsedResult);
-                        } catch (e) {
-                            console.error("Failed to parse result.text", e);
-                        }
+            catch {
+                result = null;
+            }
+            if (result) {
+                console.log("result", result.text);
+                let parsedResult = result.text;
+                // If it's a stringified JSON, parse it
+                if (typeof parsedResult === "string") {
+                    try {
+                        parsedResult = JSON.parse(parsedResult);
+                    } catch (e) {
+                        console.error("Failed to parse result.text", e);
                     }
-                    setResult(parsedResult);
-                }
-                else if (messageData.message && messageData.type) {
-                    console.log(messageData)
-                    const { message, type } = messageData;
-                    setStatusMessages((prevMessages) => [
-                        ...prevMessages,
-                        { message, type },
-                    ]);
                 }
-                try {
-                    finished = messageData.finished;
+                setResult(parsedResult);
+            }
+            else if (messageData.partial) {
+                // Show each section as soon as the model finishes it; the final result replaces this
+                const { page_number, attempt, section, index, data } = messageData.partial;
+                const pages = partialRef.current;
+                const page = pages[page_number];
+                // A retry of the page (enhanced or re-rendered image) starts its draft over
+                if (!page || attempt > page.attempt) {
+                    pages[page_number] = { attempt, draft: {} };
+                } else if (attempt < page.attempt) {
+                    return;
                 }
-                catch {
-                    finished = null;
+                const draft = pages[page_number].draft;
+                if (index !== null && index !== undefined) {
+                    draft[section] = [...(draft[section] || []), data];
+                } else {
+                    draft[section] = data;
                 }
-                if (finished) {
-                    setIsProcessing(false);
-                }
-            } else {
-                // If it's not valid JSON, treat it as plain text (info type by default)
+                const combined = combinePartialDrafts(pages);
+                setResult({ extraction_data: { ...combined, combined_data: { ...combined } }, partial: true });
+            }
+            else if (messageData.message && messageData.type) {
+                console.log(messageData)
+                const { message, type } = messageData;
                 setStatusMessages((prevMessages) => [
                     ...prevMessages,
-                    { message: event.data, type: 'info' },
+                    { message, type },
                 ]);
             }
-        };
-        // Handle WebSocket closure
-        ws.onclose = () => {
-            console.log('WebSocket connection closed');
-        };
+            try {
+                finished = messageData.finished;
+            }
+            catch {
+                finished = null;
+            }
+            if (finished) {
+                setIsProcessing(false);
+            }
+        } else {
+            // If it's not valid JSON, treat it as plain text (info type by default)
+            setStatusMessages((prevMessages) => [
+                ...prevMessages,
+                { message: event.data, type: 'info' },
+            ]);
+        }
+    };
 
-        setSocket(ws);
+    const addStatus = (message, type) => {
+        setStatusMessages((prevMessages) => [...prevMessages, { message, type }]);
+    };
 
-        // Cleanup WebSocket when component unmounts
-        return () => {
-            if (ws) ws.close();
-        };
+    const handleUpload = async () => {
+        if (!file) return;
 
+        setStatusMessages([]);
+        partialRef.current = {};
+        if (file.size > MAX_UPLOAD_BYTES) {
+            addStatus(`File is too large (limit ${MAX_UPLOAD_BYTES / (1024 * 1024)} MB)`, 'error');
+            return;
+        }
+        setIsProcessing(true);
+        setUploadProgress(0);
+
+        // Survives reconnects, so an interrupted upload resumes where the server says it stopped
+        const upload = { id: null, retries: 0, sent: false, failed: false };
+
+        const connect = () => {
+            const ws = new WebSocket(WS_URL);
+            let nextOffset = 0;
+            let nextSeq = 0;
+            let chunkSize = 0;
+            let inFlight = 0;
+            let pumping = false;
+
+            // Send chunks until UPLOAD_WINDOW are unacknowledged, then upload_end once all are
+            const pump = async () => {
+                if (pumping || upload.sent) return;
+                pumping = true;
+                while (nextOffset < file.size && inFlight < UPLOAD_WINDOW && ws.readyState === WebSocket.OPEN) {
+                    const offset = nextOffset;
+                    const seq = nextSeq;
+                    const end = Math.min(offset + chunkSize, file.size);
+                    nextOffset = end;
+                    nextSeq += 1;
+                    inFlight += 1;
+                    const body = await file.slice(offset, end).arrayBuffer();
+                    const frame = new Uint8Array(CHUNK_HEADER_BYTES + body.byteLength);
+                    const header = new DataView(frame.buffer);
+                    header.setUint32(0, seq);
+                    header.setBigUint64(4, BigInt(offset));
+                    frame.set(new Uint8Array(body), CHUNK_HEADER_BYTES);
+                    ws.send(frame);
+                }
+                pumping = false;
+                if (nextOffset >= file.size && inFlight === 0 && ws.readyState === WebSocket.OPEN) {
+                    upload.sent = true;
+                    ws.send(JSON.stringify({ type: 'upload_end', upload_id: upload.id }));
+                }
+            };
+
+            ws.onopen = () => {
+                ws.send(JSON.stringify({ type: 'upload_start', filename: file.name, size: file.size, upload_id: upload.id }));
+            };
+            ws.onmessage = (event) => {
+                let parsed = null;
+                try {
+                    parsed = JSON.parse(event.data);
+                } catch {
+                    parsed = null;
+                }
+                const uploadMessage = parsed && typeof parsed.type === 'string' && parsed.type.startsWith('upload_');
+                if (!uploadMessage) {
+                    handleServerMessage(event);
+                    return;
+                }
+                if (parsed.type === 'upload_ready') {
+                    if (upload.id && parsed.offset > 0) {
+                        addStatus(`Resuming upload at ${Math.round(parsed.offset * 100 / file.size)}%`, 'info');
+                    }
+                    upload.id = parsed.upload_id;
+                    nextOffset = parsed.offset;
+                    nextSeq = parsed.seq;
+                    chunkSize = parsed.chunk_size;
+                    pump();
+                } else if (parsed.type === 'upload_ack') {
+                    inFlight -= 1;
+                    setUploadProgress(Math.round(parsed.offset * 100 / file.size));
+                    pump();
+                } else if (parsed.type === 'upload_error') {
+                    upload.failed = true;
+                    addStatus(parsed.message, 'error');
+                    setIsProcessing(false);
+                }
+            };
+            // Handle WebSocket closure; reconnect if the upload itself was cut off
+            ws.onclose = () => {
+                console.log('WebSocket connection closed');
+                if (upload.sent || upload.failed) return;
+                if (upload.retries >= MAX_UPLOAD_RETRIES) {
+                    addStatus('Upload failed: connection lost', 'error');
+                    setIsProcessing(false);
+                    return;
+                }
+                upload.retries += 1;
+                addStatus('Connection lost, reconnecting...', 'info');
+                setTimeout(connect, 1000 * upload.retries);
+            };
+
+            setSocket(ws);
+        };
 
-        // You can listen to further updates from the backend in real-time
+        connect();
     };
     // Handle file upload
     const handleFileUpload = (event) => {
@@ -218,7 +347,7 @@ const FileUpload = ({ onFileSelect, setResult }) => {
                     </button>
                 </div>
                 <p className="file-info">
-                    Limit 200MB per file • PNG, JPG, JPEG, TIFF, TIF, PDF
+                    Limit 100MB per file • PNG, JPG, JPEG, TIFF, TIF, PDF
                 </p>
 
                 {file && (
@@ -246,7 +375,11 @@ const FileUpload = ({ onFileSelect, setResult }) => {
                         {/* Process Invoice Button */}
                         <div className="process-btn-wrapper">
                             <button className="process-btn" onClick={handleUpload} disabled={isProcessing}>
-                                {isProcessing ? 'Processing...' : 'Upload and Process'}
+                                {!isProcessing
+                                    ? 'Upload and Process'
+                                    : uploadProgress !== null && uploadProgress < 100
+                                        ? `Uploading ${uploadProgress}%...`
+                                        : 'Processing...'}
                             </button>
                         </div>
                     </div>